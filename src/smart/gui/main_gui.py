@@ -105,6 +105,8 @@ class smartGui(
             self.img_backup_path = self.settings_object["FileManager"]["restoreimagedb"]
 
         self.imageBuffer = ImageBufferInfo(self, self.img_backup_path)
+        self.imageBuffer.progressUpdate_sig.connect(self.progressUpdate)
+        self.imageBuffer.statusMessage_sig.connect(self.statusUpdate)
         self.tbl_render_order.imageBuffer = self.imageBuffer
 
         self.imageBuffer.recallImgBackup()
@@ -246,6 +248,8 @@ class smartGui(
             self.img_backup_path = self.settings_object["FileManager"]["restoreimagedb"]
 
         self.imageBuffer = ImageBufferInfo(self, self.img_backup_path)
+        self.imageBuffer.progressUpdate_sig.connect(self.progressUpdate)
+        self.imageBuffer.statusMessage_sig.connect(self.statusUpdate)
         self.tbl_render_order.imageBuffer = self.imageBuffer
 
         # // draw scalebar
@@ -639,6 +643,7 @@ class smartGui(
         self.bt_clear_tbl.setText("Clear workspace")
         self.bt_clear_tbl.clicked.connect(self.clear)
         self.tbl_render_order.cellClicked.connect(self.tblItemClicked)
+        self.tbl_render_order.itemClicked.connect(self.on_table_order_clicked)
 
         self.bt_imageMenu.setMenu(QtWidgets.QMenu(self.bt_imageMenu))
         self.bt_imageMenu.clicked.connect(self.bt_imageMenu.showMenu)
@@ -710,6 +715,23 @@ class smartGui(
         self.bt_import_image.setIconSize(QtCore.QSize(32, 32))
         self.bt_import_image.clicked.connect(lambda: self.import_image_from_disk())
 
+        self.bt_export_mosaic = QtWidgets.QPushButton(self)
+        action = QtWidgets.QWidgetAction(self.bt_imageMenu)
+        action.setDefaultWidget(self.bt_export_mosaic)
+        self.bt_imageMenu.menu().addAction(action)
+        icon1 = QtGui.QIcon()
+        icon1.addPixmap(
+            QtGui.QPixmap(
+                str(ui_file_folder / "icons" / "FileSystem" / "save_as_128x128.png")
+            ),
+            QtGui.QIcon.Normal,
+            QtGui.QIcon.Off,
+        )
+        self.bt_export_mosaic.setIcon(icon1)
+        self.bt_export_mosaic.setText("Export stitched mosaic")
+        self.bt_export_mosaic.setIconSize(QtCore.QSize(32, 32))
+        self.bt_export_mosaic.clicked.connect(self.exportMosaic)
+
     def expand_full(self):
         self.mdi_field_widget.autoRange()
 
@@ -778,6 +800,7 @@ class smartGui(
             )
 
         if len(source_path_list) > 0:
+            entries = []
             for filePath in source_path_list:
                 if not os.path.exists(filePath):
                     continue
@@ -801,7 +824,9 @@ class smartGui(
                     if ret:
                         d.update(ret)
 
-                self.imageBuffer.load_qi(d)
+                entries.append((d, None))
+            # // decode all files in parallel and add them to the field in one batch
+            self.imageBuffer.load_qi_batch(entries)
 
             self.settings_object["FileManager"]["currentimagedbDir"] = os.path.dirname(
                 source_path_list[0]
@@ -871,6 +896,38 @@ class smartGui(
                 self, "Error", """<p>Invalid export path.<p>"""
             )
 
+    def exportMosaic(self):
+        # // stitch the visible images into one tiled tiff/hdf5 file, written in the background
+        import os
+
+        # // clicking again while it runs aborts it, the worker stops after the tile in flight
+        if self.imageBuffer.export_running():
+            self.imageBuffer.abort_export(wait=False)
+            self.statusbar.showMessage("Aborting the mosaic export ...")
+            return
+        dialog = QtWidgets.QFileDialog()
+        path = QtCore.QDir.toNativeSeparators(
+            self.settings_object["FileManager"]["currentimagedbDir"]
+        )
+        mosaic_path, _ = dialog.getSaveFileName(
+            self,
+            "Export stitched mosaic",
+            path if os.path.exists(path) else os.getcwd(),
+            "Tiled tiff (*.tif *.tiff);;HDF5 (*.h5 *.hdf5)",
+        )
+        if not mosaic_path:
+            return
+        if os.path.exists(os.path.dirname(mosaic_path)):
+            self.imageBuffer.export_mosaic(mosaic_path)
+            if self.imageBuffer.export_running():
+                self.bt_export_mosaic.setText("Abort mosaic export")
+                self.imageBuffer.export_thread.finished.connect(
+                    lambda: self.bt_export_mosaic.setText("Export stitched mosaic"))
+        else:
+            QtWidgets.QMessageBox.critical(
+                self, "Error", """<p>Invalid export path.<p>"""
+            )
+
     def draw_scalebar(self):
         """
         Draw a scalebar
@@ -938,6 +995,7 @@ class smartGui(
             # // delete image from the buffer
             if isinstance(self.field_img[i], ImageBufferObject):
                 self.imageBuffer.removeImgBackup(item.loc)
+                self.imageBuffer.residency.forget(self.field_img[i])
             # // untick the image in the pipeline
             elif isinstance(self.field_img[i], pg.ImageItem):
                 self.clearSingleTick.emit(item.loc)
@@ -957,11 +1015,17 @@ class smartGui(
         Clear the workspace by removing all images.
         :return:
         """
+        # // stop the background work on the images: decoding, mosaic export and batch registration
+        self.imageBuffer.abort_decoding()
+        self.imageBuffer.abort_export()
+        self.abort_batch_registration()
         # // clear internal list
         self.field.clear()
         # // alternative is to delete all items in the field view
         for img in self.field_img:
             self.field.removeItem(img)
+            if isinstance(img, ImageBufferObject):
+                self.imageBuffer.residency.forget(img)
             img.deleteLater()
 
         self.field_list = []
@@ -1080,6 +1144,14 @@ class smartGui(
             else:
                 event.accept()
             self.camara_widget.thread_period_timer_forceRead.quit()
+            # // the particle locate workers are kept alive between calls
+            from smart.util.particle_locate import shutdown_locate_pools
+            shutdown_locate_pools()
+            self.imageBuffer.abort_export()
+            self.abort_batch_registration()
+            # // a particle preview takes a fraction of a second, let it finish instead of destroying its thread
+            if self.preview_thread is not None:
+                self.preview_thread.wait()
             # self._disconnect_zmq_server()
             self.zmq_listener_thread.quit()
             if hasattr(self, 'widget_spock'):
@@ -296,16 +296,17 @@ class beamlineControl(object):
     def show_all_rois(self):
         for each in self.camara_widget.rois:
             self.camara_widget.img_viewer.vb.removeItem(each)
+        # // stage positions are read once for all rois
+        to_pix = self.camara_widget.stage_to_pix_transform()
         for i in range(self.pandas_model_queue_camara_viewer._data.shape[0]):
             cmd = self.pandas_model_queue_camara_viewer._data.iloc[i,:]['scan_command']
             scan_roi_ref = self._compute_scan_roi_ref_origin(eval(self.pandas_model_queue_camara_viewer._data.iloc[i,:]['pre_scan_action']))
-            scan_roi_ref_pix = self.camara_widget._convert_stage_coord_to_pix_unit(*scan_roi_ref)
+            scan_roi_ref_pix = to_pix.map(scan_roi_ref)
             if cmd.startswith('pmesh'):
-                anchors_list = re.findall(r"(\[[-+]?(?:\d*\.*\d+) [-+]?(?:\d*\.*\d+)\])", self.pandas_model_queue_camara_viewer._data.iloc[i,:]['scan_command'])
-                anchors_list = [self.camara_widget._convert_stage_coord_to_pix_unit(*eval(each.replace(' ', ','))) for each in anchors_list]
+                anchors_list = to_pix.map(self._parse_pmesh_anchors(cmd))
                 # anchors_list = [np.array(each)/1000+scan_roi_ref_pix for each in anchors_list]
                 if self.settings_object['ScanType']['two_set_of_stage']:
-                    anchors_list = [np.array(each)+self.camara_widget._convert_stage_coord_to_pix_unit(*scan_roi_ref) for each in anchors_list]
+                    anchors_list = anchors_list + scan_roi_ref_pix
                 else:
                     pass
                 #anchors_list = [np.array(each)+scan_roi_ref_pix for each in anchors_list]
@@ -323,8 +324,7 @@ class beamlineControl(object):
                 x_, y_ = float(scan_cmd_list[2]), float(scan_cmd_list[6])
                 x_end_, y_end_ = float(scan_cmd_list[3]), float(scan_cmd_list[7])
                 #self.camara_widget.roi_scan_xy_stage = [x_, y_]
-                x, y = self.camara_widget._convert_stage_coord_to_pix_unit(x_, y_)
-                x_end, y_end = self.camara_widget._convert_stage_coord_to_pix_unit(x_end_, y_end_)
+                (x, y), (x_end, y_end) = to_pix.map([[x_, y_], [x_end_, y_end_]])
                 w, h = abs(x - x_end), abs(y - y_end)                     
                 pen = pg.mkPen((0, 200, 200), width=1)
                 roi = pg.ROI(scan_roi_ref_pix, [w, h], pen=pen)
@@ -341,6 +341,10 @@ class beamlineControl(object):
         row = modelindex.row()
         self.update_roi_at_row(row)
 
+    def _parse_pmesh_anchors(self, scan_command):
+        # // anchors of a pmesh command, '[x y]' pairs, as a N x 2 array of stage coordinates
+        return np.array(re.findall(r"\[([-+]?\d*\.*\d+) ([-+]?\d*\.*\d+)\]", scan_command), dtype=float).reshape(-1, 2)
+
     def _compute_scan_roi_ref_origin(self, pre_scan_action_list):
         assert type(pre_scan_action_list)==list, 'pre scan action not in a list format'
         assert len(pre_scan_action_list)==2, 'two items should be in pre scan action list'
@@ -352,12 +356,12 @@ class beamlineControl(object):
         self.camara_widget.setPaused(True)
         scan_cmd_list = self.pandas_model_queue_camara_viewer._data.iloc[row,:]['scan_command'].rsplit(' ')
         scan_roi_ref = self._compute_scan_roi_ref_origin(eval(self.pandas_model_queue_camara_viewer._data.iloc[row,:]['pre_scan_action']))
+        to_pix = self.camara_widget.stage_to_pix_transform()
         if scan_cmd_list[0]=='pmesh':
-            anchors_list = re.findall(r"(\[[-+]?(?:\d*\.*\d+) [-+]?(?:\d*\.*\d+)\])", self.pandas_model_queue_camara_viewer._data.iloc[row,:]['scan_command'])
-            anchors_list = [self.camara_widget._convert_stage_coord_to_pix_unit(*eval(each.replace(' ', ','))) for each in anchors_list]
+            anchors_list = to_pix.map(self._parse_pmesh_anchors(self.pandas_model_queue_camara_viewer._data.iloc[row,:]['scan_command']))
             #scan_roi_ref_ = scan_roi_ref if self.settings_object['ScanType']['two_set_of_stage'] else [0,0]
             if self.settings_object['ScanType']['two_set_of_stage']:
-                anchors_list = [np.array(each)+self.camara_widget._convert_stage_coord_to_pix_unit(*scan_roi_ref) for each in anchors_list]
+                anchors_list = anchors_list + to_pix.map(scan_roi_ref)
             else:
                 pass
             # anchors_list = [np.array(each)/1000+self.camara_widget._convert_stage_coord_to_pix_unit(*scan_roi_ref) for each in anchors_list]
@@ -388,10 +392,8 @@ class beamlineControl(object):
             x_end_, y_end_ = float(scan_cmd_list[3]), float(scan_cmd_list[7])
             self.camara_widget.roi_scan_xy_stage = scan_roi_ref
             # x, y = self.camara_widget._convert_stage_coord_to_pix_unit(x_/1000, y_/1000)
-            x, y = self.camara_widget._convert_stage_coord_to_pix_unit(x_, y_)
-            x_ref, y_ref = self.camara_widget._convert_stage_coord_to_pix_unit(*scan_roi_ref)
             # x_end, y_end = self.camara_widget._convert_stage_coord_to_pix_unit(x_end_/1000, y_end_/1000)
-            x_end, y_end = self.camara_widget._convert_stage_coord_to_pix_unit(x_end_, y_end_)
+            (x, y), (x_ref, y_ref), (x_end, y_end) = to_pix.map([[x_, y_], scan_roi_ref, [x_end_, y_end_]])
             w, h = abs(x - x_end), abs(y - y_end)
             if type(self.camara_widget.roi_scan)==pg.PolyLineROI:
                 self.camara_widget.roi_type = 'rectangle'
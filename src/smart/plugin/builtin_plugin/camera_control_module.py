@@ -23,6 +23,7 @@ from functools import partial
 import numpy as np
 from smart import icon_path
 from ...util.util import findMainWindow, trigger, get_folder
+from ...util.geometry_transformation import CoordinateTransform
 
 # timer_trigger = trigger(timeout=0.1)
 
@@ -879,13 +880,23 @@ class TaurusImageItem(GraphicsLayoutWidget, TaurusBaseComponent):
         pos = (np.array([original_samx, original_samy]) - [samx, samy])/main_gui.camara_pixel_size*[1,-1] + [main_gui.camara_widget.isoLine_v.value(),main_gui.camara_widget.isoLine_h.value()]
         return pos
     
-    def _convert_stage_coord_to_pix_unit(self, original_samx, original_samy):
+    def stage_to_pix_transform(self):
+        """
+        Transform from stage coordinates to camera pixels at the current stage position. The stage positions are read
+        once, map the returned transform over all points instead of converting them one by one.
+        :return: CoordinateTransform
+        """
         main_gui = findMainWindow()
         samx = Attribute(main_gui.settings_object["SampleStages"]["x_stage_value"]).read().value
         samy = Attribute(main_gui.settings_object["SampleStages"]["y_stage_value"]).read().value
         pstage_offset = np.array(list(self._cal_pstage_offset_wrt_prim_beam()))
-        pos = (np.array([original_samx, original_samy]) - [samx, samy] - pstage_offset)/main_gui.camara_pixel_size*[1,-1] + [main_gui.camara_widget.isoLine_v.value(),main_gui.camara_widget.isoLine_h.value()]
-        return pos
+        ps = main_gui.camara_pixel_size
+        return CoordinateTransform.from_components(scale=(1 / ps, -1 / ps),
+                                                   translation=(main_gui.camara_widget.isoLine_v.value(), main_gui.camara_widget.isoLine_h.value()),
+                                                   offset=np.array([samx, samy]) + pstage_offset)
+
+    def _convert_stage_coord_to_pix_unit(self, original_samx, original_samy):
+        return self.stage_to_pix_transform().map([original_samx, original_samy])
     
     def update_stage_pos_at_prim_beam(self, infline_obj = None, dir='x'):
         main_gui = findMainWindow()
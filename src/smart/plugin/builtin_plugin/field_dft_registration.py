@@ -8,7 +8,12 @@ import numpy as np
 import pandas as pd
 import copy
 import math
-from smart.util.geometry_transformation import rotatePoint
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from smart.util.geometry_transformation import rotatePoint, warp_img_dict, PhaseCorrelationRegistration
+from smart.resource.database_tool.registration_cache import RegistrationCache
+from smart.resource.database_tool.image_buffer import ImageBufferObject
 from smart.util.util import get_stage_coords_from_tif_file_from_p06_desy
 from PyQt5.QtWidgets import  QAbstractItemView
 from PyQt5 import QtGui, QtCore, QtWidgets, uic
@@ -107,6 +112,50 @@ def mdi_field_imreg_show(self):
     self.mdi_field_registration_widget.show()
     self.mdi_field_registration_widget.exec_()
 
+class RegistrationDebugSink(object):
+    """
+    Opt-in collector of the intermediate frames and per-stage timings of a registration (ImageRegistration/debug).
+    Everything is kept in memory, files are only written by an explicit call of save.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.frames = OrderedDict()
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - t0
+
+    def capture(self, name, frame):
+        self.frames[name] = np.array(frame, copy=True)
+
+    def report(self):
+        return [f'{name}: {t * 1000:.1f} ms' for name, t in self.timings.items()]
+
+    def save(self, folder):
+        for name, frame in self.frames.items():
+            cv2.imwrite(os.path.join(folder, f'{name}.jpg'), frame)
+
+
+class _NullDebugSink(object):
+    # // default sink, registration neither times stages nor keeps copies of the frames
+    enabled = False
+
+    def stage(self, name):
+        return nullcontext()
+
+    def capture(self, name, frame):
+        pass
+
+    def report(self):
+        return []
+
+
 class DFTRegistration(QtCore.QObject):
 
     sig_dft_finished = QtCore.pyqtSignal(object)
@@ -116,20 +165,126 @@ class DFTRegistration(QtCore.QObject):
         super().__init__()
         self.reference_sub_frame = None
         self.target_zoom_frame = None
+        self.settings = {}
+        self._translation_registration = None
+        self.cache = None
+        self.debug = _NullDebugSink()
 
-    def prepare_dft(self, reference, target):
+    def prepare_dft(self, reference, target, settings=None, debug=None):
+        """
+        :param debug: optional RegistrationDebugSink
+        :param settings: the ImageRegistration section of the app settings, dft_mode is one of
+        'single' (one imreg_dft pass at full resolution, the default), 'pyramid' (coarse-to-fine), 'translation' (sub-pixel phase
+        correlation, scale and rotation fixed), 'features' (ORB/AKAZE keypoints and RANSAC, for little overlap or
+        different contrast) or 'auto' (translation if a coarse check finds no rotation/scaling, pyramid otherwise)
+        """
         self.reference_sub_frame = reference
         self.target_zoom_frame = target
+        self.settings = settings or {}
+        self.debug = debug or _NullDebugSink()
+        if self.cache is None and self.settings.get('use_registration_cache', True):
+            cache_dir = self.settings.get('registration_cache_dir', '') or \
+                        os.path.join(os.path.expanduser('~'), '.smart', 'registration_cache')
+            try:
+                self.cache = RegistrationCache(cache_dir, max_entries=int(self.settings.get('registration_cache_entries', 1000)))
+            except OSError:
+                QtCore.qDebug(f"Registration cache disabled, cannot create {cache_dir}")
+
+    def registration_params(self, mode):
+        # // everything besides the two frames which changes the registration result
+        params = {'dft_mode': mode, 'iterations': 5}
+        if mode in ('pyramid', 'auto'):
+            params.update(pyramid_min_size=int(self.settings.get('pyramid_min_size', 256)),
+                          pyramid_max_similarity_size=int(self.settings.get('pyramid_max_similarity_size', 1024)))
+        if mode in ('translation', 'auto'):
+            params.update(upsample_factor=int(self.settings.get('upsample_factor', 20)))
+        if mode == 'features':
+            params.update(self.feature_params())
+        return params
+
+    def feature_params(self):
+        return {'feature_detector': self.settings.get('feature_detector', 'orb'),
+                'feature_max_size': int(self.settings.get('feature_max_size', 1024))}
+
+    def register_translation(self, reference, target):
+        # // the fft of the reference is kept as long as the reference does not change, e.g. while dragging the target
+        if self._translation_registration is None or not self._translation_registration.matches_reference(reference):
+            self._translation_registration = PhaseCorrelationRegistration(reference)
+        self._translation_registration.upsample_factor = int(self.settings.get('upsample_factor', 20))
+        return self._translation_registration.register(target)
 
     def perform_dft(self):
-        from smart.util.geometry_transformation import registration_dft_slice
+        from smart.util.geometry_transformation import register_frames, is_translation_only
         self.sig_dft_status.emit('Start DFT registration..')
-        vector_dict = registration_dft_slice(self.reference_sub_frame, self.target_zoom_frame, iterations=5, \
-                                                display=False,  progressbar=None,
-                                                display_window=None)
+        mode = self.settings.get('dft_mode', 'single')
+        key = None
+        if self.cache is not None and self.settings.get('use_registration_cache', True):
+            params = self.registration_params(mode)
+            with self.debug.stage('cache lookup'):
+                key = self.cache.key(self.reference_sub_frame, self.target_zoom_frame, params)
+                vector_dict = self.cache.get(key)
+            if vector_dict is not None:
+                self.sig_dft_status.emit('DFT registration result taken from the cache!')
+                self.sig_dft_finished.emit(vector_dict)
+                return
+        if mode == 'auto':
+            with self.debug.stage('mode detection'):
+                mode = 'translation' if is_translation_only(self.reference_sub_frame, self.target_zoom_frame) else 'pyramid'
+        with self.debug.stage(f'registration ({mode})'):
+            if mode == 'translation':
+                vector_dict = self.register_translation(self.reference_sub_frame, self.target_zoom_frame)
+            else:
+                vector_dict = register_frames(self.reference_sub_frame, self.target_zoom_frame, mode=mode, iterations=5,
+                                              min_size=int(self.settings.get('pyramid_min_size', 256)),
+                                              max_similarity_size=int(self.settings.get('pyramid_max_similarity_size', 1024)),
+                                              **self.feature_params())
+        if key is not None:
+            self.cache.put(key, vector_dict, params)
         self.sig_dft_status.emit('DFT registration is finished!')
         self.sig_dft_finished.emit(vector_dict)
 
+class BatchRegistration(QtCore.QObject):
+    """
+    Registers many images of the field in a process pool, see util.batch_registration.batch_register
+    """
+    progressUpdate_sig = Signal(float)
+    statusMessage_sig = Signal(str)
+    finished = Signal(object)
+
+    def __init__(self, placements, reference, settings=None):
+        super().__init__()
+        self.placements = placements
+        self.reference = reference
+        self.settings = settings or {}
+        self._abort = False
+
+    def abort(self):
+        self._abort = True
+
+    def run(self):
+        from smart.util.batch_registration import batch_register
+        try:
+            corrections, failed = batch_register(self.placements, reference=self.reference,
+                                                 strategy=self.settings.get('batch_strategy', 'tree'),
+                                                 mode=self.settings.get('dft_mode', 'single'),
+                                                 max_workers=int(self.settings.get('batch_workers', 0)) or None,
+                                                 progress_callback=self.progressUpdate_sig.emit,
+                                                 status_callback=self.statusMessage_sig.emit,
+                                                 abort=lambda: self._abort,
+                                                 max_size=int(self.settings.get('batch_max_size', 1024)),
+                                                 feature_detector=self.settings.get('feature_detector', 'orb'),
+                                                 feature_max_size=int(self.settings.get('feature_max_size', 1024)))
+        except Exception as e:
+            self.statusMessage_sig.emit(f'Batch registration failed: {e}')
+            corrections, failed = {}, list(range(len(self.placements)))
+        if self._abort:
+            # // a partly registered batch would tear the images of a tree apart, nothing is moved
+            self.statusMessage_sig.emit('Batch registration aborted, no image was moved.')
+            self.finished.emit(None)
+            return
+        self.finished.emit((corrections, failed))
+
+
 class MdiFieldImreg_Wrapper(object):
     """
     class around the GUI for image registration based on DFT-based input
@@ -152,6 +307,9 @@ class MdiFieldImreg_Wrapper(object):
         self.dft_reg_thread = QtCore.QThread()
         self.dft_reg_instance.moveToThread(self.dft_reg_thread)
         self.dft_reg_thread.started.connect(self.dft_reg_instance.perform_dft)
+        self.batch_selection = []
+        self.batch_reg_thread = None
+        self.batch_reg_worker = None
         self.init_scan_list()
         self.scaling_ft_along_height = 1
         self.scaling_ft_along_width = 1
@@ -237,11 +395,18 @@ class MdiFieldImreg_Wrapper(object):
         #return scaling_ft_along_width, scaling_ft_along_height
 
     def generate_scan_macro(self):
+        roi_width, roi_height = self.roi_dft.size()
+        roi_x, roi_y = self.roi_dft.pos()
+        return self.add_roi_to_scan_list(roi_x, roi_y, roi_width, roi_height)
+
+    def add_roi_to_scan_list(self, roi_x, roi_y, roi_width, roi_height, update_view=True):
+        """
+        Append the mesh scan over a rectangle in view coordinates to the scan list
+        :return: the scan macro
+        """
         mot_name_along_width = self.settings_object['SampleStageMotorNames']['scanx']
         mot_name_along_height = self.settings_object['SampleStageMotorNames']['scany']
         macro_name = self.lineEdit_macro_name.text()
-        roi_width, roi_height = self.roi_dft.size()
-        roi_x, roi_y = self.roi_dft.pos()
         beam_pos_vp = eval(self.lineEdit_beampos_coordinates.text())
         beam_pos_stage = eval(self.lineEdit_beampos_motors.text())
         dwell_time = float(self.lineEdit_dwell_time.text())
@@ -258,7 +423,8 @@ class MdiFieldImreg_Wrapper(object):
         assert prescan_action.startswith('[') and prescan_action.endswith(']'), 'The prescan str must be like []'
         new_row_in_table = [eval(prescan_action), macro_string, str(roi_x), str(roi_y), str(roi_width), str(roi_height)]
         self.pandas_model_scan_list._data.loc[len(self.pandas_model_scan_list._data)] = new_row_in_table
-        self.pandas_model_scan_list.update_view()
+        if update_view:
+            self.pandas_model_scan_list.update_view()
 
         return macro_string
 
@@ -318,8 +484,10 @@ class MdiFieldImreg_Wrapper(object):
         self.progressUpdate_sig.connect(self.progressUpdate)
         # self.updateFieldMode_sig.connect(self.field.set_mode)
         self.field.rectangleSelected_sig.connect(self.set_reference_zone)
+        self.field.imagesSelected_sig.connect(self.set_batch_selection)
         #connect widget events
         self.bt_registration.clicked.connect(self.prepare_dft)
+        self.pushButton_batch_registration.clicked.connect(self.batch_register_images)
         self.pushButton_move.clicked.connect(self.translate_target)
         self.bt_add_ref.clicked.connect(self.add_reference)
         self.bt_add_target.clicked.connect(self.add_target)
@@ -336,6 +504,66 @@ class MdiFieldImreg_Wrapper(object):
         # self.pushButton_submit_jobs.clicked.connect(self.submit_jobs_to_run)
         self.pushButton_submit_jobs.clicked.connect(lambda: self.submit_jobs_to_queue_server(viewer = 'img_reg'))
 
+    def set_batch_selection(self, images):
+        self.batch_selection = [img for img in images if isinstance(img, ImageBufferObject)]
+
+    def batch_register_images(self):
+        """
+        Register the rubber band selected images (all images if nothing is selected) against the reference image
+        (the current image if no reference was added) in the background and move them in one update
+        :return:
+        """
+        # // clicking again while it runs aborts it, the pairs in flight are finished first
+        if self.batch_reg_thread is not None and self.batch_reg_thread.isRunning():
+            self.abort_batch_registration(wait=False)
+            self.statusbar.showMessage('Aborting the batch registration ...')
+            return
+        images = self.batch_selection or [img for img in self.field_img if isinstance(img, ImageBufferObject)]
+        reference = getattr(self, 'reference_image', None)
+        if reference not in images:
+            reference = self.update_field_current if self.update_field_current in images else images[0] if images else None
+        if reference is None or len(images) < 2:
+            self.statusbar.showMessage('Select at least two images for the batch registration.')
+            return
+        self._batch_images = images
+        self.batch_reg_thread = QtCore.QThread()
+        self.batch_reg_worker = BatchRegistration([img.placement() for img in images], images.index(reference),
+                                                  settings=self.settings_object.get('ImageRegistration', {}))
+        self.batch_reg_worker.moveToThread(self.batch_reg_thread)
+        self.batch_reg_thread.started.connect(self.batch_reg_worker.run)
+        self.batch_reg_worker.progressUpdate_sig.connect(self.progressUpdate)
+        self.batch_reg_worker.statusMessage_sig.connect(self.update_status)
+        self.batch_reg_worker.finished.connect(self.batch_reg_thread.quit)
+        self.batch_reg_worker.finished.connect(self.apply_batch_registration)
+        self.pushButton_batch_registration.setText('abort batch')
+        self.statusbar.showMessage(f'Registering {len(images)} images against {reference.attrs["Path"]} ...')
+        self.batch_reg_thread.start()
+
+    def abort_batch_registration(self, wait=True):
+        """
+        Stop a running batch registration, e.g. before the workspace is cleared or the program exits
+        :param wait: block until the worker has stopped
+        :return:
+        """
+        if self.batch_reg_worker is not None:
+            self.batch_reg_worker.abort()
+        if wait and self.batch_reg_thread is not None:
+            self.batch_reg_thread.quit()
+            self.batch_reg_thread.wait()
+
+    def apply_batch_registration(self, result):
+        self.pushButton_batch_registration.setText('batch register')
+        if result is None:
+            return
+        corrections, failed = result
+        images = self._batch_images
+        self.imageBuffer.apply_view_corrections({images[k]: m for k, (m, success) in corrections.items()})
+        msg = f'{len(corrections)} images registered'
+        if failed:
+            msg += f', {len(failed)} without enough overlap or failed: ' + \
+                   ', '.join(os.path.basename(images[k].attrs['Path']) for k in failed[:5])
+        self.statusbar.showMessage(msg)
+
     def cal_union_region_target_and_reference(self):
         x_min, x_max, y_min, y_max = 0, 0, 0, 0
         assert hasattr(self, 'target_image') and hasattr(self, 'reference_image'), 'pick both target and reference images first'
@@ -389,11 +617,12 @@ class MdiFieldImreg_Wrapper(object):
         self.outl_target = current_loc['Outline']
         if isinstance(current_loc, dict):
             self.target_attrs = current_loc
-            self.target_frame = qt_image_to_array(self.target_image.pixmap.toImage())
-            # // grayscale conversion
-            # self.target_frame = np.dot(self.target_frame[..., :3], [0.299, 0.587, 0.114])
+            # // the full resolution pixels are decoded in the background, the frame is empty until they arrive
+            self.target_frame = np.zeros((0, 0))
             self.ent_target.setText(current_loc["Path"])
-            self.statusbar.showMessage(f'Target image added: {current_loc["Path"]}')
+            self.statusbar.showMessage(f'Loading target image: {current_loc["Path"]} ...')
+            self.target_image.gray_array_async(
+                lambda frame, image=self.target_image: self._set_target_frame(image, frame))
         elif isinstance(current_loc, Group):
             dset = current_loc.get_dataset()
             self.target_attrs = dset.attrs
@@ -420,15 +649,34 @@ class MdiFieldImreg_Wrapper(object):
         self.outl_reference = current_loc['Outline']
         if isinstance(current_loc, dict):
             self.reference_attrs = current_loc
-            self.reference_frame = qt_image_to_array(self.reference_image.pixmap.toImage())
-            # // grayscale conversion
-            # self.reference_frame = np.dot(self.reference_frame[..., :3], [0.299, 0.587, 0.114])
+            self.reference_frame = np.zeros((0, 0))
             self.ent_ref.setText(current_loc["Path"])
-            self.statusbar.showMessage(f'Reference image added: {current_loc["Path"]}')
+            self.statusbar.showMessage(f'Loading reference image: {current_loc["Path"]} ...')
+            self.reference_image.gray_array_async(
+                lambda frame, image=self.reference_image: self._set_reference_frame(image, frame))
         else:
             self.statusbar.showMessage(f'Fail to add reference image: {current_loc["Path"]}')
             raise ValueError("Unexpected type: {}".format(type(current_loc)))
 
+    def _set_target_frame(self, image, frame):
+        # // a target added in the meantime wins
+        if image is not self.target_image:
+            return
+        if frame is None:
+            self.statusbar.showMessage(f'Fail to load target image: {image.loc["Path"]}')
+            return
+        self.target_frame = frame
+        self.statusbar.showMessage(f'Target image added: {image.loc["Path"]}')
+
+    def _set_reference_frame(self, image, frame):
+        if image is not self.reference_image:
+            return
+        if frame is None:
+            self.statusbar.showMessage(f'Fail to load reference image: {image.loc["Path"]}')
+            return
+        self.reference_frame = frame
+        self.statusbar.showMessage(f'Reference image added: {image.loc["Path"]}')
+
     @Slot(float,float,float,float)
     def set_reference_zone(self, x0, y0, x1, y1):
         """
@@ -554,51 +802,32 @@ class MdiFieldImreg_Wrapper(object):
         self.move_box.setPos(translation_vector + self.move_box.pos())
 
     def _padding_to_union_size(self, array_frame, outline, union_outline):
+        # // place the frame into a union sized array filled with 250, one allocation and no trimming copy
         x_min, x_max, y_min, y_max = union_outline
         x0, x1, y0, y1 = [int(round(each)) for each in outline]
-        # print([(y0-y_min, y_max-y1),(x0-x_min, x_max-x1)])
-        return np.pad(array_frame, pad_width=[(y0-y_min, y_max-y1),(x0-x_min, x_max-x1)], mode='constant', constant_values=250)
-    
+        out = np.full((y_max - y_min, x_max - x_min), 250, dtype=array_frame.dtype)
+        oy, ox = max(y0 - y_min, 0), max(x0 - x_min, 0)
+        h, w = min(array_frame.shape[0], out.shape[0] - oy), min(array_frame.shape[1], out.shape[1] - ox)
+        out[oy:oy + h, ox:ox + w] = array_frame[:h, :w]
+        return out
+
     def prepare_dft(self):
         assert hasattr(self, 'reference_sub_outline'), "reference sub frame not yet selected"
         assert hasattr(self, 'target_sub_outline'), "target sub frame not yet selected"
-        output_text = []
+        settings = self.settings_object.get('ImageRegistration', {})
+        # // intermediate frames and timings are only collected on request, registration does no disk I/O by default
+        self.registration_debug = RegistrationDebugSink() if settings.get('debug', False) else _NullDebugSink()
+        debug = self.registration_debug
         # // determine the image registration transform
         #do pading here
-        union_outline = self.cal_union_region_target_and_reference()
-        self.target_zoom_frame = self._padding_to_union_size(self.target_sub_frame,self.target_sub_outline,union_outline)
-        self.reference_sub_frame = self._padding_to_union_size(self.reference_sub_frame,self.reference_sub_outline,union_outline)
-        min_y_dim = min([self.target_zoom_frame.shape[0],self.reference_sub_frame.shape[0]])
-        min_x_dim = min([self.target_zoom_frame.shape[1],self.reference_sub_frame.shape[1]])
-        #trim it down
-        self.target_zoom_frame = self.target_zoom_frame[0:min_y_dim,0:min_x_dim]
-        self.reference_sub_frame = self.reference_sub_frame[0:min_y_dim,0:min_x_dim]
-
-        cv2.imwrite(os.path.join(self.settings_object["FileManager"]["currentimagedbDir"],"target_sub_frame_downscaled.jpg"), self.target_zoom_frame)
-        #print("shapes:{}{}".format(self.target_zoom_frame.shape,self.reference_sub_frame.shape))
-        output_text.append("shapes:{}{}".format(self.target_zoom_frame.shape,self.reference_sub_frame.shape))
-        # // match the shape of reference (template) frame and current frame (image to be transformed
-        # if self.target_zoom_frame.shape != self.reference_sub_frame.shape:
-        #     # // pad on the right side
-        #     x_diff = self.reference_sub_frame.shape[0]-self.target_zoom_frame.shape[0]
-        #     y_diff = self.reference_sub_frame.shape[1] - self.target_zoom_frame.shape[1]
-        #     left_pad = x_diff//2
-        #     right_pad = x_diff - left_pad
-        #     top_pad = y_diff//2
-        #     bottom_pad = y_diff - top_pad
-        #     if x_diff>=0 and y_diff>=0:
-        #         self.target_zoom_frame = np.pad(self.target_zoom_frame, ((left_pad,right_pad), (top_pad, bottom_pad)), "edge")
-        #     else:
-        #         self.target_zoom_frame = self.target_zoom_frame[:self.reference_sub_frame.shape[0], :self.reference_sub_frame.shape[1]]
-        # else:
-        #     output_text.append("no padding required")
-        output_text.append("shapes:{}{}".format(self.target_zoom_frame.shape, self.reference_sub_frame.shape))
-
-        cv2.imwrite(os.path.join(self.settings_object["FileManager"]["currentimagedbDir"],"reference_sub_frame.jpg"), self.reference_sub_frame)
-
-        # import cv2
-        cv2.imwrite(os.path.join(self.settings_object["FileManager"]["currentimagedbDir"],"target_zoom_frame_padded.jpg"), self.target_zoom_frame)
-        self.dft_reg_instance.prepare_dft(self.reference_sub_frame, self.target_zoom_frame)
+        with debug.stage('padding'):
+            union_outline = self.cal_union_region_target_and_reference()
+            self.target_zoom_frame = self._padding_to_union_size(self.target_sub_frame,self.target_sub_outline,union_outline)
+            self.reference_sub_frame = self._padding_to_union_size(self.reference_sub_frame,self.reference_sub_outline,union_outline)
+        debug.capture('target_zoom_frame_padded', self.target_zoom_frame)
+        debug.capture('reference_sub_frame', self.reference_sub_frame)
+        self.dft_reg_instance.prepare_dft(self.reference_sub_frame, self.target_zoom_frame,
+                                          settings=settings, debug=debug)
         try:
             self.dft_reg_thread.terminate()
         except:
@@ -619,13 +848,17 @@ class MdiFieldImreg_Wrapper(object):
             self.scale_factor = vector_dict["scale"]
             # // correct for pixel size to calculate the correct scale factor
 
-            arr = ird.imreg.transform_img_dict(self.target_zoom_frame, tdict=vector_dict, bgval=None, order=1,
-                                               invert=False)
-            cv2.imwrite(os.path.join(self.settings_object["FileManager"]["currentimagedbDir"],"target_sub_frame_transformed.jpg"), arr)
+            debug = getattr(self, 'registration_debug', _NullDebugSink())
+            if debug.enabled:
+                debug.capture('target_sub_frame_transformed', warp_img_dict(self.target_zoom_frame, vector_dict, order=1))
 
             output_text.append("tvec: {}".format(vector_dict["tvec"]))
             output_text.append("angle: {}, {}".format(vector_dict["angle"], self.target_attrs["Rotation"]))
             output_text.append("scale: {}".format(vector_dict["scale"]))
+            output_text.extend(debug.report())
+            dump_dir = self.settings_object.get('ImageRegistration', {}).get('debug_dump_dir', '')
+            if debug.enabled and dump_dir:
+                debug.save(dump_dir)
             #set rotation and scaling via manipulating roi
             self.field.select_single_image([self.target_image])
             #scaling center
@@ -701,10 +934,12 @@ class MdiFieldImreg(QtWidgets.QDialog):
         self.outl_target = current_loc['Outline']
         if isinstance(current_loc, dict):
             self.target_attrs = current_loc
-            self.target_frame = qt_image_to_array(self.target_image.pixmap.toImage())
-            # // grayscale conversion
-            # self.target_frame = np.dot(self.target_frame[..., :3], [0.299, 0.587, 0.114])
+            # // the full resolution pixels are decoded in the background, the frame is empty until they arrive
+            self.target_frame = np.zeros((0, 0))
             self.ent_target.setText(current_loc["Path"])
+            self._parent.statusbar.showMessage(f'Loading target image: {current_loc["Path"]} ...')
+            self.target_image.gray_array_async(
+                lambda frame, image=self.target_image: self._set_target_frame(image, frame))
         elif isinstance(current_loc, Group):
             dset = current_loc.get_dataset()
             self.target_attrs = dset.attrs
@@ -727,13 +962,33 @@ class MdiFieldImreg(QtWidgets.QDialog):
         self.outl_reference = current_loc['Outline']
         if isinstance(current_loc, dict):
             self.reference_attrs = current_loc
-            self.reference_frame = qt_image_to_array(self.reference_image.pixmap.toImage())
-            # // grayscale conversion
-            # self.reference_frame = np.dot(self.reference_frame[..., :3], [0.299, 0.587, 0.114])
+            self.reference_frame = np.zeros((0, 0))
             self.ent_ref.setText(current_loc["Path"])
+            self._parent.statusbar.showMessage(f'Loading reference image: {current_loc["Path"]} ...')
+            self.reference_image.gray_array_async(
+                lambda frame, image=self.reference_image: self._set_reference_frame(image, frame))
         else:
             raise ValueError("Unexpected type: {}".format(type(current_loc)))
 
+    def _set_target_frame(self, image, frame):
+        # // a target added in the meantime wins
+        if image is not self.target_image:
+            return
+        if frame is None:
+            self._parent.statusbar.showMessage(f'Fail to load target image: {image.loc["Path"]}')
+            return
+        self.target_frame = frame
+        self._parent.statusbar.showMessage(f'Target image added: {image.loc["Path"]}')
+
+    def _set_reference_frame(self, image, frame):
+        if image is not self.reference_image:
+            return
+        if frame is None:
+            self._parent.statusbar.showMessage(f'Fail to load reference image: {image.loc["Path"]}')
+            return
+        self.reference_frame = frame
+        self._parent.statusbar.showMessage(f'Reference image added: {image.loc["Path"]}')
+
     @Slot(float,float,float,float)
     def set_reference_zone(self, x0, y0, x1, y1):
         """
@@ -862,7 +1117,6 @@ class MdiFieldImreg(QtWidgets.QDialog):
         assert hasattr(self, 'target_frame'), "No target frame has been registered!"
         self.target_sub_frame = self.roi.getArrayRegion(self.target_frame, self.target_image)
         self.target_sub_outline = self.current_roi_outline
-        cv2.imwrite(r"C:\\Users\\qiucanro\\Downloads\\target_sub_frame.jpg", self.target_sub_frame)
 
     def _update_outl(self):
         #outl should only reflect the width and the height of roi with the right rotation center
@@ -923,7 +1177,6 @@ class MdiFieldImreg(QtWidgets.QDialog):
             self.reference_sub_frame = ndii.zoom(self.reference_sub_frame, (pixel_scale_target/pixel_scale_ref))
             self.target_zoom_frame = self.target_sub_frame
         '''
-        cv2.imwrite(r"C:\\Users\\qiucanro\\Downloads\\target_sub_frame_downscaled.jpg", self.target_zoom_frame)
 
         print("shapes:", self.target_zoom_frame.shape, self.reference_sub_frame.shape)
         # // match the shape of reference (template) frame and current frame (image to be transformed
@@ -943,11 +1196,6 @@ class MdiFieldImreg(QtWidgets.QDialog):
             print("no padding required")
         print("shapes:", self.target_zoom_frame.shape, self.reference_sub_frame.shape)
         # self.target_image.setImage(self.target_frame)
-        # import cv2
-        cv2.imwrite(r"C:\\Users\\qiucanro\\Downloads\\reference_sub_frame.jpg", self.reference_sub_frame)
-
-        # import cv2
-        cv2.imwrite(r"C:\\Users\\qiucanro\Downloads\\target_zoom_frame_padded.jpg", self.target_zoom_frame)
 
         # // get different frames (taking into account the scaling)
         
@@ -965,10 +1213,6 @@ class MdiFieldImreg(QtWidgets.QDialog):
             self.scale_factor = vector_dict["scale"]
             # // correct for pixel size to calculate the correct scale factor
 
-            arr = ird.imreg.transform_img_dict(self.target_sub_frame, tdict=vector_dict, bgval=None, order=1,
-                                               invert=False)
-            cv2.imwrite(r"C:\\Users\\qiucanro\\Downloads\\target_sub_frame_transformed.jpg", arr)
-
             print('DFT registration results:')
             print("tvec: ", vector_dict["tvec"])
             print("angle: ", vector_dict["angle"], self.target_attrs["Rotation"])
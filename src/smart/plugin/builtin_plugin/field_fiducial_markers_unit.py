@@ -181,8 +181,8 @@ class FiducialMarkerWidget_wrapper(object):
         a = (abs(self.outl_r[1] - self.outl_r[0]),
              abs(self.outl_r[3] - self.outl_r[2]))
 
-        x_aspect = self.image_fiducial.pixmap.width() / a[0]
-        y_aspect = self.image_fiducial.pixmap.height() / a[1]
+        x_aspect = self.image_fiducial.image_shape[1] / a[0]
+        y_aspect = self.image_fiducial.image_shape[0] / a[1]
         s = (1 / x_aspect, 1 / y_aspect)
         tr = QtGui.QTransform()
         tr.scale(s[0], s[1])
@@ -389,8 +389,8 @@ class FiducialMarkerWidget(QtWidgets.QDialog):
         a = (abs(self.outl_r[1] - self.outl_r[0]),
              abs(self.outl_r[3] - self.outl_r[2]))
 
-        x_aspect = self.image.pixmap.width() / a[0]
-        y_aspect = self.image.pixmap.height() / a[1]
+        x_aspect = self.image.image_shape[1] / a[0]
+        y_aspect = self.image.image_shape[0] / a[1]
         s = (1 / x_aspect, 1 / y_aspect)
         tr = QtGui.QTransform()
         tr.scale(s[0], s[1])
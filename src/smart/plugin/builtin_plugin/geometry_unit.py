@@ -2,7 +2,6 @@
 import os
 from pathlib import Path
 from PyQt5 import QtGui
-from smart.util.util import qt_image_to_array
 import pyqtgraph as pg
 import numpy as np
 import math
@@ -38,9 +37,8 @@ class geometry_widget_wrapper(object):
     #callback whenever switch to a different image, being called once
     def update_geo(self):
         self.attrs_geo = self.update_field_current.loc
-        self.img_array_gray = qt_image_to_array(self.update_field_current.pixmap.toImage())
         #array dimension
-        self.shape_geo = (self.update_field_current.pixmap.width(), self.update_field_current.pixmap.height(), 1)
+        self.shape_geo = (self.update_field_current.image_shape[1], self.update_field_current.image_shape[0], 1)
         # % get length from outline
         if not 'Outline' in self.attrs_geo.keys():
             self.attrs_geo['Outline'] = [0, self.shape_geo[self.axis_geo[0]], 0, self.shape_geo[self.axis_geo[1]], 0,
@@ -4,17 +4,20 @@ from pathlib import Path
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 from PyQt5.QtCore import pyqtSignal as Signal
 from PyQt5.QtWidgets import  QAbstractItemView
-from smart.util.geometry_transformation import rotatePoint
+from smart.util.geometry_transformation import CoordinateTransform
+from smart.viewer.particle_overlay import ParticleOverlay
+from smart.resource.database_tool.particle_store import ParticleStore
 import pyqtgraph as pg
 import numpy as np
 import math
-from smart.util.util import qt_image_to_array, PandasModel
+from smart.util.util import PandasModel
 import time
 
 class TrackParticle(QtCore.QObject):
 
     sig_status_update = QtCore.pyqtSignal(str)
     sig_particle_info_update = QtCore.pyqtSignal(object)
+    sig_finished = QtCore.pyqtSignal()
 
     def __init__(self, parent, get_img_array_func, get_kwargs_func, get_method_str_func):
         super().__init__()
@@ -22,30 +25,146 @@ class TrackParticle(QtCore.QObject):
         self.get_img_array_func = get_img_array_func
         self.get_kwargs_func = get_kwargs_func
         self.get_method_str_func = get_method_str_func
+        self._abort = False
 
-    def prepare_tracking(self, img_buffer, call_back):
-        self.np_array_gray = self.get_img_array_func(img_buffer.pixmap.toImage())
+    def abort(self):
+        self._abort = True
+
+    def prepare_tracking(self, img_buffer, call_back, settings=None):
+        self.np_array_gray = self.get_img_array_func(img_buffer)
         self.kwargs = self.get_kwargs_func()
         self.method_str = self.get_method_str_func()
         self.call_back = call_back
+        self.settings = settings or {}
+        self._abort = False
         self.sig_status_update.emit('Done with preparation for particle tracking!')
         # self.parent.statusbar.showMessage('Done with preparation for particle tracking!')
 
+    def locate(self, np_array_gray):
+        from smart.util.particle_locate import locate_tiled
+        # // large images are bandpassed in tiles and refined in chunks in the locate pool
+        return locate_tiled(np_array_gray, tile_size=int(self.settings.get('locate_tile_size', 1024)),
+                            margin=int(self.settings.get('locate_margin', 0)) or None,
+                            max_workers=int(self.settings.get('locate_workers', 0)) or None,
+                            min_pixels=int(self.settings.get('locate_parallel_min_pixels', 4096 * 4096)),
+                            abort=lambda: self._abort, **self.kwargs)
+
     def track_particle(self):
-        import trackpy as tp
         self.sig_status_update.emit('Working on particle tracking now...It takes a while.')
-        if self.method_str == 'locate_brightfield_ring':
-            # this tracking algorithm is unstable
-            # particle_info = tp.locate_brightfield_ring(np_array_gray, kwargs['diameter']).round(1)
-            particle_info = tp.locate(self.np_array_gray, **self.kwargs).round(1)
-        else:
-            particle_info = tp.locate(self.np_array_gray, **self.kwargs).round(1)
+        try:
+            if self.method_str == 'locate_brightfield_ring':
+                # this tracking algorithm is unstable
+                # particle_info = tp.locate_brightfield_ring(np_array_gray, kwargs['diameter']).round(1)
+                particle_info = self.locate(self.np_array_gray).round(1)
+            else:
+                particle_info = self.locate(self.np_array_gray).round(1)
+        except Exception as e:
+            self.sig_status_update.emit(f'Particle tracking failed: {e}')
+            return
+        finally:
+            self.sig_finished.emit()
+        if self._abort:
+            self.sig_status_update.emit('Particle tracking aborted.')
+            return
         self.sig_status_update.emit('Particle tracking finished! Check results in the table viewer.')
         # self.call_back(particle_info)
         self.sig_particle_info_update.emit(particle_info)
         # self.parent.init_pandas_model(particle_info)
 
 
+class BatchTrackParticle(QtCore.QObject):
+    """
+    Locates the particles in every frame of a stack in a process pool and links them into trajectories, see
+    util.particle_locate.locate_stack
+    """
+    progressUpdate_sig = Signal(float)
+    statusMessage_sig = Signal(str)
+    frameLocated_sig = Signal(object)
+    finished = Signal(object)
+
+    def __init__(self, paths, kwargs, settings=None, drift_correction=False):
+        super().__init__()
+        self.paths = paths
+        self.kwargs = kwargs
+        self.settings = settings or {}
+        self.drift_correction = drift_correction
+        self._abort = False
+
+    def abort(self):
+        self._abort = True
+
+    def link_kwargs(self, features):
+        """
+        Register the frames onto the middle one and link the drift corrected positions, the x and y columns keep the
+        positions in the pixels of their own frame
+        :return: (features, keyword arguments of link_trajectories)
+        """
+        from smart.util.particle_locate import stack_drift, subtract_drift
+        if not self.drift_correction or features.empty:
+            return features, {}
+        self.statusMessage_sig.emit(f'Registering {len(self.paths)} frames to correct the drift ...')
+        try:
+            drift = stack_drift(self.paths, max_size=int(self.settings.get('drift_max_size', 512)),
+                                method=self.settings.get('drift_mode', 'translation'),
+                                max_workers=int(self.settings.get('stack_workers', 0)) or None,
+                                abort=lambda: self._abort)
+        except Exception as e:
+            self.statusMessage_sig.emit(f'Drift correction failed, linking the uncorrected positions: {e}')
+            return features, {}
+        if drift is None:
+            return features, {}
+        return subtract_drift(features, drift), {'pos_columns': ['y_registered', 'x_registered']}
+
+    def run(self):
+        from smart.util.particle_locate import locate_stack, link_trajectories
+        try:
+            features = locate_stack(self.paths, max_workers=int(self.settings.get('stack_workers', 0)) or None,
+                                    progress_callback=self.progressUpdate_sig.emit,
+                                    frame_callback=self.frameLocated_sig.emit,
+                                    status_callback=self.statusMessage_sig.emit,
+                                    abort=lambda: self._abort, **self.kwargs)
+            if not self._abort:
+                features, link_kwargs = self.link_kwargs(features)
+            if self._abort:
+                self.statusMessage_sig.emit('Stack tracking aborted, the trajectories are not linked.')
+                self.finished.emit(None)
+                return
+            self.statusMessage_sig.emit(f'Linking {len(features)} particles of {len(self.paths)} frames ...')
+            trajectories = link_trajectories(features, float(self.settings.get('link_search_range', 10)),
+                                             memory=int(self.settings.get('link_memory', 3)), **link_kwargs)
+        except Exception as e:
+            self.statusMessage_sig.emit(f'Stack tracking failed: {e}')
+            trajectories = None
+        self.finished.emit(trajectories)
+
+
+class PreviewParticle(QtCore.QObject):
+    """
+    Runs a LocatePreview off the gui thread, see particle_widget_wrapper.preview_particles
+    """
+    statusMessage_sig = Signal(str)
+    finished = Signal(object)
+
+    def __init__(self, locate_preview, image, pixels, kwargs):
+        super().__init__()
+        self.locate_preview = locate_preview
+        self.image = image
+        self.pixels = pixels
+        self.kwargs = kwargs
+
+    def run(self):
+        from smart.util.util import array_to_gray
+        t0 = time.time()
+        try:
+            self.locate_preview.set_image((id(self.image), tuple(self.image.image_shape)),
+                                          lambda: array_to_gray(self.pixels))
+            particle_info = self.locate_preview.locate(**self.kwargs).round(1)
+        except Exception as e:
+            self.statusMessage_sig.emit(f'Particle preview failed: {e}')
+            particle_info = None
+        self.finished.emit((self.image, particle_info, time.time() - t0))
+
+
 class particle_widget_wrapper(object):
     """
     Module contains tool to change the position and rotation of the image in the workspace.
@@ -62,14 +181,33 @@ class particle_widget_wrapper(object):
         # // enable field view
         self.setEnabled(True)
         self.track_partikle_instance = TrackParticle(parent= self,
-                                                     get_img_array_func=qt_image_to_array,
+                                                     get_img_array_func=lambda img: img.gray_array(),
                                                      get_kwargs_func=self.extract_kwargs_for_locating_particle,
                                                      get_method_str_func=self.comboBox_locate_method.currentText)
         self.thread_track_particle = QtCore.QThread()
         self.track_partikle_instance.moveToThread(self.thread_track_particle)
         self.thread_track_particle.started.connect(self.track_partikle_instance.track_particle)
+        self.track_partikle_instance.sig_finished.connect(self.thread_track_particle.quit)
         self.track_partikle_instance.sig_status_update.connect(self.update_status)
         self.track_partikle_instance.sig_particle_info_update.connect(self.update_particle_info)
+        self.track_stack_thread = None
+        self.track_stack_worker = None
+        # // the located frames of a stack are collected and shown in the table at most once per interval
+        self._stack_features = []
+        self._stack_refresh_timer = QtCore.QTimer()
+        self._stack_refresh_timer.setSingleShot(True)
+        self._stack_refresh_timer.timeout.connect(self.refresh_stack_table)
+        self.particle_store = None
+        self._particle_image = None
+        self._stack_transforms = None
+        self.locate_preview = None
+        # // parameter changes are collected for a short delay before the preview is rerun in the background
+        self._preview_timer = QtCore.QTimer()
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.timeout.connect(self.preview_particles)
+        self.preview_thread = None
+        self.preview_worker = None
+        self._preview_pending = False
         #self.init_pandas_model()
 
     @QtCore.pyqtSlot(str)
@@ -78,7 +216,61 @@ class particle_widget_wrapper(object):
 
     @QtCore.pyqtSlot(object)
     def update_particle_info(self,particle_info):
+        self.set_particle_results(particle_info)
+
+    def set_particle_results(self, particle_info, frame_transforms=None):
+        """
+        Show located particles in the table and index them in the particle store, in the view coordinates of the
+        image they were located on
+        :param frame_transforms: placement of every frame of a stack, see _frame_transforms
+        """
+        particle_info = particle_info.reset_index(drop=True)
         self.init_pandas_model(particle_info)
+        if frame_transforms is not None and 'frame' in particle_info.columns:
+            self.particle_store = ParticleStore.from_frames(particle_info, frame_transforms)
+            return
+        image = self._particle_image or self.update_field_current
+        self.particle_store = ParticleStore.from_dataframe(particle_info, to_view=CoordinateTransform.from_image_item(image))
+
+    def _frame_transforms(self, paths):
+        # // placement of every frame when the stack run starts, frames which are not in the field (the tiff files of
+        # // a folder) are placed like the current image
+        items = {img.attrs.get('Path'): img for img in self.field_img if isinstance(getattr(img, 'attrs', None), dict)}
+        transforms = []
+        for path in paths:
+            item = items.get(path, self.update_field_current)
+            transforms.append(CoordinateTransform() if item is None else CoordinateTransform.from_image_item(item))
+        return transforms
+
+    def selected_particles(self):
+        # // rows selected in the table, all particles in the visible part of the field otherwise
+        rows = [index.row() for index in self.tableView_particle_info.selectionModel().selectedRows()]
+        if rows:
+            return np.asarray(self.pandas_model._data.index[rows], dtype=int)
+        rect = self.field.viewRect()
+        return self.particle_store.query_rect(rect.left(), rect.top(), rect.right(), rect.bottom())
+
+    def particles_to_scan_list(self):
+        """
+        Add one mesh scan per selected particle, over the square the particle marker covers, to the scan list of the
+        registration panel
+        :return:
+        """
+        if self.particle_store is None or len(self.particle_store) == 0:
+            self.statusbar.showMessage('Locate particles first.')
+            return
+        indices = self.selected_particles()
+        pos = self.particle_store.view_pos[indices]
+        diameters = self.particle_store.view_diameters(indices)
+        try:
+            for (x, y), d in zip(pos, diameters):
+                self.add_roi_to_scan_list(x - d / 2, y - d / 2, d, d, update_view=False)
+        except Exception as e:
+            self.statusbar.showMessage(f'Cannot create the scans, set up the stage info of the registration panel first: {e}')
+            return
+        finally:
+            self.pandas_model_scan_list.update_view()
+        self.statusbar.showMessage(f'{len(indices)} particle scans added to the scan list.')
 
     def init_pandas_model(self, data, table_view_widget_name='tableView_particle_info'):
         #disable_all_tabs_but_one(self, tab_widget_name, tab_indx)
@@ -121,16 +313,182 @@ class particle_widget_wrapper(object):
         self.pushButton_annotate_particle.clicked.connect(self.annotate)
         self.tableView_particle_info.clicked.connect(self.annotate_clicked_row)
         self.pushButton_save_locate_settings.clicked.connect(self.update_partical_tracking_pars)
+        self.pushButton_locate_stack.clicked.connect(self.track_particle_stack)
+        self.pushButton_particles_to_scan.clicked.connect(self.particles_to_scan_list)
+        # // with the preview checked every parameter change reruns locate on the cached downsampled image
+        for line_edit in (self.lineEdit_diameter, self.lineEdit_minmass, self.lineEdit_maxsize, self.lineEdit_threshold):
+            line_edit.editingFinished.connect(self.schedule_preview)
+        self.doubleSpinBox_noise_size.valueChanged.connect(self.schedule_preview)
+        self.comboBox_invert.currentIndexChanged.connect(self.schedule_preview)
+        self.checkBox_locate_preview.toggled.connect(self.schedule_preview)
 
-    def track_particle(self):
-        self.track_partikle_instance.prepare_tracking(self.update_field_current, self.init_pandas_model)
+    def _stack_paths(self):
+        # // the rubber band selected images in the order of their file names, or the tiff frames of a folder
+        from smart.resource.data_loaders.file_loader import list_tiff_files, sort_nicely
+        paths = [img.attrs['Path'] for img in getattr(self, 'batch_selection', [])]
+        if len(paths) > 1:
+            return sort_nicely(paths)
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, 'Select the folder holding the frames of the stack')
+        return list_tiff_files(folder) if folder else []
+
+    def track_particle_stack(self):
+        """
+        Locate the particles in every frame of a stack and link them into trajectories in the background, the located
+        frames are streamed into the table. Clicking again while it runs aborts it.
+        :return:
+        """
+        if self.track_stack_thread is not None and self.track_stack_thread.isRunning():
+            self.track_stack_worker.abort()
+            self.statusbar.showMessage('Aborting the stack tracking ...')
+            return
+        paths = self._stack_paths()
+        if len(paths) < 2:
+            self.statusbar.showMessage('Select at least two images or a folder of tiff frames to track a stack.')
+            return
+        self._stack_features = []
+        # // the table streams frames which are not in the particle store, it is rebuilt once the stack is done
+        self.particle_store = None
+        self.pushButton_particles_to_scan.setEnabled(False)
+        self._stack_refresh_timer.setInterval(
+            int(self.settings_object.get('ParticleTracking', {}).get('stack_table_refresh_ms', 1000)))
+        self._particle_image = self.update_field_current
+        self._stack_transforms = self._frame_transforms(paths)
+        self.track_stack_thread = QtCore.QThread()
+        self.track_stack_worker = BatchTrackParticle(paths, self.extract_kwargs_for_locating_particle(),
+                                                     settings=self.settings_object.get('ParticleTracking', {}),
+                                                     drift_correction=self.checkBox_drift_correction.isChecked())
+        self.track_stack_worker.moveToThread(self.track_stack_thread)
+        self.track_stack_thread.started.connect(self.track_stack_worker.run)
+        self.track_stack_worker.progressUpdate_sig.connect(self.progressUpdate)
+        self.track_stack_worker.statusMessage_sig.connect(self.update_status)
+        self.track_stack_worker.frameLocated_sig.connect(self.append_stack_frame)
+        self.track_stack_worker.finished.connect(self.track_stack_thread.quit)
+        self.track_stack_worker.finished.connect(self.finish_particle_stack)
+        self.pushButton_locate_stack.setText('AbortStack')
+        self.statusbar.showMessage(f'Tracking particles in {len(paths)} frames ...')
+        self.track_stack_thread.start()
+
+    @QtCore.pyqtSlot(object)
+    def append_stack_frame(self, features):
+        self._stack_features.append(features.round(1))
+        if not self._stack_refresh_timer.isActive():
+            self._stack_refresh_timer.start()
+
+    def refresh_stack_table(self):
+        import pandas as pd
+        if self._stack_features:
+            # // one concat per refresh, the frames received since the last one are merged into the accumulated table
+            self._stack_features = [pd.concat(self._stack_features, ignore_index=True)]
+            self.init_pandas_model(self._stack_features[0])
+
+    @QtCore.pyqtSlot(object)
+    def finish_particle_stack(self, trajectories):
+        import pandas as pd
+        self._stack_refresh_timer.stop()
+        self.pushButton_locate_stack.setText('TrackStack')
+        self.pushButton_particles_to_scan.setEnabled(True)
+        if trajectories is None:
+            # // aborted or failed, the table and the store keep the frames located so far
+            if self._stack_features:
+                self.set_particle_results(pd.concat(self._stack_features, ignore_index=True), self._stack_transforms)
+            return
+        self.set_particle_results(trajectories.round(1), self._stack_transforms)
+        n = trajectories['particle'].nunique() if len(trajectories) else 0
+        self.statusbar.showMessage(f'Stack tracking finished, {n} trajectories linked.')
+
+    def schedule_preview(self, *args):
+        # // restart the delay on every change, only the last one of a burst is previewed
+        self._preview_timer.setInterval(
+            int(self.settings_object.get('ParticleTracking', {}).get('preview_delay_ms', 300)))
+        self._preview_timer.start()
+
+    def preview_particles(self):
+        """
+        Locate the particles on a downsampled and bandpassed copy of the current image in the background, the
+        preprocessing is cached across parameter changes. Track recomputes at full resolution.
+        :return:
+        """
+        if not self.checkBox_locate_preview.isChecked() or self.update_field_current is None:
+            return
+        # // a preview is still running, rerun once it is done with the parameters of then
+        if self.preview_thread is not None and self.preview_thread.isRunning():
+            self._preview_pending = True
+            return
+        image = self.update_field_current
+        if not image.is_full_resolution():
+            self.statusbar.showMessage('Loading the full resolution image for the particle preview ...')
+        image.with_full_resolution(lambda pixels: self._start_preview(image, pixels))
+
+    def _start_preview(self, image, pixels):
+        if pixels is None:
+            self.statusbar.showMessage(f'Particle preview failed: could not load {image.loc.get("Path", "")}')
+            return
+        if image is not self.update_field_current or not self.checkBox_locate_preview.isChecked():
+            return
+        if self.preview_thread is not None and self.preview_thread.isRunning():
+            self._preview_pending = True
+            return
+        from smart.util.particle_locate import LocatePreview
+        if self.locate_preview is None:
+            settings = self.settings_object.get('ParticleTracking', {})
+            self.locate_preview = LocatePreview(max_size=int(settings.get('preview_max_size', 1024)))
         try:
-            self.thread_track_particle.terminate()
-        except:
-            pass
+            kwargs = self.extract_kwargs_for_locating_particle()
+        except Exception as e:
+            self.statusbar.showMessage(f'Particle preview failed: {e}')
+            return
+        self.preview_thread = QtCore.QThread()
+        self.preview_worker = PreviewParticle(self.locate_preview, image, pixels, kwargs)
+        self.preview_worker.moveToThread(self.preview_thread)
+        self.preview_thread.started.connect(self.preview_worker.run)
+        self.preview_worker.statusMessage_sig.connect(self.update_status)
+        self.preview_worker.finished.connect(self.preview_thread.quit)
+        self.preview_worker.finished.connect(self.finish_preview)
+        self.preview_thread.finished.connect(self._preview_thread_finished)
+        self.preview_thread.start()
+
+    @QtCore.pyqtSlot(object)
+    def finish_preview(self, result):
+        image, particle_info, seconds = result
+        # // the shown results are stale if the image changed or the preview was switched off in the meantime
+        if particle_info is not None and image is self.update_field_current and \
+                self.checkBox_locate_preview.isChecked():
+            self._particle_image = image
+            self.set_particle_results(particle_info)
+            self.annotate()
+            self.statusbar.showMessage(f'Preview: {len(particle_info)} particles in {seconds:.2f} s, '
+                                       f'press Track to locate them at full resolution.')
+
+    def _preview_thread_finished(self):
+        # // changes made while the preview was running
+        if self._preview_pending:
+            self._preview_pending = False
+            self._preview_timer.start()
+
+    def track_particle(self):
+        # // clicking again while it runs aborts it, the worker stops after the tiles in flight
+        if self.thread_track_particle.isRunning():
+            self.track_partikle_instance.abort()
+            self.statusbar.showMessage('Aborting the particle tracking ...')
+            return
+        image = self.update_field_current
+        self._particle_image = image
+        # // the full resolution pixels are decoded in the background, tracking starts once they are resident
+        self.statusbar.showMessage('Loading the full resolution image for particle tracking ...')
+        image.with_full_resolution(lambda pixels: self._start_tracking(image, pixels))
+
+    def _start_tracking(self, image, pixels):
+        if pixels is None:
+            self.statusbar.showMessage(f'Particle tracking failed: could not load {image.loc.get("Path", "")}')
+            return
+        # // clicked twice while the image was loading
+        if self.thread_track_particle.isRunning():
+            return
+        self.track_partikle_instance.prepare_tracking(image, self.init_pandas_model,
+                                                      settings=self.settings_object.get('ParticleTracking', {}))
         self.thread_track_particle.start()
         '''
-        np_array_gray = qt_image_to_array(self.update_field_current.pixmap.toImage())
+        np_array_gray = self.update_field_current.gray_array()
         kwargs = self.extract_kwargs_for_locating_particle()
         method_str = self.comboBox_locate_method.currentText()
         if method_str == 'locate_brightfield_ring':
@@ -148,26 +506,31 @@ class particle_widget_wrapper(object):
             self.field.removeItem(self.markers)
         if self.markers_clicked!=None:
             self.field.removeItem(self.markers_clicked)        
-        self.markers = pg.ScatterPlotItem(size=10, pxMode=False, pen=pg.mkPen(255, 0, 255, 255), brush=pg.mkBrush(255, 255, 255, 120))
-        spots = zip(self.pandas_model._data.x, self.pandas_model._data.y, self.pandas_model._data.mass)
-        spots = [{'pos':self.scale_rotate_and_translate([x,y]), 'data': value, 'symbol':'o'} for x, y, value in spots]
-        self.markers.addPoints(spots, pxMode=False)
-        self.markers.setSize(self.pandas_model._data['size']*2)
+        settings = self.settings_object.get('ParticleTracking', {})
+        self.markers = ParticleOverlay(max_points=int(settings.get('overlay_max_points', 5000)),
+                                       cell_px=float(settings.get('overlay_cell_px', 8)))
         self.field.addItem(self.markers)
+        if self.particle_store is None:
+            self.set_particle_results(self.pandas_model._data)
+        self.markers.set_particles(*self.particle_store.overlay_args())
         self.markers.setZValue(10)
         self.update_field_current.setZValue(0)
 
     def annotate_clicked_row(self, index=None):
         if self.markers_clicked!=None:
             self.field.removeItem(self.markers_clicked)        
-        x = self.pandas_model._data.x.to_list()[index.row()]
-        y = self.pandas_model._data.y.to_list()[index.row()]
-        mass = self.pandas_model._data.mass.to_list()[index.row()]
+        if self.particle_store is None:
+            return
+        # // the table rows are labelled with the row of the particle in the store
+        label = int(self.pandas_model._data.index[index.row()])
+        mass = self.pandas_model._data.mass.iloc[index.row()]
         self.markers_clicked = pg.ScatterPlotItem(size=10, pen=pg.mkPen(0, 255, 0, 255), brush=pg.mkBrush(255, 255, 255, 120))
-        spots = [{'pos':self.scale_rotate_and_translate([x,y]), 'data': mass, 'symbol':'+'}]
+        columns = self.particle_store.columns
+        spots = [{'pos': (columns['vx'][label], columns['vy'][label]), 'data': mass, 'symbol':'+'}]
         self.markers_clicked.addPoints(spots)
         self.field.addItem(self.markers_clicked)
         self.markers_clicked.setZValue(20)
 
     def scale_rotate_and_translate(self, pot):
-        return np.array(rotatePoint([0,0], np.array(pot) * np.array(self.update_field_current._scale), self.update_field_current.loc['Rotation'])) + np.array(self.update_field_current.pos())
\ No newline at end of file
+        # // image pixel -> view coordinates, pot is a single point or a N x 2 array
+        return CoordinateTransform.from_image_item(self.update_field_current).map(pot)
\ No newline at end of file
@@ -104,35 +104,149 @@ def load_tiff(path_str, mode=0, mono=False, dgroup='', node='', progressbar='',
         dset_node.attrs["Outline"] = [pos[0] - w / 2, w / 2 + pos[0], pos[1] - h / 2, h / 2 + pos[1], 0, 1]
         tif.close()
     elif mode == 2:
-        from tifffile import TiffFile
-        import cv2
-        import time
-        os.chdir(path_str)
-        sourcelist = glob.glob("*.tif") + glob.glob("*.tiff")
+        sourcelist = list_tiff_files(path_str)
         if not sourcelist:
             print('No tiff files found.')
             return None
-        sourcelist = sort_nicely(sourcelist)
-        dat_shape = TiffFile(sourcelist[0]).asarray().shape
-        dset_node = init_write(_shape=(1, len(sourcelist), 1, dat_shape[0], dat_shape[1]), _defaultName='TIFF_',
-                               dgroup=dgroup, node=node)
         if progressbar:
             progressbar.setValue(0)
-        for n, f in enumerate(sourcelist):
-            # tif = TiffFile(f)
-            # dset_node[:,:,n] = tif.asarray()
-            # tif.close()
-
-            # im = Image.open(f)
-            # dset_node[:,:,n] = np.array(im)
-            dset_node[0, n, 0, :, :] = cv2.imread(f, -1)
+        import tifffile
+        with tifffile.TiffFile(sourcelist[0]) as tif:
+            frame_shape, frame_dtype = tif.series[0].shape, tif.series[0].dtype
+        dset_node = init_write(_shape=(1, len(sourcelist), 1, frame_shape[0], frame_shape[1]), _defaultName='TIFF_',
+                               dgroup=dgroup, node=node)
+        # // the stack is decoded in chunks of frames into one reused buffer and written slice by slice, so at most
+        # // one chunk is held in memory besides the dataset
+        chunk = os.cpu_count() or 1
+        buffer = np.empty((chunk,) + tuple(frame_shape), dtype=frame_dtype)
+        for start in range(0, len(sourcelist), chunk):
+            files = sourcelist[start:start + chunk]
+            load_tiff_stack(files, out=buffer[:len(files)])
+            dset_node[0, start:start + len(files), 0, :, :] = buffer[:len(files)]
             if progressbar:
-                progressbar.setValue(n / len(sourcelist) * 100)
+                progressbar.setValue(int((start + len(files)) / len(sourcelist) * 100))
     current_group = dset_node.parent
     current_group.node.channel_dict.check_size(dset_node.shape[1])
     return dset_node.parent
 
 
+def sort_nicely(l):
+    """
+    Sort strings the way humans expect, i.e. frame_2.tif before frame_10.tif
+
+    :param l: list of strings
+    :return: sorted list
+    """
+    import re
+    convert = lambda text: int(text) if text.isdigit() else text.lower()
+    return sorted(l, key=lambda key: [convert(c) for c in re.split('([0-9]+)', key)])
+
+
+def list_tiff_files(folder):
+    """
+    Full paths of the tiff files in a folder, in natural order. The working directory of the process is not touched.
+
+    :param folder: folder holding the frames of a stack
+    :return: list of file paths
+    """
+    files = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(('.tif', '.tiff'))]
+    return sort_nicely(files)
+
+
+def load_tiff_stack(files, out=None, max_workers=None, progress_callback=None):
+    """
+    Loads a list of equally shaped tiff frames into one array. The output is allocated once from the shape and dtype
+    of the first frame and every frame is decoded straight into its slice by a pool of threads, tifffile releases
+    the GIL while decoding.
+
+    :param files: list of tiff file paths, one frame each
+    :param out: optional preallocated array of shape (len(files), *frame_shape)
+    :param max_workers: size of the thread pool, defaults to the number of cores
+    :param progress_callback: called with the progress in percent, from the calling thread
+    :return: the stack as numpy array
+    """
+    import tifffile
+    from concurrent.futures import ThreadPoolExecutor
+    with tifffile.TiffFile(files[0]) as tif:
+        shape, dtype = tif.series[0].shape, tif.series[0].dtype
+    if out is None:
+        out = np.empty((len(files),) + tuple(shape), dtype=dtype)
+    elif out.shape != (len(files),) + tuple(shape):
+        raise ValueError(f"Output shape {out.shape} does not fit {len(files)} frames of shape {shape}")
+
+    def _read(n):
+        # // one decoding thread per frame, the parallelism comes from the pool
+        tifffile.imread(files[n], out=out[n], maxworkers=1)
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+        for n, _ in enumerate(pool.map(_read, range(len(files)))):
+            if progress_callback:
+                progress_callback((n + 1) / len(files) * 100)
+    return out
+
+
+def load_image_array(path, memmap=True):
+    """
+    Decodes an image file into a numpy array. Every file is decoded exactly once, the returned array is
+    handed straight to the image item in the field view.
+
+    :param path: full path of the image file (.tif, .tiff, .bmp, .png, .jpg or .jpeg)
+    :param memmap: memory-map uncompressed, contiguous tiff files instead of reading them
+    :return: the image as numpy array (RGB channel order for color images), None if the file could not be decoded
+    """
+    ext = os.path.splitext(path)[-1].lower()
+    if ext in ('.tif', '.tiff'):
+        import tifffile
+        if memmap:
+            try:
+                # // read-only mapping, pages are only read from disk when the pixels are accessed
+                return tifffile.memmap(path, mode='r')
+            except ValueError:
+                # // compressed or tiled data, which can not be mapped
+                pass
+        return tifffile.imread(path)
+    elif ext in ('.bmp', '.png', '.jpg', '.jpeg'):
+        import cv2
+        # // cv2 detects the format from the file content, so a png which actually holds a bmp is fine as well
+        image = cv2.imread(path)
+        if image is None and ext == '.png':
+            # // fallback for pngs which are actually bmps and which cv2 still refuses, read them as bmp with qt
+            # // instead of copying the file to a .bmp next to it
+            from PyQt5 import QtGui
+            import qimage2ndarray
+            qimage = QtGui.QImage()
+            if not qimage.load(path, 'BMP'):
+                return None
+            return np.ascontiguousarray(qimage2ndarray.rgb_view(qimage))
+        if image is None:
+            return None
+        # // RGB like the QPixmap the field used to show, cv2 itself decodes to BGR
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return None
+
+
+def read_image_shape(path):
+    """
+    Reads the shape of an image from the file header, without decoding the pixels.
+
+    :param path: full path of the image file
+    :return: the shape load_image_array would return, None if it can not be determined
+    """
+    ext = os.path.splitext(path)[-1].lower()
+    if ext in ('.tif', '.tiff'):
+        import tifffile
+        with tifffile.TiffFile(path) as tif:
+            return tuple(tif.series[0].shape)
+    elif ext in ('.bmp', '.png', '.jpg', '.jpeg'):
+        from PyQt5 import QtGui
+        size = QtGui.QImageReader(path).size()
+        if not size.isValid():
+            return None
+        # // load_image_array always returns 3 channel RGB arrays for these formats
+        return (size.height(), size.width(), 3)
+    return None
+
+
 def load_align_xml(xml_path):
     """
 
@@ -336,29 +450,7 @@ def load_im(filename, library=None):
         from scipy import io
         return io.mmread(filename)
     elif (filename.endswith(('.bmp', '.png', '.jpg'))):
-        from PySide import QtGui
-        img = QtGui.QPixmap(filename).toImage()
-        assert img.format() == QtGui.QImage.Format.Format_RGB32, \
-            "img format must be QImage.Format.Format_RGB32, got: {}".format(img.format())
-        img_size = img.size()
-        buffer = img.constBits()
-
-        # Sanity check
-        n_bits_buffer = len(buffer) * 8
-        n_bits_image = img_size.width() * img_size.height() * img.depth()
-        assert n_bits_buffer == n_bits_image, \
-            "size mismatch: {} != {}".format(n_bits_buffer, n_bits_image)
-
-        assert img.depth() == 32, "unexpected image depth: {}".format(img.depth())
-
-        # Note the different width height parameter order!
-        arr = np.ndarray(shape=(img_size.height(), img_size.width(), img.depth() // 8),
-                         buffer=buffer,
-                         dtype=np.uint8)
-        # print(arr.shape)
-        arr_corr = np.roll(arr[:, :, :3], axis=2, shift=2)
-        # arr_corr = np.dstack((arr_corr,arr[:,:,3]))
-        return arr_corr
+        return load_image_array(filename)
     elif (filename.endswith(('.tiff', '.tif'))):
         from tifffile import TiffFile
         tif = TiffFile(filename)
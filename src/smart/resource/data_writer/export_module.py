@@ -129,3 +129,104 @@ def write_im_xml(xml_path, attrList, distributed=False):
     tree.write(xml_path, pretty_print=True, xml_declaration=True, encoding="Windows-1252")
 
 
+
+
+class ImageDbJournal(object):
+    """
+    Append-only change journal living next to an imagedb xml file (<xml_path>.journal).
+
+    Every edit of the image buffer is written as one json line holding only the attributes of the touched image,
+    so a single edit costs O(1) disk io instead of rewriting the whole xml. compact() replays the journal onto the
+    xml and writes it again with write_im_xml, the result loads with file_loader.load_im_xml as before.
+    Records are keyed by the image Path: 'add' and 'update' insert or replace the image, 'remove' drops it.
+    """
+
+    def __init__(self, xml_path):
+        self.xml_path = xml_path
+        self.journal_path = xml_path + '.journal'
+        self.n_records = self._count_records()
+
+    def _count_records(self):
+        if not os.path.exists(self.journal_path):
+            return 0
+        with open(self.journal_path, 'r') as f:
+            return sum(1 for line in f if line.strip())
+
+    @staticmethod
+    def _to_json(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return str(obj)
+
+    def record(self, op, d):
+        """
+        Append one change to the journal
+        :param op: 'add', 'update' or 'remove'
+        :param d: the attribute dict of the image
+        :return: number of records in the journal
+        """
+        import json
+        if op not in ('add', 'update', 'remove'):
+            raise ValueError(f"Unknown journal operation {op}")
+        if op == 'remove':
+            attrs = {'Path': d['Path']}
+        else:
+            # // the qt objects and other runtime only entries are not persisted
+            attrs = {key: value for key, value in d.items() if key not in ('Parent', 'AspectRatio')}
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps({'op': op, 'attrs': attrs}, default=self._to_json) + '\n')
+            f.flush()
+        self.n_records += 1
+        return self.n_records
+
+    def replay(self, attr_list):
+        """
+        Apply the journaled changes on a list of attribute dicts
+        :param attr_list: attribute dicts as loaded from the xml file, will be modified in place
+        :return: attr_list
+        """
+        import json
+        if not os.path.exists(self.journal_path):
+            return attr_list
+        index = {d['Path']: i for i, d in enumerate(attr_list)}
+        with open(self.journal_path, 'r') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # // a torn last line after a crash, everything before it is still valid
+                    continue
+                path = rec['attrs']['Path']
+                if rec['op'] == 'remove':
+                    if path in index:
+                        attr_list[index.pop(path)] = None
+                elif path in index:
+                    attr_list[index[path]] = rec['attrs']
+                else:
+                    index[path] = len(attr_list)
+                    attr_list.append(rec['attrs'])
+        attr_list[:] = [d for d in attr_list if d is not None]
+        return attr_list
+
+    def reset(self):
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.n_records = 0
+
+    def compact(self):
+        """
+        Fold the journal into the xml file and start a fresh journal
+        :return: the compacted list of attribute dicts
+        """
+        from ..data_loaders.file_loader import load_im_xml
+        if not os.path.exists(self.journal_path):
+            return None
+        attr_list = []
+        if os.path.exists(self.xml_path):
+            attr_list = load_im_xml(self.xml_path, exclude_file=[], progressbar=None)
+        attr_list = self.replay(attr_list)
+        write_im_xml(self.xml_path, attr_list, distributed=True)
+        self.reset()
+        return attr_list
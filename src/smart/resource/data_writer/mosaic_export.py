@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import os
+import math
+from collections import OrderedDict
+import numpy as np
+
+
+class MosaicExportAborted(Exception):
+    pass
+
+
+def _to_rgb8(image, levels=None):
+    """
+    Convert an image to uint8 RGB the way it is displayed in the field view
+    :param image: 2d gray or 3d color image
+    :param levels: display levels (lo, hi), scalar or per channel, None to use the value range of the image
+    :return: (h, w, 3) uint8 array
+    """
+    if image.ndim == 3:
+        image = image[..., :3]
+    if image.dtype != np.uint8 or levels is not None:
+        if levels is None:
+            lo, hi = float(image.min()), float(image.max())
+        else:
+            levels = np.asarray(levels, dtype=np.float64)
+            lo, hi = levels[..., 0], levels[..., 1]
+            if image.ndim == 2 and np.ndim(lo) > 0:
+                lo, hi = lo.min(), hi.max()
+        scale = 255.0 / np.maximum(np.asarray(hi) - lo, 1e-12)
+        image = np.clip((image.astype(np.float32) - lo) * scale, 0, 255).astype(np.uint8)
+    if image.ndim == 2:
+        image = np.repeat(image[..., None], 3, axis=2)
+    return np.ascontiguousarray(image)
+
+
+class MosaicStitcher(object):
+    """
+    Stitches placed images into one mosaic, tile by tile.
+
+    Every placement is a dict with
+        'path':    image file, read with load_func (memory-mapped for uncompressed tiffs)
+        'shape':   full resolution shape of the image
+        'affine':  2x3 matrix mapping image pixel coordinates (column, row) to view coordinates
+        'levels':  display levels, None to use the value range of the image
+        'opacity': 0..1
+    Placements are drawn in list order, i.e. the last one ends up on top.
+    Each output tile is rendered on its own by warping the overlapping images into it, so the memory needed is bounded
+    by the tile size plus a small cache of (binned) source images, independent of the size of the mosaic.
+    """
+
+    def __init__(self, placements, resolution=None, region=None, tile_size=1024, cache_mb=1024, load_func=None):
+        """
+        :param placements: list of placement dicts, see the class doc
+        :param resolution: size of one mosaic pixel in view units, defaults to the finest image pixel
+        :param region: (x0, y0, x1, y1) in view units, defaults to the union of all images
+        :param tile_size: edge of the square tiles which are rendered and written
+        :param cache_mb: memory for the decoded source images kept between tiles
+        :param load_func: callable returning the pixels of a path, defaults to file_loader.load_image_array
+        """
+        if len(placements) == 0:
+            raise ValueError("Nothing to stitch, no images placed")
+        if load_func is None:
+            from ..data_loaders.file_loader import load_image_array
+            load_func = load_image_array
+        self.placements = placements
+        self.load_func = load_func
+        self.tile_size = int(tile_size)
+        self.cache_bytes = int(cache_mb * 1024 ** 2)
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+
+        self._inverse = []
+        bboxes = []
+        pixel_sizes = []
+        for p in placements:
+            a = np.asarray(p['affine'], dtype=np.float64)
+            h, w = p['shape'][:2]
+            corners = a[:, :2] @ np.array([[0, w, 0, w], [0, 0, h, h]], dtype=np.float64) + a[:, 2:]
+            bboxes.append((corners[0].min(), corners[1].min(), corners[0].max(), corners[1].max()))
+            pixel_sizes.append(math.sqrt(abs(np.linalg.det(a[:, :2]))))
+            self._inverse.append(np.linalg.inv(a[:, :2]))
+        self.bboxes = np.array(bboxes)
+        self.resolution = float(resolution) if resolution else min(pixel_sizes)
+        self.region = region if region is not None else (self.bboxes[:, 0].min(), self.bboxes[:, 1].min(),
+                                                         self.bboxes[:, 2].max(), self.bboxes[:, 3].max())
+
+    def level_resolution(self, level):
+        return self.resolution * 2 ** level
+
+    def level_shape(self, level):
+        x0, y0, x1, y1 = self.region
+        res = self.level_resolution(level)
+        return max(int(math.ceil((y1 - y0) / res)), 1), max(int(math.ceil((x1 - x0) / res)), 1), 3
+
+    def n_levels(self):
+        # // halve the resolution until the mosaic fits into a single tile
+        n = 1
+        while max(self.level_shape(n - 1)[:2]) > self.tile_size:
+            n += 1
+        return n
+
+    def _source(self, index, binning):
+        # // decoded, binned and display converted source image, kept in a small lru cache
+        key = (index, binning)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        from ..database_tool.image_cache import bin_image
+        p = self.placements[index]
+        image = self.load_func(p['path'])
+        if image is None:
+            rgb = None
+        else:
+            rgb = _to_rgb8(bin_image(image, binning), p.get('levels'))
+        self._cache[key] = rgb
+        self._cached_bytes += 0 if rgb is None else rgb.nbytes
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cached_bytes -= 0 if old is None else old.nbytes
+        return rgb
+
+    def render_tile(self, level, tile_row, tile_col):
+        """
+        Render one tile of the mosaic
+        :param level: pyramid level, 0 is the full resolution
+        :param tile_row, tile_col: tile indices
+        :return: (tile_size, tile_size, 3) uint8 array, the parts outside of the mosaic are black
+        """
+        import cv2
+        ts = self.tile_size
+        res = self.level_resolution(level)
+        tile = np.zeros((ts, ts, 3), dtype=np.uint8)
+        tx0 = self.region[0] + tile_col * ts * res
+        ty0 = self.region[1] + tile_row * ts * res
+        tx1, ty1 = tx0 + ts * res, ty0 + ts * res
+        b = self.bboxes
+        hits = np.nonzero((b[:, 0] < tx1) & (b[:, 2] > tx0) & (b[:, 1] < ty1) & (b[:, 3] > ty0))[0]
+        for index in hits:
+            p = self.placements[index]
+            a = np.asarray(p['affine'], dtype=np.float64)
+            a_inv = self._inverse[index]
+            # // source pixels per mosaic pixel, bin the source first instead of aliasing while warping
+            binning = max(int(res / math.sqrt(abs(np.linalg.det(a[:, :2])))), 1)
+            src = self._source(index, binning)
+            if src is None:
+                continue
+            # // mosaic pixel centre -> view -> image pixel -> binned image pixel
+            m = np.empty((2, 3))
+            m[:, :2] = a_inv * res / binning
+            m[:, 2] = a_inv @ (np.array([tx0, ty0]) + 0.5 * res - a[:, 2]) / binning - 0.5
+            warped = cv2.warpAffine(src, m, (ts, ts), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                    borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            mask = cv2.warpAffine(np.ones(src.shape[:2], dtype=np.uint8), m, (ts, ts),
+                                  flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP,
+                                  borderMode=cv2.BORDER_CONSTANT, borderValue=0).astype(bool)
+            opacity = float(p.get('opacity', 1.0))
+            if opacity >= 1:
+                tile[mask] = warped[mask]
+            elif opacity > 0:
+                tile[mask] = (warped[mask] * opacity + tile[mask] * (1 - opacity)).astype(np.uint8)
+        return tile
+
+    def iter_tiles(self, level=0, abort=None):
+        """
+        Render the tiles of one level in row-major order
+        :param abort: optional callable, the iteration stops with MosaicExportAborted once it returns True
+        :return: generator of (row0, col0, tile)
+        """
+        h, w = self.level_shape(level)[:2]
+        ts = self.tile_size
+        for tile_row in range(int(math.ceil(h / ts))):
+            for tile_col in range(int(math.ceil(w / ts))):
+                if abort is not None and abort():
+                    raise MosaicExportAborted()
+                yield tile_row * ts, tile_col * ts, self.render_tile(level, tile_row, tile_col)
+
+    def n_tiles(self, levels):
+        ts = self.tile_size
+        return sum(int(math.ceil(self.level_shape(k)[0] / ts)) * int(math.ceil(self.level_shape(k)[1] / ts))
+                   for k in range(levels))
+
+    def write(self, path, levels=None, compression='zlib', progress_callback=None, abort=None):
+        """
+        Stream the mosaic into a tiled, pyramidal tiff (.tif/.tiff) or a hdf5 file (.h5/.hdf5) with one dataset per level
+        :param path: output file
+        :param levels: number of pyramid levels, defaults to halving until the mosaic fits into one tile
+        :param compression: tile compression
+        :param progress_callback: called with the progress in percent
+        :param abort: optional callable to stop the export early
+        :return: path
+        """
+        levels = levels or self.n_levels()
+        total = self.n_tiles(levels)
+        done = [0]
+
+        def _tiles(level):
+            for row0, col0, tile in self.iter_tiles(level, abort=abort):
+                done[0] += 1
+                if progress_callback:
+                    progress_callback(done[0] / total * 100)
+                yield row0, col0, tile
+
+        ext = os.path.splitext(path)[-1].lower()
+        if ext in ('.h5', '.hdf5'):
+            self._write_hdf5(path, levels, compression, _tiles)
+        else:
+            self._write_tiff(path, levels, compression, _tiles)
+        return path
+
+    def _write_tiff(self, path, levels, compression, tiles):
+        import tifffile
+        ts = self.tile_size
+        with tifffile.TiffWriter(path, bigtiff=True) as tif:
+            for level in range(levels):
+                kwargs = {'subifds': levels - 1} if level == 0 else {'subfiletype': 1}
+                tif.write((tile for _, _, tile in tiles(level)), shape=self.level_shape(level), dtype=np.uint8,
+                          tile=(ts, ts), photometric='rgb', compression=compression, **kwargs)
+
+    def _write_hdf5(self, path, levels, compression, tiles):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("h5py is required to export the mosaic as hdf5, export it as tiff instead")
+        ts = self.tile_size
+        with h5py.File(path, 'w') as f:
+            f.attrs['origin'] = self.region[:2]
+            f.attrs['resolution'] = self.resolution
+            for level in range(levels):
+                shape = self.level_shape(level)
+                dset = f.create_dataset(f'level_{level}', shape=shape, dtype=np.uint8,
+                                        chunks=(min(ts, shape[0]), min(ts, shape[1]), 3),
+                                        compression='gzip' if compression else None)
+                for row0, col0, tile in tiles(level):
+                    h, w = min(ts, shape[0] - row0), min(ts, shape[1] - col0)
+                    dset[row0:row0 + h, col0:col0 + w] = tile[:h, :w]
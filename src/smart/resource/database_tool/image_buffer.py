@@ -1,11 +1,206 @@
 from PyQt5 import QtGui, QtCore, QtWidgets
 from PyQt5.QtCore import pyqtSignal as Signal
 import pyqtgraph.functions as fn
-import cv2, tifffile, qimage2ndarray
+import os
+import math
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import qimage2ndarray
 import pyqtgraph as pg
 from ...util.geometry_transformation import rotatePoint
-from ...resource.data_loaders.file_loader import load_im_xml
-from ...resource.data_writer.export_module import write_im_xml
+from ...resource.data_loaders.file_loader import load_im_xml, load_image_array, read_image_shape
+from ...resource.data_writer.export_module import write_im_xml, ImageDbJournal
+from ...resource.data_writer.mosaic_export import MosaicStitcher, MosaicExportAborted
+from .image_cache import ImagePreviewCache, bin_image
+from .image_residency import ImageResidencyManager
+from ...util.util import array_to_gray
+
+
+def _decode_image_entry(d, cache=None):
+    """
+    Runs inside the decode pool, all heavy lifting (file io and decompression) happens here.
+    If a preview cache is given, the cached preview is returned instead of decoding the file at full resolution.
+    :return: dict with the 'image' to display, the full resolution 'shape' and a 'thumbnail' (or None)
+    """
+    if not os.path.exists(d['Path']):
+        return None
+    if cache is not None:
+        entry = cache.get(d['Path'])
+        if entry is not None:
+            return {'image': entry['preview'], 'shape': entry['shape'], 'thumbnail': entry['thumbnail']}
+    image = load_image_array(d['Path'])
+    if image is None:
+        return None
+    thumbnail = None
+    if cache is not None:
+        thumbnail = cache.put(d['Path'], image)['thumbnail']
+    return {'image': image, 'shape': tuple(image.shape), 'thumbnail': thumbnail}
+
+
+def _probe_image_entry(d, cache=None):
+    """
+    Runs inside the decode pool for lazily loaded imagedbs. The cached preview and thumbnail are shown if the preview
+    cache has them, otherwise only the file header is read.
+    :return: dict like _decode_image_entry, with a one pixel placeholder as 'image' on a cache miss
+    """
+    if not os.path.exists(d['Path']):
+        return None
+    if cache is not None:
+        entry = cache.get(d['Path'])
+        if entry is not None:
+            return {'image': entry['preview'], 'shape': entry['shape'], 'thumbnail': entry['thumbnail']}
+    shape = read_image_shape(d['Path'])
+    if shape is None:
+        return None
+    return {'image': np.zeros((1, 1), dtype=np.uint8), 'shape': shape, 'thumbnail': None, 'placeholder': True}
+
+
+def build_image_pyramid(image, min_size=256):
+    """
+    Build the levels of detail of an image by repeated 2x2 binning.
+    :param image: full resolution image array, row-major
+    :param min_size: binning stops once the shorter edge of a level would drop below this size
+    :return: list of arrays, level 0 is the input image itself
+    """
+    levels = [image]
+    while min(levels[-1].shape[:2]) // 2 >= min_size:
+        levels.append(bin_image(levels[-1], 2))
+    return levels
+
+
+class _ImageItemNotifier(QtCore.QObject):
+    # // lives in the gui thread, hands the results of the background pool over to the image items
+    pyramidReady_sig = Signal(object, object)
+    imageLoaded_sig = Signal(object, object)
+
+    def __init__(self):
+        super(_ImageItemNotifier, self).__init__()
+        self.pyramidReady_sig.connect(self._on_pyramid_ready)
+        self.imageLoaded_sig.connect(self._on_image_loaded)
+
+    def _on_pyramid_ready(self, item, levels):
+        try:
+            item.set_pyramid(levels)
+        except RuntimeError:
+            # // the item was deleted in the meantime
+            pass
+
+    def _on_image_loaded(self, item, image):
+        try:
+            item._load_pending = False
+            # // only ever swap in finer pixels than the resident ones
+            if image is not None and image.shape[1] > item.image.shape[1]:
+                item._swap_image(image)
+            if item._full_resolution_callbacks:
+                if image is None or item.is_full_resolution():
+                    callbacks, item._full_resolution_callbacks = item._full_resolution_callbacks, []
+                    for callback in callbacks:
+                        callback(item.image if image is not None else None)
+                else:
+                    # // a coarser load was pending when the full resolution was asked for
+                    item.request_full_resolution()
+        except RuntimeError:
+            pass
+
+
+class ImageDecodeWorker(QtCore.QObject):
+    """
+    Decodes the image files of an imagedb on a pool of threads. The decoded arrays are handed over to the gui thread
+    in the order of the attribute list, so that the render order in the field view does not depend on which file
+    happens to be decoded first. The number of decoded-but-not-yet-consumed images is bounded by max_in_flight.
+    """
+    imagesDecoded_sig = Signal(object)
+    progressUpdate_sig = Signal(float)
+    finished = Signal()
+
+    def __init__(self, attr_list, max_workers=0, max_in_flight=0, cache=None, decode_func=_decode_image_entry,
+                 chunk_size=64, chunk_interval=0.25):
+        super(ImageDecodeWorker, self).__init__()
+        self.attr_list = list(attr_list)
+        self.cache = cache
+        self.decode_func = decode_func
+        # // decoded images are handed over in chunks, so that the gui adds them in batches
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+        self._chunk = []
+        self._last_flush = time.monotonic()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_in_flight = max(max_in_flight or 2 * self.max_workers, 1)
+        self._abort = False
+
+    def abort(self):
+        self._abort = True
+
+    def _hand_over(self, pending, i):
+        d, future = pending.popleft()
+        try:
+            decoded = future.result()
+        except Exception as e:
+            QtCore.qDebug(f"Failed to decode {d['Path']}: {e}")
+            decoded = None
+        self._chunk.append((d, decoded))
+        if len(self._chunk) >= self.chunk_size or time.monotonic() - self._last_flush > self.chunk_interval:
+            self._flush(i + 1)
+        return i + 1
+
+    def _flush(self, n_done):
+        if self._chunk and not self._abort:
+            self.imagesDecoded_sig.emit(self._chunk)
+            self.progressUpdate_sig.emit(n_done / len(self.attr_list) * 100)
+        self._chunk = []
+        self._last_flush = time.monotonic()
+
+    def run(self):
+        pending = deque()
+        i = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for d in self.attr_list:
+                if self._abort:
+                    break
+                pending.append((d, pool.submit(self.decode_func, d, self.cache)))
+                # // keep the pool busy but do not let decoded arrays pile up in memory
+                if len(pending) >= self.max_in_flight:
+                    i = self._hand_over(pending, i)
+            while pending and not self._abort:
+                i = self._hand_over(pending, i)
+            self._flush(i)
+            for _, future in pending:
+                future.cancel()
+        self.finished.emit()
+
+
+class MosaicExportWorker(QtCore.QObject):
+    """
+    Streams a stitched mosaic of the field to disk in a background thread, see MosaicStitcher.
+    """
+    progressUpdate_sig = Signal(float)
+    statusMessage_sig = Signal(str)
+    finished = Signal()
+
+    def __init__(self, stitcher, path):
+        super(MosaicExportWorker, self).__init__()
+        self.stitcher = stitcher
+        self.path = path
+        self._abort = False
+
+    def abort(self):
+        self._abort = True
+
+    def run(self):
+        try:
+            self.stitcher.write(self.path, progress_callback=self.progressUpdate_sig.emit, abort=lambda: self._abort)
+            self.statusMessage_sig.emit(f"Mosaic exported to {self.path}")
+        except MosaicExportAborted:
+            # // a truncated file would pass for a mosaic
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.statusMessage_sig.emit("Mosaic export aborted")
+        except Exception as e:
+            self.statusMessage_sig.emit(f"Mosaic export failed: {e}")
+        self.finished.emit()
+
 
 class ImageBufferInfo(QtCore.QObject):
     statusMessage_sig = Signal(str)
@@ -17,6 +212,28 @@ class ImageBufferInfo(QtCore.QObject):
         self.attrList = []
         self._parent = parent
         self.img_backup_path = img_backup_path
+        self.decode_thread = None
+        self.decode_worker = None
+        self.export_thread = None
+        self.export_worker = None
+        self.journal = ImageDbJournal(img_backup_path) if img_backup_path else None
+        self.cache = self._init_preview_cache()
+        self.residency = ImageResidencyManager(self._parent.settings_object.get('ImageBuffer', {}).get('memory_budget_mb', 0))
+        # // pixels of lazily loaded images are fetched for the visible part of the field (plus a margin)
+        self._parent.field.sigRangeChanged.connect(self.prefetch_viewport)
+
+    def _init_preview_cache(self):
+        settings = self._parent.settings_object.get('ImageBuffer', {})
+        if not settings.get('use_preview_cache', True):
+            return None
+        cache_dir = settings.get('preview_cache_dir', '') or os.path.join(os.path.expanduser('~'), '.smart', 'image_cache')
+        try:
+            return ImagePreviewCache(cache_dir, preview_size=int(settings.get('preview_size', 1024)),
+                                     thumbnail_size=int(settings.get('thumbnail_size', 96)),
+                                     max_mb=int(settings.get('preview_cache_mb', 2048)))
+        except OSError:
+            QtCore.qDebug(f"Preview cache disabled, cannot create {cache_dir}")
+            return None
 
     def load_imagedb(self, xml_path, exclude_file_list=[]):
         tempAttrList = load_im_xml(xml_path, exclude_file=exclude_file_list,
@@ -24,186 +241,362 @@ class ImageBufferInfo(QtCore.QObject):
         self.logMessage_sig.emit({"type": "info",
                                   "message": "imagedb data files loaded into project.",
                                   "class": "ImportDialog"})
-        for d in tempAttrList[::-1]:
-            self.load_qi(d)
+        self.start_decoding(tempAttrList[::-1])
+        return tempAttrList
+
+    def start_decoding(self, attr_list):
+        """
+        Decode the image files of attr_list in the background, each image is added to the field once it is decoded.
+        With ImageBuffer/lazy_loading only the file headers are read, the images are added as placeholders with their
+        full geometry and their pixels are loaded once they come into view.
+        :param attr_list: list of image attribute dicts, in the order they are to be added to the field
+        :return:
+        """
+        self.abort_decoding()
+        settings = self._parent.settings_object.get('ImageBuffer', {})
+        lazy = settings.get('lazy_loading', True)
+        self.decode_thread = QtCore.QThread()
+        self.decode_worker = ImageDecodeWorker(attr_list,
+                                               max_workers=int(settings.get('decode_workers', 0)),
+                                               max_in_flight=int(settings.get('max_in_flight', 0)),
+                                               cache=self.cache,
+                                               decode_func=_probe_image_entry if lazy else _decode_image_entry)
+        self.decode_worker.moveToThread(self.decode_thread)
+        self.decode_thread.started.connect(self.decode_worker.run)
+        # // queued connections, the items are created in the gui thread
+        self.decode_worker.imagesDecoded_sig.connect(self._on_images_decoded)
+        self.decode_worker.progressUpdate_sig.connect(self.progressUpdate_sig)
+        self.decode_worker.finished.connect(self.decode_thread.quit)
+        self.decode_worker.finished.connect(self._on_decoding_finished)
+        self.statusMessage_sig.emit(f"Decoding {len(attr_list)} images in the background ...")
+        self.decode_thread.start()
+
+    def abort_decoding(self):
+        # // stop a running decode job, images which are not yet in the field are dropped
+        if self.decode_worker is not None:
+            self.decode_worker.abort()
+        if self.decode_thread is not None:
+            self.decode_thread.quit()
+            self.decode_thread.wait()
+        self.decode_worker = None
+        self.decode_thread = None
+
+    def _on_images_decoded(self, entries):
+        if self.sender() is not self.decode_worker:
+            return
+        self.load_qi_batch([(d, decoded) for d, decoded in entries if decoded is not None])
+
+    def _on_decoding_finished(self):
+        if self.sender() is not self.decode_worker:
+            return
         self._parent.tbl_render_order.resizeRowsToContents()
         self._parent.tbl_render_order.setColumnWidth(0, 55)
-        return tempAttrList
+        self.statusMessage_sig.emit("All images of the imagedb are loaded.")
+        self._parent.highlightFirstImg()
+        self.prefetch_viewport()
+
+    def prefetch_viewport(self, *args):
+        """
+        Request the pixels of the images which intersect the field viewport enlarged by ImageBuffer/prefetch_margin
+        (fraction of the viewport size on every side). Images inside the viewport also load on their own once painted,
+        the margin makes panning show them without waiting.
+        :return:
+        """
+        field = self._parent.field
+        margin = float(self._parent.settings_object.get('ImageBuffer', {}).get('prefetch_margin', 0.5))
+        (x0, x1), (y0, y1) = field.viewRange()
+        dx, dy = (x1 - x0) * margin, (y1 - y0) * margin
+        view_pixel_size = max(field.viewPixelSize())
+        for img in field.images_in_rect(x0 - dx, y0 - dy, x1 + dx, y1 + dy):
+            if isinstance(img, ImageBufferObject):
+                img.prefetch(view_pixel_size)
+
+    def mosaic_placements(self):
+        """
+        Placement of every visible image in the field, in paint order (bottom first), see MosaicStitcher
+        :return: list of placement dicts
+        """
+        images = [(i, img) for i, img in enumerate(self._parent.field_img)
+                  if isinstance(img, ImageBufferObject) and img.isVisible()]
+        # // field_img starts with the top image, equal z values are painted in reverse list order
+        images.sort(key=lambda e: (e[1].zValue(), -e[0]))
+        placements = []
+        for _, img in images:
+            placement = img.placement()
+            # // images which were never loaded have no display levels yet, the stitcher uses their value range
+            levels = None if img._auto_levels_pending else img.getLevels()
+            placement.update(levels=None if levels is None else np.array(levels), opacity=img.opacity())
+            placements.append(placement)
+        return placements
 
-    def load_qi(self, d, showGUI=False):
+    def apply_view_corrections(self, corrections):
+        """
+        Move images by view space corrections (e.g. from a batch registration) and store them in one backup update
+        :param corrections: dict ImageBufferObject -> 3x3 matrix acting on view coordinates
+        :return:
+        """
+        for img, m in corrections.items():
+            a = np.vstack([img.view_affine(), (0, 0, 1)])
+            a = m @ a
+            h, w = img.image_shape[:2]
+            center = a[:2, :2] @ (w / 2, h / 2) + a[:2, 2]
+            scale = math.sqrt(abs(np.linalg.det(m[:2, :2])))
+            size = (img.attrs['Size'][0] * scale, img.attrs['Size'][1] * scale)
+            rotation = img.attrs.get('Rotation', 0) + math.degrees(math.atan2(m[1, 0], m[0, 0]))
+            img.set_placement(center, size, rotation)
+            for i, n in enumerate(self.attrList):
+                if n['Path'] == img.attrs['Path']:
+                    self.attrList[i] = img.attrs
+        # // one full write instead of a journal record per image
+        self.writeImgBackup()
+        self._parent.field.update()
+
+    def export_mosaic(self, path, resolution=None, region=None):
+        """
+        Stitch the visible images into one tiled, pyramidal tiff or hdf5 file in the background
+        :param path: output file, .tif/.tiff or .h5/.hdf5
+        :param resolution: mosaic pixel size in field units, defaults to ImageBuffer/mosaic_resolution or the finest image
+        :param region: (x0, y0, x1, y1) in field units, defaults to all visible images
+        :return:
+        """
+        if self.export_running():
+            self.statusMessage_sig.emit("A mosaic export is already running.")
+            return
+        settings = self._parent.settings_object.get('ImageBuffer', {})
+        try:
+            stitcher = MosaicStitcher(self.mosaic_placements(),
+                                      resolution=resolution or float(settings.get('mosaic_resolution', 0)) or None,
+                                      region=region,
+                                      tile_size=int(settings.get('mosaic_tile_size', 1024)),
+                                      cache_mb=float(settings.get('mosaic_cache_mb', 1024)))
+        except ValueError as e:
+            self.statusMessage_sig.emit(str(e))
+            return
+        self.export_thread = QtCore.QThread()
+        self.export_worker = MosaicExportWorker(stitcher, path)
+        self.export_worker.moveToThread(self.export_thread)
+        self.export_thread.started.connect(self.export_worker.run)
+        self.export_worker.progressUpdate_sig.connect(self.progressUpdate_sig)
+        self.export_worker.statusMessage_sig.connect(self.statusMessage_sig)
+        self.export_worker.finished.connect(self.export_thread.quit)
+        h, w = stitcher.level_shape(0)[:2]
+        self.statusMessage_sig.emit(f"Exporting a {w} x {h} mosaic to {path} ...")
+        self.export_thread.start()
+
+    def export_running(self):
+        return self.export_thread is not None and self.export_thread.isRunning()
+
+    def abort_export(self, wait=True):
+        """
+        Stop a running mosaic export, the worker stops after the tile in flight and the partial file is removed
+        :param wait: block until the worker has stopped, e.g. before the workspace is cleared or the program exits
+        :return:
+        """
+        if self.export_worker is not None:
+            self.export_worker.abort()
+        if not wait:
+            return
+        if self.export_thread is not None:
+            self.export_thread.quit()
+            self.export_thread.wait()
+        self.export_worker = None
+        self.export_thread = None
+
+    def load_qi(self, d, showGUI=False, decoded=None):
         """
         This loads an image based on a dictionary of keys
         :param showGUI:
         :param d: the dictionary. It must have a Path, Center, Size, and Name keys as minimum
+        :param decoded: result of _decode_image_entry done in the background, if None the file is decoded here
         :return:
         """
-        import os
-        image = None
-        if os.path.exists(d['Path']):
-            if os.path.splitext(d['Path'])[-1].lower() == ".bmp":
-                qi = QtGui.QPixmap(d['Path'])
-                image = cv2.imread(d['Path'])
-            elif os.path.splitext(d['Path'])[-1].lower() == ".jpg" or os.path.splitext(d['Path'])[
-                -1].lower() == ".jpeg":
-                qi = QtGui.QPixmap(d['Path'])
-                image = cv2.imread(d['Path'])
-            elif os.path.splitext(d['Path'])[-1].lower() == ".png":
-                qi = QtGui.QPixmap(d['Path'])
-                image = cv2.imread(d['Path'])
-                if not qi:
-                    # // try to copy the png to bmp and import it. This is a workaround as the PNG is actually a BMP
-                    import shutil
-                    new_file = os.path.join(os.path.splitext(d['Path'])[0] + ".bmp")
-                    shutil.copy(d['Path'], new_file)
-                    qi = QtGui.QPixmap()
-                    ret = qi.load(new_file, format="BMP")
-            elif os.path.splitext(d['Path'])[-1].lower() == ".tif" or os.path.splitext(d['Path'])[
-                -1].lower() == ".tiff":
-                image = tifffile.imread(d['Path'])
-                # image = cv2.convertScaleAbs(image, alpha=0.001, beta=50)
-                qimage= qimage2ndarray.array2qimage(image)
-                qi = QtGui.QPixmap(qimage)
-            else:
-                QtCore.qDebug("Image format not supported")
-                qi = None
-        else:
+        self.load_qi_batch([(d, decoded)])
+
+    def _decode_or_report(self, d):
+        if not os.path.exists(d['Path']):
             QtCore.qDebug("Path not found")
-            qi = None
-
-        if qi:
-            # // load the center and size keys into the dict using the aspect reatio tool (if needed)
-            if ("Center" not in d.keys()):
-                if ("Outline" not in d.keys()):
-                    # // set the center to the current center in the workspace
-                    d["Center"] = [0] * 3
-                    d["Center"][0] = self._parent.X_controller_travel//2
-                    d["Center"][1] = self._parent.Y_controller_travel//2
-                    d["Center"][2] = 0
-                else:
-                    # // calculate the center based on the outline
-                    d["Center"] = [0] * 3
-                    d["Center"][0] = abs(d["Outline"][1] - d["Outline"][0]) / 2.0 + d["Outline"][0]
-                    d["Center"][1] = abs(d["Outline"][3] - d["Outline"][2]) / 2.0 + d["Outline"][2]
-                    d["Center"][2] = abs(d["Outline"][5] - d["Outline"][4]) / 2.0 + d["Outline"][4]
-
-            if ("Size" not in d.keys()):
-                if ("Outline" not in d.keys()):
-                    d["Size"] = (qi.size().width(), qi.size().height(), 1)
-                else:
-                    d["Size"] = (abs(d["Outline"][1] - d["Outline"][0]),\
-                                 abs(d["Outline"][3] - d["Outline"][2]),\
-                                 abs(d["Outline"][5] - d["Outline"][4]))
-
-            if "Outline" not in d.keys():
-                if "Center" in d.keys() and "Size" in d.keys():
-                    d["Outline"] = [0] * 6
-                    d["Outline"][0] = d["Center"][0] - d["Size"][0] / 2
-                    d["Outline"][1] = d["Center"][0] + d["Size"][0] / 2
-                    d["Outline"][2] = d["Center"][1] - d["Size"][1] / 2
-                    d["Outline"][3] = d["Center"][1] + d["Size"][1] / 2
-                    if len(d["Size"]) > 2 and len(d["Center"]) > 2:
-                        d["Outline"][4] = d["Center"][2] - d["Size"][2] / 2
-                        d["Outline"][5] = d["Center"][2] + d["Size"][2] / 2
-
-            if 'StageCoords_TL' not in d.keys():#top left stage coordinates
-                d['StageCoords_TL'] = (0,0,0)
+            return None
+        decoded = _decode_image_entry(d, self.cache)
+        if decoded is None:
+            QtCore.qDebug("Image format not supported")
+        return decoded
+
+    def load_qi_batch(self, entries):
+        """
+        Add a batch of images to the field in one go: the items are created first, then the render table receives
+        all rows at once, and the view is auto ranged once. The result is the same as calling load_qi for every entry.
+        :param entries: list of (d, decoded) tuples, entries without decoded result are decoded here in parallel
+        :return: list of the ImageBufferObject created
+        """
+        missing = [i for i, (_, decoded) in enumerate(entries) if decoded is None]
+        if len(missing) > 0:
+            entries = list(entries)
+            max_workers = int(self._parent.settings_object.get('ImageBuffer', {}).get('decode_workers', 0)) or os.cpu_count() or 1
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for i, decoded in zip(missing, pool.map(lambda i: self._decode_or_report(entries[i][0]), missing)):
+                    entries[i] = (entries[i][0], decoded)
+
+        created = []
+        for d, decoded in entries:
+            if decoded is not None:
+                created.append((self._create_image_item(d, decoded), decoded))
+        if len(created) == 0:
+            return []
+
+        # // the last image of the batch ends up on top, as if the images were added one after the other
+        new_items = created[::-1]
+        tbl = self._parent.tbl_render_order
+        tbl.setUpdatesEnabled(False)
+        tbl.blockSignals(True)
+        try:
+            tbl.model().insertRows(0, len(new_items))
+            for row, (img, decoded) in enumerate(new_items):
+                self._fill_render_row(row, img, decoded['thumbnail'])
+        finally:
+            tbl.blockSignals(False)
+            tbl.setUpdatesEnabled(True)
+        self._parent.field_img[:0] = [img for img, _ in new_items]
+        self._parent.field_list[:0] = [img.loc for img, _ in new_items]
+
+        # // set current image in the field view
+        self._parent.update_field_current = new_items[0][0]
+        self._parent.hist.setImageItem(new_items[0][0])
+        self._parent.field.autoRange(padding=0.02)
+
+        for img, _ in created:
+            self.addImgBackup(img.loc)
+        return [img for img, _ in created]
+
+    def _create_image_item(self, d, decoded):
+        """
+        Create the ImageBufferObject of an image and place it in the field
+        :param d: the attribute dictionary of the image, missing geometry keys are filled in
+        :param decoded: result of _decode_image_entry
+        :return: the ImageBufferObject
+        """
+        # // the displayed image might be a cached preview, geometry is always derived from the full resolution shape
+        image = decoded['image']
+        image_h, image_w = decoded['shape'][:2]
+
+        # // load the center and size keys into the dict using the aspect reatio tool (if needed)
+        if ("Center" not in d.keys()):
+            if ("Outline" not in d.keys()):
+                # // set the center to the current center in the workspace
+                d["Center"] = [0] * 3
+                d["Center"][0] = self._parent.X_controller_travel//2
+                d["Center"][1] = self._parent.Y_controller_travel//2
+                d["Center"][2] = 0
             else:
-                d['StageCoords_TL'] = eval(d['StageCoords_TL'])
-            aspect_ratio = []
-            aspect_ratio.append(d["Outline"][1] - d["Outline"][0])
-            aspect_ratio.append(d["Outline"][3] - d["Outline"][2])
-            aspect_ratio.append(d["Outline"][5] - d["Outline"][4])
-            try:
-                aspect_ratio[0] /= qi.size().width()
-                aspect_ratio[1] /= qi.size().height()
-            except:
-                aspect_ratio[0] /= d['Size'][0]
-                aspect_ratio[1] /= d['Size'][1]
-
-            aspect_ratio[2] /= 1
-            d.update({'AspectRatio': aspect_ratio})
-
-            if "Opacity" in d.keys():
-                opa = float(d["Opacity"])
-                if opa > 100:
-                    opa = 100
-                elif opa < 0:
-                    opa = 0
+                # // calculate the center based on the outline
+                d["Center"] = [0] * 3
+                d["Center"][0] = abs(d["Outline"][1] - d["Outline"][0]) / 2.0 + d["Outline"][0]
+                d["Center"][1] = abs(d["Outline"][3] - d["Outline"][2]) / 2.0 + d["Outline"][2]
+                d["Center"][2] = abs(d["Outline"][5] - d["Outline"][4]) / 2.0 + d["Outline"][4]
+
+        if ("Size" not in d.keys()):
+            if ("Outline" not in d.keys()):
+                d["Size"] = (image_w, image_h, 1)
             else:
+                d["Size"] = (abs(d["Outline"][1] - d["Outline"][0]),\
+                             abs(d["Outline"][3] - d["Outline"][2]),\
+                             abs(d["Outline"][5] - d["Outline"][4]))
+
+        if "Outline" not in d.keys():
+            if "Center" in d.keys() and "Size" in d.keys():
+                d["Outline"] = [0] * 6
+                d["Outline"][0] = d["Center"][0] - d["Size"][0] / 2
+                d["Outline"][1] = d["Center"][0] + d["Size"][0] / 2
+                d["Outline"][2] = d["Center"][1] - d["Size"][1] / 2
+                d["Outline"][3] = d["Center"][1] + d["Size"][1] / 2
+                if len(d["Size"]) > 2 and len(d["Center"]) > 2:
+                    d["Outline"][4] = d["Center"][2] - d["Size"][2] / 2
+                    d["Outline"][5] = d["Center"][2] + d["Size"][2] / 2
+
+        if 'StageCoords_TL' not in d.keys():#top left stage coordinates
+            d['StageCoords_TL'] = (0,0,0)
+        else:
+            d['StageCoords_TL'] = eval(d['StageCoords_TL'])
+        aspect_ratio = []
+        aspect_ratio.append(d["Outline"][1] - d["Outline"][0])
+        aspect_ratio.append(d["Outline"][3] - d["Outline"][2])
+        aspect_ratio.append(d["Outline"][5] - d["Outline"][4])
+        try:
+            aspect_ratio[0] /= image_w
+            aspect_ratio[1] /= image_h
+        except:
+            aspect_ratio[0] /= d['Size'][0]
+            aspect_ratio[1] /= d['Size'][1]
+
+        aspect_ratio[2] /= 1
+        d.update({'AspectRatio': aspect_ratio})
+
+        if "Opacity" in d.keys():
+            opa = float(d["Opacity"])
+            if opa > 100:
                 opa = 100
+            elif opa < 0:
+                opa = 0
+        else:
+            opa = 100
 
-            # // calculate the outline based on the center and size
-            img = ImageBufferObject(image = image, width=d['Size'][0], height=d['Size'][1],
-                                    pos=(d["Outline"][0], d["Outline"][2]), pixmap=qi, opacity=opa,
-                                    attrs=d)
-            self._parent.field.addItem(img)
-            # if os.path.splitext(d['Path'])[-1].lower() == ".tif" or os.path.splitext(d['Path'])[
-                # -1].lower() == ".tiff":
-                # img.setImage(image)
-            self._parent.hist.setImageItem(img)
-            # // reset the scale for rotation
-            s = list(img._scale)
-            if s[0] == 0:
-                s[0] = 1
-            if s[1] == 0:
-                s[1] = 1
-
-            # img.scale(1 / s[0], 1 / s[1])
-            tr = QtGui.QTransform()
-            tr.scale(1 / s[0], 1 / s[1])
-            img.setTransform(tr)
-
-            if not "Rotation" in d.keys():
-                d["Rotation"] = 0
-            # img.rotate(d['Rotation'])
-            img.setRotation(d["Rotation"])
-            # img.scale(s[0], s[1])
-            tr = QtGui.QTransform()
-            tr.scale(s[0], s[1])
-            img.setTransform(tr)
+        # // calculate the outline based on the center and size
+        img = ImageBufferObject(image = image, width=d['Size'][0], height=d['Size'][1],
+                                pos=(d["Outline"][0], d["Outline"][2]), opacity=opa,
+                                attrs=d, image_shape=decoded['shape'], cache=self.cache, residency=self.residency,
+                                placeholder=decoded.get('placeholder', False))
+        self._parent.field.addItem(img)
+        img.build_pyramid(min_size=int(self._parent.settings_object.get('ImageBuffer', {}).get('pyramid_min_size', 256)))
+        # // reset the scale for rotation
+        s = list(img._scale)
+        if s[0] == 0:
+            s[0] = 1
+        if s[1] == 0:
+            s[1] = 1
 
-            # // apply coordinate transformation for rotation in the XY plane
-            
-            v = rotatePoint(centerPoint=d['Center'], point=[d["Outline"][0], d["Outline"][2]],
-                            angle=d['Rotation'])
-            img.setPos(pg.Point(v[0], v[1]))
-            self._parent.field.autoRange(padding=0.02)
-            self._parent.field_img.insert(0, img)
-            # // set current image in the field view
-            self._parent.update_field_current = img
-            # // attach the label to the image
-            img.loc = d
-
-            # // add to the renderlist
-            rowPosition = 0
-            self._parent.tbl_render_order.insertRow(rowPosition)
-
-            cb = QtWidgets.QTableWidgetItem()
-            cb.setBackground(QtGui.QColor("#368AD4"))
-            cb.setCheckState(QtCore.Qt.CheckState.Checked)
-            self._parent.tbl_render_order.setItem(rowPosition, 0, cb)
-            self._parent.field_list.insert(0, img.loc)
-            self._parent.tbl_render_order.itemClicked.connect(lambda item: self._parent.on_table_order_clicked(item))
-
-            sb = QtWidgets.QSpinBox()
-            sb.setRange(0, 100)
-            sb.setValue(int(opa))
-            sb.editingFinished.connect(self.update_opacity)
-            self._parent.tbl_render_order.setCellWidget(rowPosition, 1, sb)
-            sb.loc = img.loc
-
-            p = QtWidgets.QTableWidgetItem(d["Name"])
-            p.loc = d
-
-            self._parent.tbl_render_order.setItem(rowPosition, 2, p)
-
-            if showGUI:
-                pass
-                # // add the image to the imagebuffer
-            # self._parent.update_geo()
-            # self.addImgBackup(self._parent.attrs_geo)
-            img.loc = d
-            self.addImgBackup(d)
+        # img.scale(1 / s[0], 1 / s[1])
+        tr = QtGui.QTransform()
+        tr.scale(1 / s[0], 1 / s[1])
+        img.setTransform(tr)
+
+        if not "Rotation" in d.keys():
+            d["Rotation"] = 0
+        # img.rotate(d['Rotation'])
+        img.setRotation(d["Rotation"])
+        # img.scale(s[0], s[1])
+        tr = QtGui.QTransform()
+        tr.scale(s[0], s[1])
+        img.setTransform(tr)
+
+        # // apply coordinate transformation for rotation in the XY plane
+        
+        v = rotatePoint(centerPoint=d['Center'], point=[d["Outline"][0], d["Outline"][2]],
+                        angle=d['Rotation'])
+        img.setPos(pg.Point(v[0], v[1]))
+        # // attach the label to the image
+        img.loc = d
+        return img
+
+    def _fill_render_row(self, rowPosition, img, thumbnail=None):
+        # // add to the renderlist, the row has to exist already
+        d = img.loc
+        cb = QtWidgets.QTableWidgetItem()
+        cb.setBackground(QtGui.QColor("#368AD4"))
+        cb.setCheckState(QtCore.Qt.CheckState.Checked)
+        self._parent.tbl_render_order.setItem(rowPosition, 0, cb)
+
+        sb = QtWidgets.QSpinBox()
+        sb.setRange(0, 100)
+        sb.setValue(int(round(img.opacity() * 100)))
+        sb.editingFinished.connect(self.update_opacity)
+        self._parent.tbl_render_order.setCellWidget(rowPosition, 1, sb)
+        sb.loc = d
+
+        p = QtWidgets.QTableWidgetItem(d["Name"])
+        if thumbnail is not None:
+            p.setIcon(QtGui.QIcon(QtGui.QPixmap(qimage2ndarray.array2qimage(thumbnail, normalize=True))))
+        p.loc = d
+
+        self._parent.tbl_render_order.setItem(rowPosition, 2, p)
 
     def update_opacity(self):
         sb = self.sender()
@@ -211,17 +604,44 @@ class ImageBufferInfo(QtCore.QObject):
             ind = self._parent.field_list.index(sb.loc)
             self._parent.field_img[ind].setOpacity(sb.value() / 100.0)
             sb.loc["Opacity"] = sb.value()
-            self.writeImgBackup()
+            self.journalImgBackup('update', sb.loc)
 
     def addImgBackup(self, dict_image):
         # // function to add a dataset to current backup file
-        self.attrList.append(dict_image)
-        self.writeImgBackup()
+        for i, n in enumerate(self.attrList):
+            if n["Path"] == dict_image["Path"]:
+                if n is dict_image:
+                    # // already part of the backup file, e.g. when recalling it
+                    return
+                self.attrList[i] = dict_image
+                break
+        else:
+            self.attrList.append(dict_image)
+        self.journalImgBackup('add', dict_image)
+
+    def journalImgBackup(self, op, dict_image):
+        """
+        Record a single change in the journal of the backup file, instead of rewriting the whole file.
+        The journal is folded into the backup file once it holds ImageBuffer/journal_compact_every records.
+        :param op: 'add', 'update' or 'remove'
+        :param dict_image: attribute dict of the changed image
+        :return:
+        """
+        if self.journal is None:
+            return
+        n = self.journal.record(op, dict_image)
+        compact_every = int(self._parent.settings_object.get('ImageBuffer', {}).get('journal_compact_every', 200))
+        if n >= compact_every:
+            self.writeImgBackup()
 
     def writeImgBackup(self, path = None):
         # // flushes the current image buffer to the backup file
         if path == None:
+            if not self.img_backup_path:
+                return
             write_im_xml(self.img_backup_path, self.attrList, distributed=True)
+            # // the backup file holds the complete state now
+            self.journal.reset()
         else:
             write_im_xml(path, self.attrList, distributed=True)
 
@@ -237,8 +657,8 @@ class ImageBufferInfo(QtCore.QObject):
                 # // found match
                 self.attrList[i] = newDict
 
-        # // update the backup file by refreshing
-        self.writeImgBackup()
+        # // update the backup file by journaling the change
+        self.journalImgBackup('update', newDict)
 
     def removeImgBackup(self, d):
         """
@@ -253,8 +673,8 @@ class ImageBufferInfo(QtCore.QObject):
                 # // found match
                 del self.attrList[i]
 
-        # // remove from the backup file by refreshing
-        self.writeImgBackup()
+        # // remove from the backup file by journaling the change
+        self.journalImgBackup('remove', d)
 
     def writeimagedb(self, xml_path):
         # // save the image buffer to a specified location
@@ -310,47 +730,46 @@ class ImageBufferInfo(QtCore.QObject):
             pass
 
     def recallImgBackup(self):
-        import os
         # // recall the previous imagedb if the path is valid
         if self.img_backup_path:
+            # // fold changes of the last session which were not compacted yet into the backup file
+            self.journal.compact()
             if os.path.exists(self.img_backup_path):
                 dict_list = self.load_imagedb(xml_path=self.img_backup_path)
-                # self.attrList = dict_list
+                self.attrList = dict_list
 
 
 # class ImageBufferObject(pg.GraphicsObject):
 class ImageBufferObject(pg.ImageItem):
     """
-    This class is meant for displaying a picture in the field view, without listing it in the field render list
+    This class is meant for displaying a picture in the field view, without listing it in the field render list.
+    Once the image pyramid is built, the level matching the current zoom is rendered instead of the full image,
+    so that the cost of drawing the field scales with the screen pixels rather than with the image pixels.
     """
+    _pool = None
+    _notifier = None
 
-    def __init__(self, image = None, width=None, height=None, pos=(0, 0), rot=0, Visible=True, pixmap=None, attrs={}, opacity=100):
+    def __init__(self, image = None, width=None, height=None, pos=(0, 0), rot=0, Visible=True, attrs={}, opacity=100, image_shape=None,
+                 cache=None, residency=None, placeholder=False):
         pg.ImageItem.__init__(self, image)
         self.width = width
         self.height = height
         self.axisOrder = 'row-major'
         self._scale = [1, 1]
         self.attrs = attrs
-        if not image.any() and (pixmap is not None):
-            self.setPixmap(pixmap)
-            self.pixmap = pixmap
-        else:
-            self.pixmap = pixmap
+        # // the resident image might be a downsampled preview, the item geometry always refers to the full resolution
+        self.image_shape = tuple(image_shape) if image_shape is not None else tuple(image.shape)
 
         if width is not None and height is None:
-            # s = float(width) / self.pixmap.width()
-            s = float(width) / self.image.shape[1]
+            s = float(width) / self.image_shape[1]
             self.scale(s, s)
             self._scale = (s, s)
         elif height is not None and width is None:
-            # s = float(height) / self.pixmap.height()
-            s = float(height) / self.image.shape[0]
+            s = float(height) / self.image_shape[0]
             self.scale(s, s)
             self._scale = (s, s)
-        elif width is not None and height is not None and (self.image.shape[0] > 0) and (self.image.shape[1] > 0):
-            # self._scale = (float(width) / self.pixmap.width(), float(height) / self.pixmap.height())
-            self._scale = (float(width) / self.image.shape[1], float(height) / self.image.shape[0])
-            # self.scale(self._scale[0], self._scale[1])
+        elif width is not None and height is not None and (self.image_shape[0] > 0) and (self.image_shape[1] > 0):
+            self._scale = (float(width) / self.image_shape[1], float(height) / self.image_shape[0])
             tr = QtGui.QTransform()
             tr.scale(self._scale[0], self._scale[1])
             self.setTransform(tr)
@@ -361,23 +780,314 @@ class ImageBufferObject(pg.ImageItem):
 
         self.setOpacity(opacity / 100)
         self.border = None
+        self._pyramid = []
+        self._pyramid_min_size = 256
+        self._lod_current = 0
+        self._load_pending = False
+        self._full_resolution_callbacks = []
+        # // the levels of a placeholder are meaningless, they are set from the first real pixels
+        self._auto_levels_pending = placeholder
+        self.cache = cache
+        self.residency = residency
+        if self.residency is not None:
+            self.residency.account(self)
 
-    def update_dim(self, new_dims):
-        self.width, self.height = new_dims
+    @classmethod
+    def _background(cls):
+        if cls._pool is None:
+            cls._pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+            cls._notifier = _ImageItemNotifier()
+        return cls._pool, cls._notifier
+
+    def gray_array(self):
+        """
+        Grayscale version of the full resolution pixels, as used by the registration and particle tools. Decodes the
+        file right away if only a preview is resident, see gray_array_async to keep the gui responsive.
+        :return: 2d float array
+        """
+        return array_to_gray(self.ensure_full_resolution())
+
+    def gray_array_async(self, callback):
+        """
+        Like gray_array, the file is decoded in the background if only a preview is resident
+        :param callback: called in the gui thread with the 2d float array, or None if the file could not be decoded
+        """
+        self.with_full_resolution(lambda image: callback(None if image is None else array_to_gray(image)))
+
+    def resident_gray_value(self, row, col):
+        """
+        Grayscale intensity at a full resolution pixel, read from the resident pixels without decoding the file
+        :return: float, or None outside the image
+        """
+        if self.image is None or not (0 <= row < self.image_shape[0] and 0 <= col < self.image_shape[1]):
+            return None
+        ds = self._resident_downsampling()
+        row, col = min(int(row / ds), self.image.shape[0] - 1), min(int(col / ds), self.image.shape[1] - 1)
+        return float(array_to_gray(self.image[row:row + 1, col:col + 1])[0, 0])
+
+    def view_affine(self):
+        """
+        Placement of the image in the field
+        :return: 2x3 matrix mapping full resolution pixel coordinates (column, row) to view coordinates
+        """
+        o = self.mapToParent(QtCore.QPointF(0, 0))
+        ex = self.mapToParent(QtCore.QPointF(1, 0))
+        ey = self.mapToParent(QtCore.QPointF(0, 1))
+        return np.array([[ex.x() - o.x(), ey.x() - o.x(), o.x()],
+                         [ex.y() - o.y(), ey.y() - o.y(), o.y()]])
+
+    def placement(self):
+        # // picklable description of the image and its placement, for the headless mosaic and registration tools
+        return {'path': self.attrs['Path'], 'shape': tuple(self.image_shape), 'affine': self.view_affine()}
+
+    def set_placement(self, center, size, rotation):
+        """
+        Move the image and update its attribute dict, the previous outline and rotation are kept as
+        Outline_r/Rotation_r for restoring them
+        :param center: new center (x, y) in view coordinates
+        :param size: new (width, height) in view units
+        :param rotation: new rotation in degrees
+        :return:
+        """
+        d = self.attrs
+        d.setdefault('Outline_r', list(d['Outline']))
+        d.setdefault('Rotation_r', d.get('Rotation', 0))
+        c = list(d.get('Center', [0, 0, 0]))
+        c[0], c[1] = float(center[0]), float(center[1])
+        d['Center'] = c
+        s = list(d.get('Size', (0, 0, 1)))
+        s[0], s[1] = float(size[0]), float(size[1])
+        d['Size'] = tuple(s)
+        outline = list(d['Outline'])
+        outline[:4] = [c[0] - s[0] / 2, c[0] + s[0] / 2, c[1] - s[1] / 2, c[1] + s[1] / 2]
+        d['Outline'] = outline
+        d['Rotation'] = float(rotation)
+        aspect_ratio = list(d.get('AspectRatio', [1, 1, 1]))
+        aspect_ratio[0], aspect_ratio[1] = s[0] / self.image_shape[1], s[1] / self.image_shape[0]
+        d['AspectRatio'] = aspect_ratio
+
+        # // same geometry as set up in ImageBufferInfo._create_image_item
+        self._scale = (aspect_ratio[0], aspect_ratio[1])
+        tr = QtGui.QTransform()
+        tr.scale(self._scale[0], self._scale[1])
+        self.setTransform(tr)
+        self.setRotation(d['Rotation'])
+        v = rotatePoint(centerPoint=c, point=[outline[0], outline[2]], angle=d['Rotation'])
+        self.setPos(pg.Point(v[0], v[1]))
+        self.loc = d
+
+    def is_full_resolution(self):
+        return self.image is not None and tuple(self.image.shape[:2]) == tuple(self.image_shape[:2])
+
+    def ensure_full_resolution(self):
+        """
+        Load the full resolution pixels right away, e.g. before an image is registered
+        :return: the full resolution image array
+        """
+        if not self.is_full_resolution():
+            image = load_image_array(self.attrs['Path'])
+            if image is not None:
+                self._swap_image(image)
+        return self.image
+
+    def with_full_resolution(self, callback):
+        """
+        Call back with the full resolution pixels, right away if they are resident, otherwise once the background
+        pool has decoded them
+        :param callback: called in the gui thread with the image array, or None if the file could not be decoded
+        """
+        if self.is_full_resolution():
+            callback(self.image)
+            return
+        self._full_resolution_callbacks.append(callback)
+        self.request_full_resolution()
+
+    def _resident_downsampling(self):
+        # // binning factor of the resident pixels relative to the full resolution
+        return self.image_shape[1] / self.image.shape[1]
+
+    def request_full_resolution(self):
+        self.request_resolution(1)
+
+    def request_resolution(self, ds):
+        """
+        Load pixels fine enough for the given screen downsampling in the background, the resident pixels are shown
+        until they arrive. The cached preview is used whenever it is fine enough, otherwise the file is decoded.
+        :param ds: number of full resolution pixels per screen pixel
+        :return:
+        """
+        if self._load_pending or self.is_full_resolution():
+            return
+        self._load_pending = True
+        pool, notifier = self._background()
+        path, shape, cache = self.attrs['Path'], self.image_shape, self.cache
+
+        def _load():
+            if cache is not None and cache.preview_factor(shape) <= ds:
+                entry = cache.get(path)
+                if entry is not None:
+                    return entry['preview']
+            return load_image_array(path)
+
+        def _done(future):
+            image = future.result() if future.exception() is None else None
+            notifier.imageLoaded_sig.emit(self, image)
+
+        pool.submit(_load).add_done_callback(_done)
+
+    def prefetch(self, view_pixel_size):
+        """
+        Request pixels fine enough for the current zoom before the item gets painted
+        :param view_pixel_size: size of one screen pixel in view coordinates
+        :return:
+        """
+        ds = view_pixel_size / max(abs(self._scale[0]), abs(self._scale[1]))
+        if ds < self._resident_downsampling():
+            self.request_resolution(ds)
 
-    def setPixmap(self, pixmap):
-        self.pixmap = pixmap
+    def _swap_image(self, image):
+        # // replace the resident pixels, position, rotation and scale of the item in the scene stay untouched
+        pg.ImageItem.setImage(self, image, autoLevels=self._auto_levels_pending)
+        self._auto_levels_pending = False
+        self._pyramid = []
+        self.build_pyramid(self._pyramid_min_size)
+        if self.residency is not None:
+            self.residency.account(self)
+
+    def nbytes(self):
+        # // memory held by the resident pixels and their pyramid, memory-mapped pixels are backed by the file
+        levels = self._pyramid if self._pyramid and self._pyramid[0] is self.image else [self.image]
+        return sum(level.nbytes for level in levels if level is not None and not isinstance(level, np.memmap))
+
+    def is_in_view(self):
+        # // whether any part of the item is inside the visible range of its view box
+        vb = self.getViewBox()
+        if vb is None or not self.isVisible() or not hasattr(vb, 'viewRect'):
+            return False
+        return vb.viewRect().intersects(self.mapRectToView(self.boundingRect()))
+
+    def evict(self):
+        """
+        Drop the resident pixels and keep only a small stand-in, called by the residency manager
+        :return:
+        """
+        if self.image is None:
+            return
+        if self._pyramid and self._pyramid[0] is self.image and len(self._pyramid) > 1:
+            stand_in = self._pyramid[-1]
+        else:
+            stand_in = bin_image(self.image, math.ceil(max(self.image.shape[:2]) / self._pyramid_min_size))
+        if stand_in is self.image:
+            return
+        pg.ImageItem.setImage(self, stand_in, autoLevels=False)
+        self._pyramid = [stand_in]
+
+    def build_pyramid(self, min_size=256):
+        """
+        Build the levels of detail in the background, the item keeps rendering the resident image until they are ready
+        :param min_size: shorter edge of the coarsest level
+        :return:
+        """
+        self._pyramid_min_size = min_size
+        if self.image is None:
+            return
+        pool, notifier = self._background()
+
+        def _done(future):
+            if future.exception() is None:
+                notifier.pyramidReady_sig.emit(self, future.result())
+
+        pool.submit(build_image_pyramid, self.image, min_size).add_done_callback(_done)
+
+    def set_pyramid(self, levels):
+        if not levels or levels[0] is not self.image:
+            # // the image changed since the pyramid was requested
+            return
+        self._pyramid = levels
+        self._renderRequired = True
         self.update()
 
-    def paint_(self, p, *args):
-        p.setRenderHint(p.Antialiasing)
-        p.drawPixmap(0, 0, self.pixmap)
+    def _screen_downsampling(self):
+        # // number of full resolution pixels covered by one screen pixel
+        o = self.mapToDevice(QtCore.QPointF(0, 0))
+        x = self.mapToDevice(QtCore.QPointF(1, 0))
+        y = self.mapToDevice(QtCore.QPointF(0, 1))
+        if o is None:
+            return None
+        w = pg.Point(x - o).length()
+        h = pg.Point(y - o).length()
+        if w == 0 or h == 0:
+            return None
+        return 1.0 / max(w, h)
+
+    def _lod_level(self, ds=None):
+        # // pick the coarsest level which still has at least one image pixel per screen pixel
+        if len(self._pyramid) < 2 or self._pyramid[0] is not self.image:
+            return 0
+        ds = ds or self._screen_downsampling()
+        if ds is None:
+            return 0
+        ds /= self._resident_downsampling()
+        if ds < 2:
+            return 0
+        return min(int(math.log2(ds)), len(self._pyramid) - 1)
+
+    def render(self):
+        level = self._lod_level()
+        self._lod_current = level
+        if level == 0:
+            return pg.ImageItem.render(self)
+        # // render the qimage from the pyramid level, paint stretches it over the full image rect
+        full = self.image
+        self.image = self._pyramid[level]
+        try:
+            pg.ImageItem.render(self)
+        finally:
+            self.image = full
+
+    def paint(self, p, *args):
+        if self.image is None:
+            return
+        if self.residency is not None:
+            self.residency.touch(self)
+        ds = self._screen_downsampling()
+        if ds is not None and ds < self._resident_downsampling():
+            # // drawn finer than the resident pixels, e.g. zoomed in on a preview or an evicted image
+            self.request_resolution(ds)
+        if self._renderRequired:
+            self.render()
+            if self._unrenderable:
+                return
+        if self.paintMode is not None:
+            p.setCompositionMode(self.paintMode)
+        p.drawImage(self.boundingRect(), self.qimage)
         if self.border is not None:
             p.setPen(self.border)
             p.drawRect(self.boundingRect())
 
+    def itemChange(self, change, value):
+        ret = pg.ImageItem.itemChange(self, change, value)
+        if change in (self.GraphicsItemChange.ItemPositionHasChanged,
+                      self.GraphicsItemChange.ItemTransformHasChanged,
+                      self.GraphicsItemChange.ItemRotationHasChanged,
+                      self.GraphicsItemChange.ItemScaleHasChanged):
+            # // keep the spatial index of the field view in sync with the geometry
+            vb = self.getViewBox()
+            if hasattr(vb, 'item_geometry_changed'):
+                vb.item_geometry_changed(self)
+        return ret
+
+    def viewTransformChanged(self):
+        if self._pyramid and self._lod_level() != self._lod_current:
+            self._renderRequired = True
+            self.update()
+        pg.ImageItem.viewTransformChanged(self)
+
+    def update_dim(self, new_dims):
+        self.width, self.height = new_dims
+
     def boundingRect(self):
-        return QtCore.QRectF(self.pixmap.rect())
+        return QtCore.QRectF(0, 0, self.image_shape[1], self.image_shape[0])
 
     def setBorder(self, b):
         self.border = fn.mkPen(b)
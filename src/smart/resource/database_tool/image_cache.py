@@ -0,0 +1,159 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from PyQt5 import QtCore
+
+
+def bin_image(image, factor):
+    """
+    Downsample an image by averaging factor x factor blocks, trailing rows/columns which do not fill a block are dropped
+    :param image: row-major image array (2d or 3d with channels last)
+    :param factor: integer binning factor
+    :return: binned array with the dtype of the input
+    """
+    factor = int(factor)
+    if factor <= 1:
+        return image
+    h, w = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    binned = image[:h, :w].reshape(h // factor, factor, w // factor, factor, *image.shape[2:]).mean(axis=(1, 3))
+    return binned.astype(image.dtype)
+
+
+class ImagePreviewCache(object):
+    """
+    On-disk cache of thumbnails and mid-resolution previews of image files.
+
+    Entries are keyed by a hash of the whole content of the file, so a copied or moved session still hits its entries
+    and any edit misses them. The content hash is memoised per file identity (device, inode, size and modification
+    time in ns) in a small .id file, so opening an unchanged imagedb again does not read the images, only new,
+    copied or edited files are read once to hash them.
+    Each entry is one compressed npz file holding the thumbnail, the preview and the full resolution image shape.
+    Once the entries exceed max_mb, the least recently used ones are removed, checked every prune_every writes.
+    """
+    version = 3
+    chunk_size = 1 << 20
+
+    def __init__(self, cache_dir, preview_size=1024, thumbnail_size=96, max_mb=2048, prune_every=50):
+        self.cache_dir = cache_dir
+        self.preview_size = preview_size
+        self.thumbnail_size = thumbnail_size
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.prune_every = max(int(prune_every), 1)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._digests = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def content_digest(self, path):
+        """
+        Hash of the whole file content, memoised per file identity in memory and on disk
+        """
+        st = os.stat(path)
+        identity = f'{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}'
+        with self._lock:
+            if identity in self._digests:
+                return self._digests[identity]
+        id_name = hashlib.blake2b(identity.encode(), digest_size=16).hexdigest() + '.id'
+        id_path = os.path.join(self.cache_dir, 'ids', id_name)
+        try:
+            with open(id_path, 'r') as f:
+                digest = f.read().strip()
+        except OSError:
+            digest = ''
+        if len(digest) != 40:
+            h = hashlib.blake2b(digest_size=20)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            try:
+                os.makedirs(os.path.dirname(id_path), exist_ok=True)
+                tmp_path = id_path + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(digest)
+                os.replace(tmp_path, id_path)
+            except OSError as e:
+                QtCore.qDebug(f'Failed to write the content hash of {path}: {e}')
+        with self._lock:
+            self._digests[identity] = digest
+        return digest
+
+    def key(self, path):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f'{self.version}:{self.preview_size}:{self.thumbnail_size}:{self.content_digest(path)}'.encode())
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def preview_factor(self, shape):
+        # // binning factor between the full resolution image and its preview
+        return max(int(np.ceil(max(shape[:2]) / self.preview_size)), 1)
+
+    def get(self, path):
+        """
+        Look up the cached previews of an image file
+        :param path: full path of the image file
+        :return: dict with 'thumbnail', 'preview' and 'shape' keys, None on a cache miss
+        """
+        try:
+            entry_path = self._entry_path(self.key(path))
+            if not os.path.exists(entry_path):
+                return None
+            with np.load(entry_path) as f:
+                entry = {'thumbnail': f['thumbnail'], 'preview': f['preview'], 'shape': tuple(f['shape'])}
+            # // hits count as recent use for the pruning
+            os.utime(entry_path)
+            return entry
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, path, image):
+        """
+        Build the previews of a decoded image and store them in the cache
+        :param path: full path of the image file the image was decoded from
+        :param image: the full resolution image array
+        :return: dict with 'thumbnail', 'preview' and 'shape' keys
+        """
+        preview = bin_image(image, self.preview_factor(image.shape))
+        thumbnail = bin_image(image, int(np.ceil(max(image.shape[:2]) / self.thumbnail_size)))
+        entry = {'thumbnail': thumbnail, 'preview': preview, 'shape': tuple(image.shape)}
+        try:
+            entry_path = self._entry_path(self.key(path))
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            # // write to a temporary file first, concurrent readers never see a half written entry
+            tmp_path = entry_path + f'.{os.getpid()}.{id(image)}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, thumbnail=thumbnail, preview=preview, shape=np.array(image.shape))
+            os.replace(tmp_path, entry_path)
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune()
+        except OSError as e:
+            QtCore.qDebug(f'Failed to write the preview cache entry of {path}: {e}')
+        return entry
+
+    def _prune(self):
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(('.npz', '.id')):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,70 @@
+import weakref
+from collections import OrderedDict
+
+
+class ImageResidencyManager(object):
+    """
+    Keeps the pixel memory held by the image buffer items within a budget.
+
+    Items are kept in least-recently-used order, an item counts as used whenever it is painted. Once loading pixels
+    pushes the total above the budget, the least recently used items are evicted: they drop their pixels and keep a
+    small stand-in, their geometry and table row are untouched. Evicted items load their pixels again as soon as they
+    are drawn at a resolution the stand-in can not serve.
+    Items which intersect the visible part of the view are never evicted, evicting them would only make them load
+    again on the next paint. If the visible items alone exceed the budget, the total stays above it until the view
+    changes.
+    """
+
+    def __init__(self, budget_mb=0):
+        # // a budget of 0 disables eviction, the bookkeeping still runs
+        self.budget = int(float(budget_mb) * 1024 ** 2)
+        self.total = 0
+        self._items = OrderedDict()
+
+    def touch(self, item):
+        key = id(item)
+        if key in self._items:
+            self._items.move_to_end(key)
+
+    def account(self, item):
+        """
+        Update the memory held by item and evict other items if the budget is exceeded
+        :param item: the ImageBufferObject which just changed its resident pixels
+        :return:
+        """
+        key = id(item)
+        _, old = self._items.pop(key, (None, 0))
+        nbytes = item.nbytes()
+        self._items[key] = (weakref.ref(item), nbytes)
+        self.total += nbytes - old
+        self._enforce(keep=key)
+
+    def forget(self, item):
+        _, nbytes = self._items.pop(id(item), (None, 0))
+        self.total -= nbytes
+
+    def _enforce(self, keep):
+        if self.budget <= 0:
+            return
+        for key in list(self._items):
+            if self.total <= self.budget:
+                break
+            if key == keep:
+                continue
+            ref, nbytes = self._items[key]
+            item = ref()
+            try:
+                alive = item is not None and item.scene() is not None
+            except RuntimeError:
+                # // the underlying qt object is gone already
+                alive = False
+            if not alive:
+                del self._items[key]
+                self.total -= nbytes
+                continue
+            if item.is_in_view():
+                continue
+            item.evict()
+            new_nbytes = item.nbytes()
+            self._items[key] = (ref, new_nbytes)
+            self.total += new_nbytes - nbytes
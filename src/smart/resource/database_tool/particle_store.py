@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class ParticleStore(object):
+    """
+    Columnar store of located particles with a KD-tree on their positions in the field view.
+
+    Every trackpy column is kept as one numpy array, the view coordinates (vx, vy) of the particles are added from the
+    placement of the image they were located on. ROI and nearest neighbour queries go through the KD-tree, property
+    range queries through a sorted index per column which is built on first use, so repeated filtering never scans
+    the whole table. Query results are index arrays which select rows with take().
+    The store is saved as a single compressed npz file holding one array per column.
+    """
+
+    def __init__(self, columns, to_view=None, pixel_size=None):
+        """
+        :param columns: dict column name -> 1d array, all of the same length, with at least x and y (image pixels)
+        :param to_view: CoordinateTransform from image pixels to view coordinates, identity if None
+        :param pixel_size: view units per image pixel, taken from to_view if None
+        """
+        self.columns = {k: np.asarray(v) for k, v in columns.items()}
+        if pixel_size is None:
+            pixel_size = 1.0 if to_view is None else np.sqrt(abs(np.linalg.det(to_view.matrix[:2, :2])))
+        self.pixel_size = float(pixel_size)
+        if 'vx' not in self.columns:
+            xy = np.stack([self.columns['x'], self.columns['y']], axis=1).astype(np.float64)
+            v = xy if to_view is None else to_view.map(xy)
+            self.columns['vx'], self.columns['vy'] = v[:, 0], v[:, 1]
+        self._tree = None
+        self._sorted = {}
+
+    @classmethod
+    def from_dataframe(cls, df, to_view=None):
+        return cls({k: df[k].to_numpy() for k in df.columns}, to_view=to_view)
+
+    @classmethod
+    def from_frames(cls, df, frame_transforms):
+        """
+        Store of the particles of a stack, the particles of every frame are placed with the transform of their frame
+        :param df: DataFrame with at least x, y and frame columns
+        :param frame_transforms: one CoordinateTransform per frame index, the first one sets the pixel size
+        """
+        columns = {k: df[k].to_numpy() for k in df.columns}
+        matrices = np.stack([t.matrix for t in frame_transforms])[columns['frame'].astype(int)]
+        xy = np.stack([columns['x'], columns['y'], np.ones(len(df))], axis=1).astype(np.float64)
+        v = np.einsum('nij,nj->ni', matrices, xy)
+        columns['vx'], columns['vy'] = v[:, 0], v[:, 1]
+        return cls(columns, to_view=frame_transforms[0])
+
+    def to_dataframe(self, indices=None, view_coords=False):
+        import pandas as pd
+        cols = self.columns if indices is None else self.take(indices)
+        return pd.DataFrame({k: v for k, v in cols.items() if view_coords or k not in ('vx', 'vy')})
+
+    def __len__(self):
+        return len(self.columns['x'])
+
+    @property
+    def view_pos(self):
+        return np.stack([self.columns['vx'], self.columns['vy']], axis=1)
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self.view_pos)
+        return self._tree
+
+    def take(self, indices):
+        return {k: v[indices] for k, v in self.columns.items()}
+
+    def query_rect(self, x0, y0, x1, y1):
+        """
+        Particles inside an axis aligned rectangle in view coordinates
+        :return: index array
+        """
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        if len(self) == 0:
+            return np.zeros(0, dtype=int)
+        # // the circumscribed circle narrows the candidates, the exact test only runs on those
+        candidates = np.asarray(self.tree.query_ball_point(((x0 + x1) / 2, (y0 + y1) / 2),
+                                                           np.hypot(x1 - x0, y1 - y0) / 2), dtype=int)
+        vx, vy = self.columns['vx'][candidates], self.columns['vy'][candidates]
+        return np.sort(candidates[(vx >= x0) & (vx <= x1) & (vy >= y0) & (vy <= y1)])
+
+    def query_polygon(self, vertices):
+        """
+        Particles inside a polygon in view coordinates, e.g. the handles of a PolyLineROI
+        :param vertices: (N, 2) array
+        :return: index array
+        """
+        from matplotlib.path import Path
+        vertices = np.asarray(vertices, dtype=np.float64)
+        candidates = self.query_rect(*vertices.min(axis=0), *vertices.max(axis=0))
+        inside = Path(vertices).contains_points(self.view_pos[candidates])
+        return candidates[inside]
+
+    def nearest(self, points, k=1, max_distance=np.inf):
+        """
+        :param points: (2,) or (N, 2) view coordinates
+        :param k: number of neighbours per point
+        :return: (distances, indices) as returned by cKDTree.query, missing neighbours have the index len(self)
+        """
+        return self.tree.query(points, k=k, distance_upper_bound=max_distance)
+
+    def query_range(self, column, lo=-np.inf, hi=np.inf):
+        """
+        Particles with lo <= column <= hi
+        :return: index array in ascending order of the column
+        """
+        if column not in self._sorted:
+            order = np.argsort(self.columns[column], kind='stable')
+            self._sorted[column] = order, self.columns[column][order]
+        order, values = self._sorted[column]
+        return order[np.searchsorted(values, lo, side='left'):np.searchsorted(values, hi, side='right')]
+
+    def view_diameters(self, indices=None):
+        # // trackpy size is the radius of gyration in image pixels
+        size = self.columns['size'] if 'size' in self.columns else np.ones(len(self))
+        return (size if indices is None else size[indices]) * 2 * self.pixel_size
+
+    def overlay_args(self, indices=None):
+        """
+        Arguments of ParticleOverlay.set_particles, the KD-tree is shared when all particles are drawn
+        """
+        cols = self.columns if indices is None else self.take(indices)
+        pos = np.stack([cols['vx'], cols['vy']], axis=1)
+        size = self.view_diameters(indices)
+        return pos, size, cols.get('mass'), self.tree if indices is None and len(self) else None
+
+    def save(self, path):
+        np.savez_compressed(path, _pixel_size=self.pixel_size, **self.columns)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            return cls({k: f[k] for k in f.files if k != '_pixel_size'}, pixel_size=f['_pixel_size'])
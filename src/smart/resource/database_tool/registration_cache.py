@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import numpy as np
+from PyQt5 import QtCore
+
+
+class RegistrationCache(object):
+    """
+    On-disk cache of image registration results.
+
+    Entries are keyed by a hash of the content of both (padded) frames and of the registration parameters, so a result
+    is only reused for exactly the same pair of frames registered the same way. Changed images or settings simply miss
+    the cache, bumping version invalidates all entries after a change of the registration code. The oldest entries
+    are removed once there are more than max_entries, checked every prune_every writes.
+    Each entry is a small json file holding the transform (tvec, scale, angle), the success metric and the parameters.
+    """
+    version = 1
+    result_keys = ('tvec', 'scale', 'angle', 'success', 'Dscale', 'Dangle', 'Dt')
+
+    def __init__(self, cache_dir, max_entries=1000, prune_every=50):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.prune_every = max(int(prune_every), 1)
+        self._writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, reference, target, params):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f'{self.version}:{json.dumps(params, sort_keys=True, default=str)}'.encode())
+        for frame in (reference, target):
+            frame = np.ascontiguousarray(frame)
+            h.update(f'{frame.shape}:{frame.dtype.str}'.encode())
+            h.update(memoryview(frame).cast('B'))
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key):
+        """
+        :param key: see key()
+        :return: result dict with the transform and success metric, None on a cache miss
+        """
+        try:
+            with open(self._entry_path(key), 'r') as f:
+                entry = json.load(f)
+            # // hits count as recent use for the pruning
+            os.utime(self._entry_path(key))
+        except (OSError, ValueError):
+            return None
+        result = entry['result']
+        result['tvec'] = np.array(result['tvec'])
+        return result
+
+    def put(self, key, result, params):
+        """
+        Store the transform of a registration result, the transformed image ('timg') is not cached
+        """
+        entry = {'result': {k: np.asarray(result[k]).tolist() for k in self.result_keys if k in result},
+                 'params': params}
+        try:
+            # // write to a temporary file first, concurrent readers never see a half written entry
+            tmp_path = self._entry_path(key) + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f, default=str)
+            os.replace(tmp_path, self._entry_path(key))
+            # // listing the directory costs more than the entry itself, the limit may be exceeded by a few writes
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune()
+        except OSError as e:
+            QtCore.qDebug(f'Failed to write the registration cache entry {key}: {e}')
+
+    def _prune(self):
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
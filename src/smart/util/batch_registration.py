@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import math
+from collections import deque
+import numpy as np
+
+
+def _extend(m):
+    # // 2x3 -> 3x3 homogeneous matrix
+    e = np.eye(3)
+    e[:2] = m
+    return e
+
+
+def _bbox(placement):
+    a = np.asarray(placement['affine'], dtype=np.float64)
+    h, w = placement['shape'][:2]
+    corners = a[:, :2] @ np.array([[0, w, 0, w], [0, 0, h, h]], dtype=np.float64) + a[:, 2:]
+    return corners[0].min(), corners[1].min(), corners[0].max(), corners[1].max()
+
+
+def _pixel_size(placement):
+    return math.sqrt(abs(np.linalg.det(np.asarray(placement['affine'], dtype=np.float64)[:, :2])))
+
+
+def overlap_areas(placements):
+    """
+    Pairwise overlap of the bounding boxes of the placed images
+    :return: (n, n) array of overlap areas in view units, zero on the diagonal
+    """
+    b = np.array([_bbox(p) for p in placements])
+    w = np.clip(np.minimum(b[:, None, 2], b[None, :, 2]) - np.maximum(b[:, None, 0], b[None, :, 0]), 0, None)
+    h = np.clip(np.minimum(b[:, None, 3], b[None, :, 3]) - np.maximum(b[:, None, 1], b[None, :, 1]), 0, None)
+    areas = w * h
+    np.fill_diagonal(areas, 0)
+    return areas
+
+
+def maximum_spanning_tree(weights, root):
+    """
+    Prim's algorithm on a dense weight matrix, edges with zero weight are absent
+    :return: dict child -> parent of all nodes connected to root (root excluded)
+    """
+    n = weights.shape[0]
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[root] = True
+    best = weights[root].astype(float).copy()
+    best_parent = np.full(n, root)
+    parents = {}
+    while True:
+        candidates = np.where(in_tree, -1, best)
+        node = int(np.argmax(candidates))
+        if candidates[node] <= 0:
+            break
+        in_tree[node] = True
+        parents[node] = int(best_parent[node])
+        better = weights[node] > best
+        best[better] = weights[node][better]
+        best_parent[better] = node
+    return parents
+
+
+def render_overlap(placement, origin, resolution, shape, load_func=None):
+    """
+    Resample the gray values of a placed image onto a grid in view coordinates
+    :param placement: dict with 'path', 'shape' and 'affine' (image pixel (column, row) -> view), as used for the mosaic
+    :param origin: view coordinates (x, y) of the top left corner of the grid
+    :param resolution: grid pixel size in view units
+    :param shape: (rows, columns) of the grid
+    :return: float32 array, zero outside of the image
+    """
+    import cv2
+    from ..resource.database_tool.image_cache import bin_image
+    from .util import array_to_gray
+
+    if load_func is None:
+        from ..resource.data_loaders.file_loader import load_image_array
+        load_func = load_image_array
+    a = np.asarray(placement['affine'], dtype=np.float64)
+    # // bin the source to about the grid resolution instead of aliasing while warping
+    binning = max(int(resolution / _pixel_size(placement)), 1)
+    image = np.float32(array_to_gray(bin_image(load_func(placement['path']), binning)))
+    a_inv = np.linalg.inv(a[:, :2])
+    # // grid pixel centre -> view -> image pixel -> binned image pixel
+    m = np.empty((2, 3))
+    m[:, :2] = a_inv * resolution / binning
+    m[:, 2] = a_inv @ (np.asarray(origin, dtype=np.float64) + 0.5 * resolution - a[:, 2]) / binning - 0.5
+    return cv2.warpAffine(image, m, (int(shape[1]), int(shape[0])), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+def register_pair(reference, target, mode='single', max_size=1024, min_overlap=32, **registration_kwargs):
+    """
+    Register two placed images on the overlap of their bounding boxes
+    :param reference, target: placement dicts, see render_overlap
+    :param mode: registration mode, see geometry_transformation.register_frames
+    :param max_size: larger edge of the overlap grid, the grid pixel is never finer than the finer image pixel
+    :param min_overlap: smallest overlap (grid pixels along either edge) worth registering
+    :return: (3x3 view transform which moves target onto reference, success), None if the images hardly overlap
+    """
+    from .geometry_transformation import register_frames, transform_dict_to_affine
+
+    r, t = _bbox(reference), _bbox(target)
+    x0, y0, x1, y1 = max(r[0], t[0]), max(r[1], t[1]), min(r[2], t[2]), min(r[3], t[3])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    resolution = max(min(_pixel_size(reference), _pixel_size(target)), max(x1 - x0, y1 - y0) / max_size)
+    shape = (int((y1 - y0) / resolution), int((x1 - x0) / resolution))
+    if min(shape) < min_overlap:
+        return None
+    im0 = render_overlap(reference, (x0, y0), resolution, shape)
+    im1 = render_overlap(target, (x0, y0), resolution, shape)
+    result = register_frames(im0, im1, mode=mode, **registration_kwargs)
+    # // grid pixel -> view, the correction in view coordinates is grid * m_grid * grid^-1
+    grid = np.array([[resolution, 0, x0 + 0.5 * resolution], [0, resolution, y0 + 0.5 * resolution], [0, 0, 1]])
+    m_grid = _extend(transform_dict_to_affine(result, shape))
+    return grid @ m_grid @ np.linalg.inv(grid), float(result.get('success', 1.0))
+
+
+def _register_pair_job(index, reference, target, mode, kwargs):
+    return index, register_pair(reference, target, mode=mode, **kwargs)
+
+
+def batch_register(placements, reference=0, strategy='tree', mode='single', max_workers=None,
+                   progress_callback=None, status_callback=None, abort=None, **kwargs):
+    """
+    Register many placed images in a process pool, every worker loads and resamples its own pair of images
+    :param placements: list of placement dicts, see render_overlap
+    :param reference: index of the image which stays in place
+    :param strategy: 'reference' registers every image overlapping the reference against it, 'tree' registers every
+    image against its parent in the maximum spanning tree of the overlap graph and chains the corrections from the
+    reference outwards, which also reaches images that do not overlap the reference
+    :param mode: registration mode, see geometry_transformation.register_frames
+    :param progress_callback: called with the progress in percent
+    :param status_callback: called with a message for every pair which could not be registered
+    :param abort: optional callable, pending pairs are cancelled once it returns True
+    :param kwargs: passed on to register_pair
+    :return: (dict index -> (3x3 view correction, success), list of indices which could not be registered)
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    n = len(placements)
+    areas = overlap_areas(placements)
+    if strategy == 'tree':
+        parents = maximum_spanning_tree(areas, reference)
+    else:
+        parents = {k: reference for k in range(n) if k != reference and areas[reference, k] > 0}
+
+    edges = {}
+    # // spawned workers, a forked child of the Qt process may inherit locks held by other threads
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(_register_pair_job, child, placements[parent], placements[child], mode, kwargs): child
+                   for child, parent in parents.items()}
+        for done, future in enumerate(as_completed(futures)):
+            if abort is not None and abort():
+                for f in futures:
+                    f.cancel()
+                break
+            try:
+                child, edge = future.result()
+                if edge is not None:
+                    edges[child] = edge
+            except Exception as e:
+                # // an unreadable image only drops its own subtree
+                if status_callback:
+                    status_callback(f"Failed to register {placements[futures[future]]['path']}: {e}")
+            finally:
+                if progress_callback:
+                    progress_callback((done + 1) / max(len(futures), 1) * 100)
+
+    # // walk the tree from the reference, a child moves with its parent and then onto it
+    corrections = {}
+    children = {}
+    for child, parent in parents.items():
+        children.setdefault(parent, []).append(child)
+    queue = deque([(reference, np.eye(3), 1.0)])
+    while queue:
+        node, correction, success = queue.popleft()
+        for child in children.get(node, []):
+            if child not in edges:
+                continue
+            edge, edge_success = edges[child]
+            corrections[child] = (correction @ edge, min(success, edge_success))
+            queue.append((child, corrections[child][0], corrections[child][1]))
+    failed = [k for k in range(n) if k != reference and k not in corrections]
+    return corrections, failed
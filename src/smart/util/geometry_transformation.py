@@ -42,6 +42,11 @@ def registration_dft_stack(
     tx=[0, 0],
     ty=[0, 0],
     iterations=100,
+    reference=None,
+    mode="neighbour",
+    method="single",
+    max_workers=None,
+    return_transforms=False,
     display=True,
     quiet=False,
     simulation=False,
@@ -58,15 +63,22 @@ def registration_dft_stack(
     channel: tuple of ints, optional
             contains the indices of the channels in the channel_axis to use as a reference. If
             channel == (-1), the integrated channels are used.
-    mode: string, optional
-            determines what operations are allowed during registration:
-            1) translation
-            2) rotation
-            3) scaling
-            4) rigid: translation+rotation
-            5) all: translation+rotation+scaling
+    scale, angle, tx, ty: [value, tolerance], optional
+            kept for compatibility, registration_dft_slice does not apply the constraints
     iterations: int, ioptional
             number of iterations in the dft algorithm (more == better registration, at a higher computational cost)
+    reference: int, optional
+            index of the reference slice, defaults to the middle slice
+    mode: string, optional
+            'reference': every slice is registered against the reference slice
+            'neighbour': every slice is registered against its neighbour towards the reference, the transforms are
+            chained (suits slowly drifting stacks)
+    method: string, optional
+            registration mode, see register_frames
+    max_workers: int, optional
+            number of processes, defaults to the number of cores
+    return_transforms: boolean, optional
+            also return the list of transforms
     display: boolean, optional
             enables user supervision through display
     quiet: boolean, optional
@@ -79,7 +91,8 @@ def registration_dft_stack(
             window to connect in order to display images; works in conjunction with the display boolean
     Returns
     -------
-            returns the registred stack (all channels have been registred)
+            returns the registred stack (all channels have been registred), with return_transforms also the list of
+            transforms (one dict per slice, see register_stack)
 
     Notes
     -----
@@ -90,16 +103,37 @@ def registration_dft_stack(
     >>>
 
     """
-    # select the middle slice as a reference
-    rank = len(dset.shape)
     if isinstance(z_axis, tuple):
         z_axis = z_axis[0]
-    if not isinstance(channel_axis, tuple):
-        channel_axis = channel_axis
-
-    _z = dset.shape[z_axis] // 2
+    if isinstance(channel_axis, tuple):
+        channel_axis = channel_axis[0]
+    frames = np.moveaxis(dset, z_axis, 0)
+    # // channel axis within a single slice
+    frame_channel_axis = channel_axis - 1 if channel_axis > z_axis else channel_axis
+    if frames.ndim > 3:
+        if channel[0] == -1:
+            ref_frames = frames.sum(axis=frame_channel_axis + 1)
+        else:
+            ref_frames = np.take(frames, channel[0], axis=frame_channel_axis + 1)
+    else:
+        ref_frames = frames
+    ref_frames = np.squeeze(ref_frames)
+    if reference is None:
+        reference = ref_frames.shape[0] // 2
     if not quiet:
-        QtCore.qDebug("Reference slice {} selected".format(_z))
+        QtCore.qDebug("Reference slice {} selected".format(reference))
+
+    def _progress(value):
+        if progressbar:
+            progressbar.setValue(value)
+
+    transforms = register_stack(ref_frames, reference=reference, mode=mode, method=method, iterations=iterations,
+                                max_workers=max_workers, progress_callback=_progress)
+    if not simulation:
+        for k, tdict in enumerate(transforms):
+            if k == reference:
+                continue
+            frames[k] = apply_imreg_dft(tdict, frames[k])
 
     if display:
         if not display_window:
@@ -110,66 +144,187 @@ def registration_dft_stack(
             imv = pg.ImageItem()
             p1.addItem(imv)
             win.show()
-            pg.QtGui.QApplication.processEvents()
             display_window = imv
+        shown = ref_frames if simulation else np.squeeze(
+            np.take(frames, max(channel[0], 0), axis=frame_channel_axis + 1) if frames.ndim > 3 else frames)
+        display_window.setImage(np.max(shown, axis=0))
+        pg.QtGui.QApplication.processEvents()
+    _progress(100)
+    if return_transforms:
+        return dset, transforms
+    return dset
 
-    for k in range(_z, 0, -1):
-        # // get channels summed
-        reg_slice = [slice(None)] * rank
-        ref_slice = [slice(None)] * rank
-        ref_slice[z_axis] = k
-        reg_slice[z_axis] = k - 1
-        if z_axis > channel_axis[0]:
-            channel_axis_alt = channel_axis
-        else:
-            channel_axis_alt = channel_axis - 1
-        dset[reg_slice] = registration_dft_slice(
-            im0=dset[ref_slice],
-            im1=dset[reg_slice],
-            channel=(0,),
-            channel_axis=channel_axis_alt,
-            scale=scale,
-            angle=angle,
-            tx=tx,
-            ty=ty,
-            iterations=iterations,
-            display=display,
-            quiet=quiet,
-            simulation=simulation,
-            progressbar="",
-            display_window=display_window,
-        )
-        if progressbar:
-            progressbar.setValue(_z - k / z_axis * 100)
 
-    for k in range(_z, dset.shape[z_axis] - 1, 1):
+def compose_transform_dict(first, second):
+    """
+    Transform dict equivalent to applying first and then second (both in the imreg_dft convention: scaling and
+    rotation around the image centre, then translation tvec = (ty, tx)). Both must refer to images of the same shape.
+    """
+    s1, a1 = first.get("scale", 1.0), first.get("angle", 0.0)
+    s2, a2 = second.get("scale", 1.0), second.get("angle", 0.0)
+    t1 = np.asarray(first.get("tvec", (0, 0)), dtype=float)
+    t2 = np.asarray(second.get("tvec", (0, 0)), dtype=float)
+    rad = np.radians(a2)
+    # // rotation of the (x, y) plane as done by cv2.getRotationMatrix2D, applied to (ty, tx)
+    tx = s2 * (np.cos(rad) * t1[1] + np.sin(rad) * t1[0]) + t2[1]
+    ty = s2 * (-np.sin(rad) * t1[1] + np.cos(rad) * t1[0]) + t2[0]
+    return {
+        "scale": s1 * s2,
+        "angle": a1 + a2,
+        "tvec": np.array([ty, tx]),
+        "success": min(first.get("success", 1.0), second.get("success", 1.0)),
+    }
+
+
+# // frames of the stack being registered, attached to shared memory in every worker process
+_stack_shm = None
+_stack_frames = None
+
+
+def _init_stack_worker(shm_name, shape, dtype):
+    global _stack_shm, _stack_frames
+    from multiprocessing import shared_memory
+
+    _stack_shm = shared_memory.SharedMemory(name=shm_name)
+    _stack_frames = np.ndarray(shape, dtype=dtype, buffer=_stack_shm.buf)
+
+
+def _register_stack_pair(ref_index, index, method, iterations):
+    result = register_frames(_stack_frames[ref_index], _stack_frames[index], mode=method, iterations=iterations)
+    # // only the transform travels back to the parent process, not the transformed image
+    return index, {
+        "scale": float(result["scale"]),
+        "angle": float(result["angle"]),
+        "tvec": np.array(result["tvec"], dtype=float),
+        "success": float(result.get("success", 1.0)),
+    }
+
+
+def register_stack(frames, reference=None, mode="reference", method="single", iterations=5, max_workers=None,
+                   progress_callback=None):
+    """
+    Register every frame of a stack in a process pool. The frames are copied once into shared memory, the workers
+    only receive the indices of the frames to register.
+    :param frames: (n, h, w) array
+    :param reference: index of the reference frame, defaults to the middle one
+    :param mode: 'reference' registers every frame against the reference frame, 'neighbour' registers every frame
+    against its neighbour towards the reference and chains the transforms
+    :param method: registration mode, see register_frames
+    :param max_workers: number of processes, defaults to the number of cores
+    :param progress_callback: called with the progress in percent
+    :return: list with one transform dict (scale, angle, tvec, success) per frame, mapping it onto the reference frame
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from multiprocessing import shared_memory
+
+    n = frames.shape[0]
+    if reference is None:
+        reference = n // 2
+    identity = {"scale": 1.0, "angle": 0.0, "tvec": np.zeros(2), "success": 1.0}
+    if mode == "neighbour":
+        pairs = [(k + 1 if k < reference else k - 1, k) for k in range(n) if k != reference]
+    else:
+        pairs = [(reference, k) for k in range(n) if k != reference]
+
+    pair_transforms = {}
+    shm = shared_memory.SharedMemory(create=True, size=max(frames.size * np.dtype(np.float32).itemsize, 1))
+    try:
+        shared = np.ndarray(frames.shape, dtype=np.float32, buffer=shm.buf)
+        shared[:] = frames
+        # // spawned workers, a forked child of the Qt process may inherit locks held by other threads
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_stack_worker, initargs=(shm.name, frames.shape, np.float32)) as pool:
+            futures = [pool.submit(_register_stack_pair, ref_index, index, method, iterations)
+                       for ref_index, index in pairs]
+            for done, future in enumerate(as_completed(futures)):
+                index, tdict = future.result()
+                pair_transforms[index] = tdict
+                if progress_callback:
+                    progress_callback((done + 1) / len(futures) * 100)
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
+    transforms = [None] * n
+    transforms[reference] = identity
+    if mode == "neighbour":
+        # // accumulate outwards from the reference: frame k -> neighbour -> ... -> reference
+        for k in range(reference - 1, -1, -1):
+            transforms[k] = compose_transform_dict(pair_transforms[k], transforms[k + 1])
+        for k in range(reference + 1, n):
+            transforms[k] = compose_transform_dict(pair_transforms[k], transforms[k - 1])
+    else:
+        for k, tdict in pair_transforms.items():
+            transforms[k] = tdict
+    return transforms
 
-        if progressbar:
-            progressbar.setValue(k / z_axis * 100)
-    if progressbar:
-        progressbar.setValue(100)
-    return dset
+
+def transform_dict_to_affine(tdict, shape, invertx=False, inverty=False):
+    """
+    Compose a transform dict (imreg_dft convention: scaling and rotation in degrees around the image centre, then the
+    translation tvec = (ty, tx)) and optional flips into one 2x3 affine matrix mapping (x, y) of the source image to
+    the output image, as used by cv2.warpAffine
+    :param tdict: dict with any of 'scale', 'angle' and 'tvec'
+    :param shape: shape of the image
+    :param invertx: flip the image left-right before transforming it
+    :param inverty: flip the image up-down before transforming it
+    :return: 2x3 array
+    """
+    import cv2
+
+    h, w = shape[:2]
+    m = np.eye(3)
+    m[:2] = cv2.getRotationMatrix2D(((w - 1) / 2, (h - 1) / 2), float(tdict.get("angle", 0.0)),
+                                    float(tdict.get("scale", 1.0)))
+    tvec = tdict.get("tvec", (0, 0))
+    m[:2, 2] += (tvec[1], tvec[0])
+    flip = np.eye(3)
+    if invertx:
+        flip[0] = (-1, 0, w - 1)
+    if inverty:
+        flip[1] = (0, -1, h - 1)
+    return (m @ flip)[:2]
+
+
+# // dtypes cv2.warpAffine can resample, others are warped as float32
+_WARP_DTYPES = (np.uint8, np.uint16, np.int16, np.float32, np.float64)
+
+
+def warp_img_dict(image, tdict, out=None, order=1, invertx=False, inverty=False, bgval=0):
+    """
+    Apply a transform dict with a single resampling pass
+    :param image: 2d image, or 3d with up to 4 channels last
+    :param tdict: dict with any of 'scale', 'angle' and 'tvec', see transform_dict_to_affine
+    :param out: optional preallocated output with the shape of image
+    :param order: interpolation order, 0 nearest, 1 linear, 3 cubic
+    :param bgval: value of the pixels which are mapped from outside the image
+    :return: the warped image (out if given)
+    """
+    import cv2
+
+    flags = {0: cv2.INTER_NEAREST, 1: cv2.INTER_LINEAR}.get(order, cv2.INTER_CUBIC)
+    src = image if image.dtype.type in _WARP_DTYPES else np.float32(image)
+    dst = out if out is not None and out.dtype == src.dtype and out.flags.c_contiguous else None
+    m = transform_dict_to_affine(tdict, image.shape, invertx=invertx, inverty=inverty)
+    warped = cv2.warpAffine(src, m, (image.shape[1], image.shape[0]), dst=dst, flags=flags,
+                            borderMode=cv2.BORDER_CONSTANT, borderValue=bgval)
+    if out is not None and warped is not out:
+        out[...] = warped
+        return out
+    return warped
 
 
-def transform_img_dict(dset, tdict, invertx=False, inverty=False):
+def transform_img_dict(dset, tdict, invertx=False, inverty=False, out=None, order=1):
     """
     reimplementation of transformation operation based on a dictionary of translation/scale/rotation vectors. Also enables invert
 
-    image is 2D
+    image is 2D, scaling, rotation, translation and the flips are applied in one resampling pass (see warp_img_dict)
     """
     if not tdict:
         raise ValueError("Error, no vector translation/scale/rotation dictionary found")
-    if inverty:
-        dset = np.flipud(dset)
-    if invertx:
-        dset = np.fliplr(dset)
-    if "angle" in tdict:
-        dset = ndimage.rotate(dset, tdict["angle"], reshape=False)
-    if "tvec" in tdict:
-        dset = np.roll(dset, shift=int(tdict["tvec"][0]), axis=0)
-    if "tvec" in tdict:
-        dset = np.roll(dset, shift=int(tdict["tvec"][1]), axis=1)
-    return dset
+    return warp_img_dict(dset, tdict, out=out, order=order, invertx=invertx, inverty=inverty)
 
 
 def registration_dft_slice(
@@ -262,43 +417,282 @@ def registration_dft_slice(
     return vector_dict
 
 
-def apply_imreg_dft(vector_dict, target):
+def _upsampled_dft(data, region_size, upsample_factor, offsets):
     """
-    Apply dft transformation
+    Inverse DFT of a spectrum evaluated only on a small region of an upsample_factor times finer grid, by matrix
+    multiplication (Guizar-Sicairos et al., Opt. Lett. 33, 156 (2008))
+    """
+    for n_items, offset in list(zip(data.shape, offsets))[::-1]:
+        kernel = (np.arange(region_size) - offset)[:, None] * np.fft.fftfreq(n_items, upsample_factor)
+        data = np.tensordot(np.exp(-2j * np.pi * kernel), data, axes=(1, -1))
+    return data
 
-    :param vector_dict:
-    :param target:
-    :return:
+
+class PhaseCorrelationRegistration(object):
+    """
+    Translation-only registration against a fixed reference image.
+
+    The FFT of the reference is computed once, every call of register then costs one forward FFT of the moving image,
+    one inverse FFT for the integer peak and a small matrix-multiply DFT which refines the peak to 1/upsample_factor
+    pixel. Scale and rotation are assumed to be fixed, see is_translation_only.
+    """
+
+    def __init__(self, reference, upsample_factor=20):
+        self.upsample_factor = upsample_factor
+        self.set_reference(reference)
+
+    def set_reference(self, reference):
+        self.reference = reference
+        self.shape = reference.shape
+        self._reference_fft = np.fft.fft2(np.float32(reference))
+
+    def matches_reference(self, reference):
+        return reference is self.reference or (reference.shape == self.shape and np.array_equal(reference, self.reference))
+
+    def register(self, image):
+        """
+        :param image: moving image, same shape as the reference
+        :return: transform dict like imreg_dft.similarity (tvec = (ty, tx) which moves image onto the reference,
+        scale 1, angle 0, success is the height of the normalized correlation peak)
+        """
+        if image.shape != self.shape:
+            raise ValueError(f"Image shape {image.shape} does not match the reference shape {self.shape}")
+        product = self._reference_fft * np.conj(np.fft.fft2(np.float32(image)))
+        product /= np.maximum(np.abs(product), 1e-12)
+        corr = np.abs(np.fft.ifft2(product))
+        peak = np.unravel_index(np.argmax(corr), corr.shape)
+        success = float(corr[peak])
+        shifts = np.array(peak, dtype=float)
+        shape = np.array(self.shape, dtype=float)
+        shifts[shifts > np.fix(shape / 2)] -= shape[shifts > np.fix(shape / 2)]
+        if self.upsample_factor > 1:
+            # // refine in a 1.5 x 1.5 pixel window around the integer peak
+            shifts = np.round(shifts * self.upsample_factor) / self.upsample_factor
+            region_size = int(np.ceil(self.upsample_factor * 1.5))
+            dftshift = np.fix(region_size / 2.0)
+            offsets = dftshift - shifts * self.upsample_factor
+            fine = np.abs(np.conj(_upsampled_dft(np.conj(product), region_size, self.upsample_factor, offsets)))
+            fine_peak = np.unravel_index(np.argmax(fine), fine.shape)
+            shifts = shifts + (np.array(fine_peak, dtype=float) - dftshift) / self.upsample_factor
+        return {"tvec": shifts, "scale": 1.0, "angle": 0.0, "success": success,
+                "Dt": 1.0 / max(self.upsample_factor, 1), "Dscale": 0.0, "Dangle": 0.0}
+
+
+def registration_dft_translation(im0, im1, upsample_factor=20):
+    """
+    Translation-only counterpart of registration_dft_slice, see PhaseCorrelationRegistration
+    """
+    return PhaseCorrelationRegistration(im0, upsample_factor=upsample_factor).register(im1)
+
+
+def is_translation_only(im0, im1, size=256, angle_tol=0.5, scale_tol=0.01):
     """
+    Check on a downsampled copy whether two images only differ by a translation
+    :param size: larger edge of the downsampled images
+    :param angle_tol: largest rotation (degrees) which still counts as none
+    :param scale_tol: largest relative scale difference which still counts as none
+    :return: bool
+    """
+    import cv2
     import imreg_dft as ird
 
-    # // run through all channels and transform the arrays separately
-    def registration_dft_worker(
-        dset,
-        _axis=(0, 1),
-        tdict=vector_dict,
-        bgval=None,
-        order=1,
-        invert=False,
-        fast=False,
-    ):
-        # // fast transform compresses the result
-        if fast:
-            return ird.imreg.transform_img_dict(
-                dset, tdict=tdict, bgval=bgval, order=order, invert=invert
-            )
+    factor = min(size / max(im0.shape[:2]), 1.0)
+    dsize = (max(int(im0.shape[1] * factor), 1), max(int(im0.shape[0] * factor), 1))
+    a = cv2.resize(np.float32(im0), dsize, interpolation=cv2.INTER_AREA)
+    b = cv2.resize(np.float32(im1), dsize, interpolation=cv2.INTER_AREA)
+    result = ird.similarity(a, b, numiter=1)
+    return abs(result["angle"]) <= angle_tol and abs(result["scale"] - 1) <= scale_tol
+
+
+def registration_dft_pyramid(
+    im0,
+    im1,
+    iterations=5,
+    min_size=256,
+    max_similarity_size=1024,
+    order=3,
+    filter_pcorr=0,
+    exponent="inf",
+):
+    """
+    Coarse-to-fine variant of registration_dft_slice for large images.
+
+    Scale, rotation and translation are estimated with imreg_dft on the coarsest level of an image pyramid (halved
+    until the larger edge is below min_size). Every finer level up to max_similarity_size refines that estimate with a
+    single log-polar pass whose search is constrained around the previous result. At full resolution only the
+    translation is refined, by sub-pixel phase correlation of im0 with im1 warped by the estimated similarity transform,
+    which costs one FFT pair instead of the iterated log-polar passes.
+
+    :param im0: reference image
+    :param im1: image to be registered, same shape as im0
+    :param iterations: number of imreg_dft iterations on the coarsest level
+    :param min_size: larger edge of the coarsest level
+    :param max_similarity_size: levels larger than this only refine the translation
+    :return: dict like imreg_dft.similarity (tvec, scale, angle, success, Dscale, Dangle, Dt, timg)
+    """
+    import cv2
+    import imreg_dft as ird
+    from sklearn.preprocessing import normalize
+
+    im0_r = np.float32(normalize(im0))
+    im1_r = np.float32(normalize(im1))
+
+    # // levels[0] is the full resolution
+    levels = [(im0_r, im1_r)]
+    while max(levels[-1][0].shape) > min_size:
+        a, b = levels[-1]
+        size = (max(a.shape[1] // 2, 1), max(a.shape[0] // 2, 1))
+        levels.append((cv2.resize(a, size, interpolation=cv2.INTER_AREA),
+                       cv2.resize(b, size, interpolation=cv2.INTER_AREA)))
+
+    result = None
+    for k in range(len(levels) - 1, -1, -1):
+        a, b = levels[k]
+        if result is not None and max(a.shape) > max_similarity_size:
+            continue
+        if result is None:
+            result = ird.similarity(a, b, numiter=int(iterations), order=order, filter_pcorr=filter_pcorr,
+                                    exponent=exponent)
         else:
-            return transform_img_dict(dset, tdict=tdict)
-
-    return mp_worker(
-        registration_dft_worker,
-        dset=target,
-        _axis=tuple([x for x in range(target.ndim) if x != 1]),
-        tdict=vector_dict,
-        bgval=None,
-        order=1,
-        invert=False,
-    )
+            # // narrow the search to the neighbourhood of the estimate of the coarser level
+            prev_shape = levels[k + 1][0].shape
+            ratio = np.array(a.shape, dtype=float) / prev_shape
+            tvec = np.array(result["tvec"]) * ratio
+            constraints = {
+                "scale": (result["scale"], max(2 * result.get("Dscale", 0), 0.01)),
+                "angle": (result["angle"], max(2 * result.get("Dangle", 0), 0.5)),
+                "ty": (tvec[0], max(2 * ratio[0] * result.get("Dt", 0), 2.0)),
+                "tx": (tvec[1], max(2 * ratio[1] * result.get("Dt", 0), 2.0)),
+            }
+            result = ird.similarity(a, b, numiter=1, order=order, filter_pcorr=filter_pcorr, exponent=exponent,
+                                    constraints=constraints)
+        result["level_shape"] = a.shape
+
+    if result["level_shape"] != im0_r.shape:
+        ratio = np.array(im0_r.shape, dtype=float) / result["level_shape"]
+        tvec = np.array(result["tvec"]) * ratio
+        warped = warp_img_dict(im1_r, {"scale": result["scale"], "angle": result["angle"], "tvec": tvec}, order=order)
+        residual = registration_dft_translation(im0_r, warped)["tvec"]
+        result["tvec"] = tvec + residual
+        # // the similarity estimate of the finest level limits the accuracy, its uncertainty in full resolution pixels
+        result["Dt"] = result.get("Dt", 0.5) * max(ratio)
+        result["timg"] = warp_img_dict(im1_r, result, order=order)
+    del result["level_shape"]
+    return result
+
+
+def _feature_image(image, dsize):
+    # // keypoint detectors want 8 bit, a percentile stretch keeps a few hot pixels from flattening the contrast
+    import cv2
+
+    image = cv2.resize(np.float32(image), dsize, interpolation=cv2.INTER_AREA)
+    lo, hi = np.percentile(image, (1, 99))
+    return np.uint8(np.clip((image - lo) * (255.0 / max(hi - lo, 1e-12)), 0, 255))
+
+
+def registration_features(im0, im1, detector="orb", max_size=1024, n_features=5000, ratio=0.75,
+                          ransac_threshold=3.0, min_matches=10):
+    """
+    Keypoint based alternative to registration_dft_slice for pairs with little overlap or different contrast.
+
+    ORB or AKAZE keypoints are detected on copies downsampled to max_size, matched with the ratio test and a
+    similarity transform (scale, rotation, translation) is fitted to the matches with RANSAC. The keypoints are scaled
+    back to full resolution before the fit, so the result does not depend on the downsampling.
+
+    :param im0: reference image
+    :param im1: image to be registered
+    :param detector: 'orb' or 'akaze'
+    :param max_size: larger edge of the images the keypoints are detected on
+    :param n_features: most keypoints kept per image (orb only)
+    :param ratio: Lowe's ratio test threshold
+    :param ransac_threshold: largest reprojection error of an inlier in full resolution pixels
+    :param min_matches: fewer inlier matches than this count as a failed registration
+    :return: dict like imreg_dft.similarity (tvec, scale, angle, success, Dscale, Dangle, Dt, timg), success is the
+    fraction of the matches which are inliers, zero (with the identity transform) if the registration failed
+    """
+    import cv2
+
+    if detector == "akaze":
+        finder = cv2.AKAZE_create()
+    else:
+        finder = cv2.ORB_create(nfeatures=int(n_features))
+    points = []
+    descriptors = []
+    for image in (im0, im1):
+        factor = min(max_size / max(image.shape[:2]), 1.0)
+        dsize = (max(int(image.shape[1] * factor), 1), max(int(image.shape[0] * factor), 1))
+        keypoints, des = finder.detectAndCompute(_feature_image(image, dsize), None)
+        pts = np.array([k.pt for k in keypoints], dtype=np.float64).reshape(-1, 2)
+        # // binned pixel centre -> full resolution pixel centre
+        points.append((pts + 0.5) * (image.shape[1] / dsize[0], image.shape[0] / dsize[1]) - 0.5)
+        descriptors.append(des)
+
+    result = {"tvec": np.zeros(2), "scale": 1.0, "angle": 0.0, "success": 0.0, "Dscale": 0.0, "Dangle": 0.0, "Dt": 0.0}
+    if descriptors[0] is None or descriptors[1] is None or min(len(d) for d in descriptors) < 2:
+        return result
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    good = [m[0] for m in matcher.knnMatch(descriptors[1], descriptors[0], k=2)
+            if len(m) == 2 and m[0].distance < ratio * m[1].distance]
+    if len(good) < min_matches:
+        return result
+    src = np.float32([points[1][m.queryIdx] for m in good])
+    dst = np.float32([points[0][m.trainIdx] for m in good])
+    m, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=ransac_threshold)
+    if m is None or int(inliers.sum()) < min_matches:
+        return result
+
+    # // m = getRotationMatrix2D(centre, angle, scale) followed by the translation, see transform_dict_to_affine
+    h, w = im1.shape[:2]
+    centre = np.array([(w - 1) / 2, (h - 1) / 2])
+    t = m[:, :2] @ centre + m[:, 2] - centre
+    inliers = inliers.ravel().astype(bool)
+    residual = src[inliers] @ m[:, :2].T + m[:, 2] - dst[inliers]
+    result.update(tvec=np.array([t[1], t[0]]), scale=float(np.hypot(m[0, 0], m[0, 1])),
+                  angle=float(np.degrees(np.arctan2(m[0, 1], m[0, 0]))), success=float(inliers.mean()),
+                  Dt=float(np.sqrt(np.mean(np.sum(residual ** 2, axis=1)))))
+    result["timg"] = warp_img_dict(np.float32(im1), result)
+    return result
+
+
+def register_frames(im0, im1, mode="single", iterations=5, min_size=256, max_similarity_size=1024,
+                    upsample_factor=20, feature_detector="orb", feature_max_size=1024):
+    """
+    Register im1 onto im0 with one of the registration modes
+    :param mode: 'pyramid' (registration_dft_pyramid), 'single' (registration_dft_slice), 'translation'
+    (registration_dft_translation), 'features' (registration_features) or 'auto' (translation if
+    is_translation_only, pyramid otherwise)
+    :return: transform dict like imreg_dft.similarity
+    """
+    if mode == "auto":
+        mode = "translation" if is_translation_only(im0, im1) else "pyramid"
+    if mode == "translation":
+        return registration_dft_translation(im0, im1, upsample_factor=upsample_factor)
+    if mode == "features":
+        return registration_features(im0, im1, detector=feature_detector, max_size=feature_max_size)
+    if mode == "pyramid":
+        return registration_dft_pyramid(im0, im1, iterations=iterations, min_size=min_size,
+                                        max_similarity_size=max_similarity_size)
+    return registration_dft_slice(im0, im1, iterations=iterations, display=False, progressbar=None,
+                                  display_window=None)
+
+
+def apply_imreg_dft(vector_dict, target, out=None):
+    """
+    Apply dft transformation
+
+    :param vector_dict: transform dict as returned by the registration functions
+    :param target: image, the transform is applied to every 2d plane along the first two axes
+    :param out: optional preallocated output with the shape and dtype of target
+    :return: transformed array with the dtype of target
+    """
+    if out is None:
+        out = np.empty_like(target)
+    if target.ndim == 2:
+        return warp_img_dict(target, vector_dict, out=out)
+    for index in np.ndindex(*target.shape[2:]):
+        plane = (slice(None), slice(None)) + index
+        out[plane] = warp_img_dict(target[plane], vector_dict)
+    return out
 
 
 def _projection_registration_fft(image_stack, channel):
@@ -440,6 +834,69 @@ def rotate_multiple_points(p, origin=(0, 0), degrees=0):
     return np.squeeze((R @ (p.T - o.T) + o.T).T)
 
 
+class CoordinateTransform(object):
+    """
+    Affine map between two 2d coordinate frames (stage, scene/view, image or camera pixels), e.g.
+
+        to_pix = CoordinateTransform.from_components(scale=(1 / ps, -1 / ps), translation=(cx, cy), offset=stage0)
+        pix = to_pix.map(stage_points)          # N x 2 in, N x 2 out
+        stage = to_pix.inverse().map(pix)
+
+    Points are mapped with one matrix product, so transforming thousands of points costs about as much as one.
+    """
+
+    def __init__(self, matrix=None):
+        """
+        :param matrix: 3x3 homogeneous or 2x3 affine matrix acting on (x, y), identity if None
+        """
+        m = np.eye(3)
+        if matrix is not None:
+            matrix = np.asarray(matrix, dtype=np.float64)
+            m[:matrix.shape[0]] = matrix
+        self.matrix = m
+        self._inverse = None
+
+    @classmethod
+    def from_components(cls, scale=(1, 1), rotation=0, translation=(0, 0), offset=(0, 0)):
+        """
+        p' = R(rotation) * diag(scale) * (p - offset) + translation, R rotates like rotatePoint (degrees)
+        """
+        angle = np.deg2rad(rotation)
+        r = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        linear = r @ np.diag(np.broadcast_to(np.asarray(scale, dtype=np.float64), (2,)))
+        m = np.eye(3)
+        m[:2, :2] = linear
+        m[:2, 2] = np.asarray(translation, dtype=np.float64) - linear @ np.asarray(offset, dtype=np.float64)
+        return cls(m)
+
+    @classmethod
+    def from_image_item(cls, item):
+        """
+        Image pixel -> view coordinates of an image item in the field, placed by pos, _scale and loc['Rotation']
+        """
+        pos = item.pos()
+        return cls.from_components(scale=item._scale, rotation=item.loc.get('Rotation', 0), translation=(pos.x(), pos.y()))
+
+    def map(self, points):
+        """
+        :param points: one point (x, y) or an N x 2 array
+        :return: mapped points with the shape of the input
+        """
+        p = np.asarray(points, dtype=np.float64)
+        mapped = np.atleast_2d(p) @ self.matrix[:2, :2].T + self.matrix[:2, 2]
+        return mapped.reshape(p.shape)
+
+    def inverse(self):
+        if self._inverse is None:
+            self._inverse = CoordinateTransform(np.linalg.inv(self.matrix))
+            self._inverse._inverse = self
+        return self._inverse
+
+    def __matmul__(self, other):
+        # // (a @ b).map(p) == a.map(b.map(p))
+        return CoordinateTransform(self.matrix @ other.matrix)
+
+
 def unit_vector(vector):
     """Returns the unit vector of the vector."""
     return vector / np.linalg.norm(vector)
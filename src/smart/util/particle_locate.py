@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def locate_pool(max_workers=None):
+    """
+    Process pool of the locate functions. It is kept alive across calls, so the workers import trackpy only once.
+    The workers are spawned, a forked child of the Qt process may inherit locks held by other threads.
+    :param max_workers: number of processes, defaults to the number of cores, one pool is kept per value
+    :return: ProcessPoolExecutor
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with _pools_lock:
+        pool = _pools.get(max_workers)
+        # // a worker which died breaks the pool for good
+        if pool is None or getattr(pool, '_broken', False):
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+            _pools[max_workers] = pool
+        return pool
+
+
+def shutdown_locate_pools():
+    """
+    Stop the workers of all locate pools, pending jobs are cancelled
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+def tile_grid(shape, tile_size, margin):
+    """
+    Split an image into tiles which own non-overlapping core regions and are read with a margin around the core
+    :param shape: image shape
+    :param tile_size: edge of the core region
+    :param margin: width of the band read around the core
+    :return: list of (core, padded) with both as (row0, row1, col0, col1)
+    """
+    h, w = shape[:2]
+    tiles = []
+    for r0 in range(0, h, tile_size):
+        for c0 in range(0, w, tile_size):
+            core = (r0, min(r0 + tile_size, h), c0, min(c0 + tile_size, w))
+            padded = (max(core[0] - margin, 0), min(core[1] + margin, h),
+                      max(core[2] - margin, 0), min(core[3] + margin, w))
+            tiles.append((core, padded))
+    return tiles
+
+
+def _share(shape, dtype, data=None):
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+    if data is not None:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf)[:] = data
+    return shm, (shm.name, tuple(shape), np.dtype(dtype))
+
+
+def _with_shared(specs, func, *args):
+    # // the arrays only live during the call, the blocks can be closed afterwards and nothing stays mapped
+    from multiprocessing import shared_memory
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    try:
+        return func(*[np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, (_, shape, dtype) in zip(blocks, specs)],
+                    *args)
+    finally:
+        for shm in blocks:
+            shm.close()
+
+
+def _bandpass_tile(raw, out, core, padded, noise_size, smoothing_size, threshold):
+    from trackpy.preprocessing import bandpass
+    r0, r1, c0, c1 = padded
+    filtered = bandpass(raw[r0:r1, c0:c1], noise_size, smoothing_size, threshold)
+    out[core[0]:core[1], core[2]:core[3]] = filtered[core[0] - r0:core[1] - r0, core[2] - c0:core[3] - c0]
+
+
+def _refine_chunk(raw, image, radius, coords, max_iterations, engine, characterize):
+    from trackpy.refine import refine_com
+    return refine_com(raw_image=raw, image=image, radius=radius, coords=coords, max_iterations=max_iterations,
+                      engine=engine, characterize=characterize)
+
+
+def _wait(futures, abort, progress_callback, start, stop):
+    from concurrent.futures import as_completed
+    for done, future in enumerate(as_completed(futures)):
+        if abort is not None and abort():
+            for f in futures:
+                f.cancel()
+            return False
+        future.result()
+        if progress_callback:
+            progress_callback(start + (done + 1) / len(futures) * (stop - start))
+    return True
+
+
+def locate_tiled(image, tile_size=1024, margin=None, max_workers=None, min_pixels=4096 * 4096,
+                 progress_callback=None, abort=None, **kwargs):
+    """
+    trackpy.locate on large images, with the two expensive steps split across a process pool.
+
+    The steps of trackpy.locate are run one by one. The bandpass is computed on tiles which are padded by the reach
+    of its filters, so the core of every tile gets the same pixels as a bandpass of the whole image (up to the last
+    bit of the running sum of the background filter). The scaling to integers, the percentile threshold and the
+    local maxima are computed once on the whole image, and only the refinement of the maxima is split into chunks,
+    which are independent per feature. Duplicates, mass/size filters and the position error are handled on the whole
+    result as in trackpy.locate, so the features match a single call on the whole image.
+    Images below min_pixels, or a single worker, are located with trackpy.locate directly.
+
+    :param image: 2d gray image
+    :param tile_size: edge of the bandpass tile cores
+    :param margin: band around the tile cores in pixels, at least the reach of the bandpass filters
+    :param max_workers: number of processes, defaults to the number of cores
+    :param min_pixels: smaller images are located in this process, the pool does not pay off for them
+    :param progress_callback: called with the progress in percent
+    :param abort: optional callable, pending jobs are cancelled once it returns True and an empty result is returned
+    :param kwargs: passed on to trackpy.locate, diameter is required
+    :return: DataFrame with the columns of trackpy.locate
+    """
+    import trackpy as tp
+
+    workers = max_workers or os.cpu_count() or 1
+    if image.size < min_pixels or workers == 1:
+        features = tp.locate(image, **kwargs)
+        if progress_callback:
+            progress_callback(100)
+        return features
+    return _locate_parallel(image, locate_pool(max_workers), workers, int(tile_size), margin, progress_callback,
+                            abort, **kwargs)
+
+
+def _locate_parallel(raw_image, pool, workers, tile_size, tile_margin, progress_callback, abort, diameter,
+                     minmass=None, maxsize=None, separation=None, noise_size=1, smoothing_size=None, threshold=None,
+                     invert=False, percentile=64, topn=None, max_iterations=10, characterize=True, engine='auto'):
+    # // trackpy.locate step by step, keep in line with its implementation
+    import pandas as pd
+    from trackpy.find import grey_dilation, where_close
+    from trackpy.masks import N_binary_mask
+    from trackpy.preprocessing import bandpass, convert_to_int, invert_image
+    from trackpy.uncertainty import _static_error, measure_noise
+    from trackpy.utils import default_pos_columns, validate_tuple
+
+    raw_image = np.squeeze(raw_image)
+    ndim = raw_image.ndim
+    diameter = tuple(int(x) for x in validate_tuple(diameter, ndim))
+    if not all(x & 1 for x in diameter):
+        raise ValueError("Feature diameter must be an odd integer. Round up.")
+    radius = tuple(x // 2 for x in diameter)
+    if maxsize is not None and len(set(radius)) > 1:
+        raise ValueError("Filtering by size is not available for anisotropic features.")
+    separation = tuple(x + 1 for x in diameter) if separation is None else validate_tuple(separation, ndim)
+    smoothing_size = diameter if smoothing_size is None else validate_tuple(smoothing_size, ndim)
+    noise_size = validate_tuple(noise_size, ndim)
+    if minmass is None:
+        minmass = 0
+    is_float_image = not np.issubdtype(raw_image.dtype, np.integer)
+    if threshold is None:
+        threshold = 1 / 255. if is_float_image else 1
+    if invert:
+        raw_image = invert_image(raw_image)
+
+    # // gaussian truncated at 4 sigma and a boxcar with the smoothing size as edge
+    reach = max(max(int(4 * n + 0.5) for n in noise_size), max(smoothing_size)) + 1
+    tiles = tile_grid(raw_image.shape, tile_size, max(int(tile_margin or 0), reach))
+    # // the output type of the bandpass depends on the input type, a corner of the image tells it cheaply
+    bandpass_dtype = bandpass(raw_image[:2 * reach + 1, :2 * reach + 1], noise_size, smoothing_size, threshold).dtype
+    blocks = []
+    try:
+        raw_shm, raw_spec = _share(raw_image.shape, raw_image.dtype, raw_image)
+        blocks.append(raw_shm)
+        bp_shm, bp_spec = _share(raw_image.shape, bandpass_dtype)
+        blocks.append(bp_shm)
+        futures = [pool.submit(_with_shared, (raw_spec, bp_spec), _bandpass_tile, core, padded, noise_size,
+                               smoothing_size, threshold) for core, padded in tiles]
+        if not _wait(futures, abort, progress_callback, 0, 50):
+            return pd.DataFrame()
+
+        dtype = np.uint8 if is_float_image else raw_image.dtype
+        bandpassed = np.ndarray(raw_image.shape, dtype=bandpass_dtype, buffer=bp_shm.buf)
+        scale_factor, image = convert_to_int(bandpassed, dtype)
+        # // an integer bandpass is returned as is, it must not outlive the shared block
+        image = image.copy() if image is bandpassed else image
+        del bandpassed
+        margin = tuple(max(rad, sep // 2 - 1, sm // 2) for rad, sep, sm in zip(radius, separation, smoothing_size))
+        coords = grey_dilation(image, separation, percentile, margin, precise=False)
+
+        if len(coords) == 0:
+            refined_coords = _refine_chunk(raw_image, image, radius, coords, max_iterations, engine, characterize)
+        else:
+            image_shm, image_spec = _share(image.shape, image.dtype, image)
+            blocks.append(image_shm)
+            futures = [pool.submit(_with_shared, (raw_spec, image_spec), _refine_chunk, radius, chunk, max_iterations,
+                                   engine, characterize)
+                       for chunk in np.array_split(coords, min(len(coords), 4 * workers))]
+            if not _wait(futures, abort, progress_callback, 50, 100):
+                return pd.DataFrame()
+            # // chunks in the order of the maxima, as a single refine_com call would return them
+            refined_coords = pd.concat([f.result() for f in futures], ignore_index=True)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    if len(refined_coords) == 0:
+        return refined_coords
+    # // flat peaks return multiple nearby maxima
+    if np.all(np.greater(separation, 0)):
+        pos_columns = default_pos_columns(ndim)
+        to_drop = where_close(refined_coords[pos_columns], separation, refined_coords['mass'])
+        refined_coords.drop(to_drop, axis=0, inplace=True)
+        refined_coords.reset_index(drop=True, inplace=True)
+    # // mass and signal were measured on the rescaled image
+    refined_coords['mass'] *= 1. / scale_factor
+    if 'signal' in refined_coords:
+        refined_coords['signal'] *= 1. / scale_factor
+    condition = refined_coords['mass'] > minmass
+    if maxsize is not None:
+        condition &= refined_coords['size'] < maxsize
+    if not condition.all():
+        refined_coords = refined_coords.loc[condition].copy()
+    if len(refined_coords) == 0:
+        return refined_coords
+    if topn is not None and len(refined_coords) > topn:
+        mass = refined_coords['mass'].values
+        refined_coords = refined_coords.iloc[[np.argmax(mass)]] if topn == 1 else \
+            refined_coords.iloc[np.argsort(mass)[-topn:]]
+    if characterize:
+        black_level, noise = measure_noise(image, raw_image, radius)
+        mass = refined_coords['raw_mass'].values - N_binary_mask(radius, ndim) * black_level
+        ep = _static_error(mass, noise, radius, noise_size)
+        if ep.ndim == 1:
+            refined_coords['ep'] = ep
+        else:
+            ep = pd.DataFrame(ep, columns=['ep_' + c for c in default_pos_columns(ndim)])
+            refined_coords = pd.concat([refined_coords, ep], axis=1)
+    return refined_coords
+
+
+def _locate_frame_job(frame, path, kwargs):
+    import trackpy as tp
+    from ..resource.data_loaders.file_loader import load_image_array
+    from .util import array_to_gray
+
+    features = tp.locate(array_to_gray(load_image_array(path)), **kwargs)
+    features['frame'] = frame
+    return frame, features
+
+
+def locate_stack(paths, max_workers=None, progress_callback=None, frame_callback=None, status_callback=None,
+                 abort=None, **kwargs):
+    """
+    trackpy.locate on every frame of a stack in the locate pool, every worker loads its own frames
+    :param paths: image files of the frames, in time order
+    :param max_workers: number of processes, defaults to the number of cores
+    :param progress_callback: called with the progress in percent
+    :param frame_callback: called with the features of every located frame as soon as it is done, frames arrive in
+    the order they finish
+    :param status_callback: called with a message for every frame which could not be located
+    :param abort: optional callable, pending frames are cancelled once it returns True
+    :param kwargs: passed on to trackpy.locate
+    :return: DataFrame with the columns of trackpy.locate of all located frames, sorted by frame
+    """
+    import pandas as pd
+    from concurrent.futures import as_completed
+
+    results = []
+    pool = locate_pool(max_workers)
+    futures = {pool.submit(_locate_frame_job, frame, path, kwargs): frame for frame, path in enumerate(paths)}
+    for done, future in enumerate(as_completed(futures)):
+        if abort is not None and abort():
+            for f in futures:
+                f.cancel()
+            break
+        try:
+            frame, features = future.result()
+            results.append(features)
+            if frame_callback:
+                frame_callback(features)
+        except Exception as e:
+            # // an unreadable frame leaves a gap, which the linker bridges with its memory
+            if status_callback:
+                status_callback(f"Failed to locate particles in {paths[futures[future]]}: {e}")
+        finally:
+            if progress_callback:
+                progress_callback((done + 1) / len(futures) * 100)
+    if not results:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True).sort_values('frame', kind='stable').reset_index(drop=True)
+
+
+def link_trajectories(features, search_range, memory=3, **kwargs):
+    """
+    Link the features of a stack into trajectories with the trackpy linker
+    :param features: DataFrame with x, y and frame columns, see locate_stack
+    :param search_range: largest displacement of a particle between two frames in pixels
+    :param memory: number of frames a particle may vanish and still be linked to its trajectory
+    :return: features with an additional particle column holding the trajectory id
+    """
+    import trackpy as tp
+
+    if features.empty:
+        return features.assign(particle=np.array([], dtype=int))
+    return tp.link(features, search_range, memory=memory, **kwargs)
+
+
+def _drift_frame_job(path, max_size):
+    from ..resource.data_loaders.file_loader import load_image_array
+    from ..resource.database_tool.image_cache import bin_image
+    from .util import array_to_gray
+
+    image = array_to_gray(load_image_array(path))
+    factor = max(int(np.ceil(max(image.shape[:2]) / max_size)), 1)
+    return factor, np.float32(bin_image(image, factor))
+
+
+def stack_drift(paths, max_size=512, method='translation', max_workers=None, abort=None):
+    """
+    Register every frame of a stack onto its middle frame, on binned copies of the frames, see
+    geometry_transformation.register_stack
+    :param paths: image files of the frames, in time order, all of the same shape
+    :param max_size: larger edge of the binned frames
+    :param method: registration mode, see geometry_transformation.register_frames
+    :param abort: optional callable, None is returned once it returns True after the frames are loaded
+    :return: list with one 3x3 matrix per frame, mapping its full resolution pixel (x, y) onto the middle frame
+    """
+    from .geometry_transformation import register_stack, transform_dict_to_affine
+
+    binned = list(locate_pool(max_workers).map(_drift_frame_job, paths, [max_size] * len(paths)))
+    if abort is not None and abort():
+        return None
+    factor = binned[0][0]
+    frames = np.stack([frame for _, frame in binned])
+    # // binned pixel centre <-> full resolution pixel centre
+    to_full = np.array([[factor, 0, (factor - 1) / 2], [0, factor, (factor - 1) / 2], [0, 0, 1]])
+    to_binned = np.linalg.inv(to_full)
+    drift = []
+    for tdict in register_stack(frames, mode='neighbour', method=method, max_workers=max_workers):
+        m = np.eye(3)
+        m[:2] = transform_dict_to_affine(tdict, frames.shape[1:])
+        drift.append(to_full @ m @ to_binned)
+    return drift
+
+
+def subtract_drift(features, drift):
+    """
+    Positions of the features in the pixels of the reference frame of the drift, the x and y columns are kept
+    :param features: DataFrame with x, y and frame columns, see locate_stack
+    :param drift: one 3x3 matrix per frame, see stack_drift
+    :return: features with additional x_registered and y_registered columns
+    """
+    m = np.asarray(drift, dtype=float)[features['frame'].to_numpy(dtype=int)]
+    xy = np.stack([features['x'].to_numpy(dtype=float), features['y'].to_numpy(dtype=float),
+                   np.ones(len(features))], axis=1)
+    mapped = np.einsum('nij,nj->ni', m, xy)
+    return features.assign(x_registered=mapped[:, 0], y_registered=mapped[:, 1])
+
+
+class LocatePreview(object):
+    """
+    Fast trackpy.locate on a downsampled, already bandpassed copy of an image, for tuning the locate parameters.
+
+    The downsampled image is kept per source image and the bandpassed one per set of preprocessing parameters (noise
+    size, diameter, threshold, invert), so changing minmass, maxsize or separation only reruns the refinement. The
+    parameters are scaled to the downsampled pixels and the features are scaled back, the preview therefore reports
+    positions, sizes and masses in full resolution units like locate on the image itself, at a coarser precision.
+    """
+
+    def __init__(self, max_size=1024, max_entries=4):
+        """
+        :param max_size: larger edge of the downsampled image
+        :param max_entries: bandpassed images kept
+        """
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._key = None
+        self._factor = 1
+        self._small = None
+        self._bandpassed = OrderedDict()
+
+    def set_image(self, key, image_func):
+        """
+        :param key: identity of the source image, the cache is reset when it changes
+        :param image_func: callable returning the full resolution 2d gray image, only called on a change of key
+        """
+        if key == self._key and self._small is not None:
+            return
+        import cv2
+        image = np.float32(image_func())
+        self._factor = max(int(np.ceil(max(image.shape[:2]) / self.max_size)), 1)
+        if self._factor > 1:
+            dsize = (max(image.shape[1] // self._factor, 1), max(image.shape[0] // self._factor, 1))
+            image = cv2.resize(image, dsize, interpolation=cv2.INTER_AREA)
+        self._key = key
+        self._small = image
+        self._bandpassed.clear()
+
+    def _scaled_diameter(self, diameter):
+        # // trackpy wants an odd diameter of at least 3 pixels
+        d = max(int(round(diameter / self._factor)), 3)
+        return d if d % 2 else d + 1
+
+    def _bandpass(self, diameter, noise_size=1, threshold=None, invert=False):
+        import trackpy as tp
+        key = (diameter, noise_size, threshold, invert)
+        if key in self._bandpassed:
+            self._bandpassed.move_to_end(key)
+            return self._bandpassed[key]
+        image = self._small.max() - self._small if invert else self._small
+        bandpassed = tp.bandpass(image, max(noise_size / self._factor, 0.5), diameter, threshold=threshold)
+        self._bandpassed[key] = bandpassed
+        while len(self._bandpassed) > self.max_entries:
+            self._bandpassed.popitem(last=False)
+        return bandpassed
+
+    def locate(self, diameter, minmass=None, maxsize=None, noise_size=1, threshold=None, invert=False, **kwargs):
+        """
+        :param kwargs: further trackpy.locate arguments, in full resolution units where they are lengths
+        :return: DataFrame with the columns of trackpy.locate, in full resolution units
+        """
+        import trackpy as tp
+        f = self._factor
+        d = self._scaled_diameter(diameter)
+        bandpassed = self._bandpass(d, noise_size=noise_size, threshold=threshold, invert=invert)
+        if 'separation' in kwargs and kwargs['separation'] is not None:
+            kwargs['separation'] = kwargs['separation'] / f
+        # // area averaging divides the integrated brightness by f ** 2
+        features = tp.locate(bandpassed, d, minmass=None if minmass is None else minmass / f ** 2,
+                             maxsize=None if maxsize is None else maxsize / f, preprocess=False, **kwargs)
+        features['x'] = (features['x'] + 0.5) * f - 0.5
+        features['y'] = (features['y'] + 0.5) * f - 0.5
+        for column in ('mass', 'raw_mass'):
+            if column in features:
+                features[column] *= f ** 2
+        features['size'] *= f
+        return features
@@ -284,6 +284,15 @@ def qt_image_to_array(img, share_memory=False):
     else:
         return copy.deepcopy(arr)
 
+def array_to_gray(arr):
+    """ Grayscale conversion of an image array, yields the same values as
+        qt_image_to_array(QPixmap(array2qimage(arr)).toImage()) without going through a QImage.
+    """
+    arr = np.clip(arr, 0, 255).astype(np.uint8)
+    if arr.ndim == 2:
+        return arr.astype(np.float64)
+    return arr[..., 0] * 0.299 + arr[..., 1] * 0.587 + arr[..., 2] * 0.114
+
 class PandasModel(QtCore.QAbstractTableModel):
     """
     Class to populate a table view with a pandas dataframe
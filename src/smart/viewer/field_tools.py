@@ -13,7 +13,8 @@ from pyqtgraph.graphicsItems.ROI import PolyLineROI
 import weakref
 from PyQt5.QtCore import pyqtSignal as Signal
 from PyQt5.QtCore import pyqtSlot as Slot
-from ..util.geometry_transformation import rotatePoint
+from ..util.geometry_transformation import CoordinateTransform
+from .spatial_index import GridSpatialIndex
 
 
 from . import field_area_tool
@@ -92,6 +93,7 @@ class FieldViewBox(pg.ViewBox):
     fiducialMarkerAdded_sig = Signal(object)
     stagePositionTarget_sig = Signal(float,float)
     stageMoveUpdate_sig = Signal(float, float)
+    imagesSelected_sig = Signal(object)
     ## mouse modes
     #PanMode = 3
     #RectMode = 1
@@ -129,6 +131,8 @@ class FieldViewBox(pg.ViewBox):
         """
         super().__init__(parent=parent, border=border, lockAspect=lockAspect, enableMouse=enableMouse, invertY=invertY, enableMenu=enableMenu, name=name, invertX=invertX, defaultPadding=defaultPadding)
         self._parent = _parent
+        # // view space index of images, fiducial markers and rois for picking and selection
+        self.spatial_index = GridSpatialIndex()
 
         # self.rbScaleBox = QtWidgets.QGraphicsRectItem(0, 0, 1, 1)
         # self.rbScaleBox.setPen(pg.functions.mkPen((255,255,100), width=1))
@@ -210,6 +214,64 @@ class FieldViewBox(pg.ViewBox):
     def remove_item(self, item):
         self.removeItem(item)
 
+    def addItem(self, item, ignoreBounds=False):
+        pg.ViewBox.addItem(self, item, ignoreBounds=ignoreBounds)
+        if isinstance(item, pg.ROI):
+            item.sigRegionChanged.connect(self.item_geometry_changed)
+        self.item_geometry_changed(item)
+
+    def removeItem(self, item):
+        self.spatial_index.remove(item)
+        if isinstance(item, pg.ROI):
+            try:
+                item.sigRegionChanged.disconnect(self.item_geometry_changed)
+            except TypeError:
+                pass
+        pg.ViewBox.removeItem(self, item)
+
+    def item_geometry_changed(self, item):
+        """
+        Refresh the bounding box of an item in the spatial index, called whenever the item moves, rotates or scales
+        :param item: an item added to this view
+        :return:
+        """
+        if item.parentItem() is not self.childGroup:
+            # // not (or no longer) part of this view
+            return
+        if isinstance(item, pg.ImageItem):
+            tag = 'image'
+        elif isinstance(item, pg.ROI):
+            tag = 'roi'
+        else:
+            tag = 'other'
+        # // the items are children of the child group, so their parent coordinates are view coordinates
+        rect = item.mapRectToParent(item.boundingRect())
+        self.spatial_index.insert(item, (rect.left(), rect.top(), rect.right(), rect.bottom()), tag=tag)
+
+    def pick_images(self, view_point):
+        """
+        Images under a point of the view, topmost first
+        :param view_point: QPointF in view coordinates
+        :return: list of image items
+        """
+        picked = []
+        for item in self.spatial_index.query_point(view_point.x(), view_point.y(), tag='image'):
+            if item.isVisible() and item.boundingRect().contains(item.mapFromParent(view_point)):
+                picked.append(item)
+        return self._topmost_first(picked)
+
+    def images_in_rect(self, x0, y0, x1, y1):
+        """
+        Images intersecting a rectangle in view coordinates, topmost first
+        :return: list of image items
+        """
+        found = [item for item in self.spatial_index.query_rect((x0, y0, x1, y1), tag='image') if item.isVisible()]
+        return self._topmost_first(found)
+
+    def _topmost_first(self, items):
+        # // higher z first, ties like Qt stacks siblings of equal z: the item added last is drawn on top
+        return sorted(items, key=lambda item: (-item.zValue(), -self.spatial_index.sequence(item)))
+
     @Slot(str)
     def set_mode(self, mode):
         assert isinstance(mode, str)
@@ -236,7 +298,7 @@ class FieldViewBox(pg.ViewBox):
     def _scale_rotate_and_translate(self, pot):
         if self._parent.update_field_current==None:
             return False, pot
-        coords = np.array(rotatePoint([0,0], (np.array(pot)-np.array(self._parent.update_field_current.pos())) * (1/np.array(self._parent.update_field_current._scale)), -self._parent.update_field_current.loc['Rotation']))
+        coords = CoordinateTransform.from_image_item(self._parent.update_field_current).inverse().map(pot)
         coords = [int(each) for each in coords]
         return self._parent.update_field_current.isUnderMouse(), coords
     
@@ -284,12 +346,20 @@ class FieldViewBox(pg.ViewBox):
                 mousePoint = self.mapSceneToView(evt)
                 self.activeScanTool.setPoints([[x['pos'].x(),x['pos'].y()] for x in self.activeScanTool.handles[:-1]]+[[mousePoint.x(),mousePoint.y()]])
         elif self.mode=='select':
-            x, y = self.mapSceneToView(evt).x(), self.mapSceneToView(evt).y()
-            in_side_scene, coords = self._scale_rotate_and_translate([x,y])
+            view_point = self.mapSceneToView(evt)
+            x, y = view_point.x(), view_point.y()
+            picked = self.pick_images(view_point)
+            current = self._parent.update_field_current
+            in_side_scene = current is not None and current in picked
+            if in_side_scene:
+                _, coords = self._scale_rotate_and_translate([x,y])
             if not in_side_scene:
-                self._parent.statusbar.showMessage('viewport coords:'+str(self.mapSceneToView(evt)))
+                msg = 'viewport coords:'+str(view_point)
+                if len(picked)>0 and hasattr(picked[0], 'loc') and isinstance(picked[0].loc, dict):
+                    msg += ' image:'+str(picked[0].loc.get('Name', ''))
+                self._parent.statusbar.showMessage(msg)
             else:
-                self._parent.statusbar.showMessage('viewport coords:'+str(self.mapSceneToView(evt))+'obj coords:'+str(coords) + 'pix ntensity:'+str(self._parent.img_array_gray[coords[1], coords[0]]))
+                self._parent.statusbar.showMessage('viewport coords:'+str(self.mapSceneToView(evt))+'obj coords:'+str(coords) + 'pix ntensity:'+str(current.resident_gray_value(coords[1], coords[0])))
 
     def mouseDragFinishedEvent(self, ev):
         print(ev, self.mode)
@@ -329,6 +399,11 @@ class FieldViewBox(pg.ViewBox):
                     p2 = self.mapSceneToView(QtCore.QPointF(x1,y1))
                     # // emit the signal to other widgets
                     self.rectangleSelected_sig.emit(p1.x(), p1.y(), p2.x(), p2.y())
+                    # // rubber band selection of the images inside the rectangle
+                    selected = self.images_in_rect(p1.x(), p1.y(), p2.x(), p2.y())
+                    if len(selected)>0:
+                        self.select_single_image(selected)
+                    self.imagesSelected_sig.emit(selected)
                     self._parent.statusbar.showMessage("Extend of the rectangle: X(lef-right): [{:.4}:{:.4}],  Y(top-bottom): [{:.4}:{:.4}]".format(p1.x()/1000, p2.x()/1000, p1.y()/1000, p2.y()/1000))
                     #self.getdataInRect()
 
@@ -375,26 +450,8 @@ class FieldViewBox(pg.ViewBox):
                 pos = ev.scenePos()
                 view = ev.currentItem
                 view_point = view.mapToView(pos)
-                # // check outline of every image displayed and check if the viewposition lies within their outline
-                clicked_list = []
-                # // select another dataset
-                for k in self._parent.field_img:
-                    if k.isUnderMouse():
-                        clicked_list.append(k)
-                    '''
-                    if hasattr(k,'loc'):
-                        if isinstance(k.loc, dict):
-                            if "Outline" in k.loc.keys():
-                                im_pos = QtCore.QRectF(k.pos(),pg.Point(k.loc["Outline"][1], k.loc["Outline"][3]))
-                        elif isinstance(k.loc, Dataset):
-                            if "Outline" in k.loc.attrs.keys():
-                                im_pos = QtCore.QRectF(k.pos(),pg.Point(k.loc.attrs["Outline"][1], k.loc.attrs["Outline"][3]))
-                        else:
-                            continue
-                        if im_pos.contains(view_point):
-                            # // if the clicked point belongs to an image, add it to the list
-                            clicked_list.append(k)
-                    '''
+                # // look up the images whose outline contains the clicked point, topmost first
+                clicked_list = self.pick_images(view_point)
                 #print(view_point)
                 #print(clicked_list)
                 if len(clicked_list)>0:
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pyqtgraph as pg
+
+
+class ParticleOverlay(pg.ScatterPlotItem):
+    """
+    Scatter overlay of located particles, drawn from numpy arrays with a single setData call.
+
+    Up to max_points particles in the visible part of the view are drawn one marker each. Beyond that, when zoomed
+    out, the particles are binned on a grid of about cell_px screen pixels and every occupied cell is drawn as one
+    marker whose opacity follows the number of particles in it, so the cost of a redraw is bounded by the number of
+    screen cells instead of the number of particles. The particles in the visible region are found with a KD-tree,
+    and the markers are only recomputed once the view leaves the padded region of the last update or the zoom changes
+    noticeably.
+    """
+
+    def __init__(self, max_points=5000, cell_px=8, n_levels=16, color=(255, 255, 255), pen=(255, 0, 255, 255)):
+        """
+        :param max_points: most particles drawn individually
+        :param cell_px: edge of the density cells in screen pixels
+        :param n_levels: number of distinct brushes, values and densities are quantized onto them
+        :param color: rgb of the brushes, the opacity encodes the value or density
+        """
+        super().__init__(pxMode=False, pen=pg.mkPen(pen))
+        self.max_points = int(max_points)
+        self.cell_px = cell_px
+        self._brushes = np.array([pg.mkBrush(*color, int(a)) for a in np.linspace(60, 220, n_levels)], dtype=object)
+        # // underscored, pos() is the position of the QGraphicsItem
+        self._pos = np.zeros((0, 2))
+        self._sizes = np.zeros(0)
+        self._levels = np.zeros(0, dtype=int)
+        self._tree = None
+        # // (x0, y0, x1, y1, pixel size) of the last update, None if it covers all particles
+        self._drawn = None
+
+    def set_particles(self, pos, size, values=None, tree=None):
+        """
+        :param pos: (N, 2) view coordinates of the particles
+        :param size: (N,) marker diameters in view units, or one diameter for all
+        :param values: optional (N,) values like the mass, encoded in the marker opacity
+        :param tree: optional cKDTree on pos, e.g. ParticleStore.tree, built on first use if None
+        """
+        self._pos = np.asarray(pos, dtype=np.float64).reshape(-1, 2)
+        self._sizes = np.broadcast_to(np.asarray(size, dtype=np.float64), (len(self._pos),))
+        if values is None or len(self._pos) == 0:
+            self._levels = np.full(len(self._pos), len(self._brushes) // 2)
+        else:
+            values = np.asarray(values, dtype=np.float64)
+            lo, hi = np.nanmin(values), np.nanmax(values)
+            scaled = (values - lo) / (hi - lo) if hi > lo else np.full(len(values), 0.5)
+            self._levels = np.clip((scaled * len(self._brushes)).astype(int), 0, len(self._brushes) - 1)
+        self._tree = tree
+        self._drawn = None
+        self.refresh(force=True)
+
+    def _view_state(self):
+        vb = self.getViewBox()
+        if vb is None or not hasattr(vb, 'viewRect'):
+            return None
+        rect = vb.viewRect()
+        px = vb.viewPixelSize()
+        return (rect.left(), rect.top(), rect.right(), rect.bottom()), max(abs(px[0]), abs(px[1]))
+
+    def _query_rect(self, x0, y0, x1, y1):
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self._pos)
+        # // the circumscribed circle narrows the candidates, the exact test only runs on those
+        candidates = np.asarray(self._tree.query_ball_point(((x0 + x1) / 2, (y0 + y1) / 2),
+                                                            np.hypot(x1 - x0, y1 - y0) / 2), dtype=int)
+        p = self._pos[candidates]
+        return candidates[(p[:, 0] >= x0) & (p[:, 0] <= x1) & (p[:, 1] >= y0) & (p[:, 1] <= y1)]
+
+    def refresh(self, force=False):
+        state = self._view_state() if len(self._pos) > self.max_points else None
+        if state is None:
+            if force:
+                self.setData(pos=self._pos, size=self._sizes, brush=self._brushes[self._levels])
+            return
+        (x0, y0, x1, y1), px = state
+        if not force and self._drawn is not None:
+            dx0, dy0, dx1, dy1, dpx = self._drawn
+            if dx0 <= x0 and dy0 <= y0 and dx1 >= x1 and dy1 >= y1 and 2 / 3 < px / dpx < 1.5:
+                return
+        # // pad by the view size, small pans are served without recomputing
+        w, h = x1 - x0, y1 - y0
+        x0, y0, x1, y1 = x0 - w, y0 - h, x1 + w, y1 + h
+        self._drawn = (x0, y0, x1, y1, px)
+        visible = self._query_rect(x0, y0, x1, y1)
+        if len(visible) <= self.max_points:
+            self.setData(pos=self._pos[visible], size=self._sizes[visible], brush=self._brushes[self._levels[visible]])
+            return
+        cell = self.cell_px * px
+        p = self._pos[visible]
+        ij = np.floor(p / cell).astype(np.int64)
+        cells, inverse, counts = np.unique(ij, axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        centers = np.stack([np.bincount(inverse, weights=p[:, k]) for k in range(2)], axis=1) / counts[:, None]
+        density = np.log1p(counts) / np.log1p(counts.max())
+        levels = np.clip((density * len(self._brushes)).astype(int), 0, len(self._brushes) - 1)
+        self.setData(pos=centers, size=cell, brush=self._brushes[levels])
+
+    def viewRangeChanged(self):
+        super().viewRangeChanged()
+        self.refresh()
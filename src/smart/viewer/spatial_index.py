@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import math
+from collections import defaultdict
+
+
+class GridSpatialIndex(object):
+    """
+    Uniform grid over the view coordinates of the items in a FieldViewBox.
+
+    Every item is registered with its axis aligned bounding box and stored in all grid cells the box overlaps,
+    point and rectangle queries therefore only look at the items of the few cells they touch instead of every item
+    in the view. Unless it is given explicitly, the cell size is taken from the first item registered with one of the
+    seed_tags and a non-degenerate box, which suits a mosaic of similarly sized tiles. Items registered before the
+    cell size is known are checked on every query and moved into the grid once it is.
+    Every item keeps the sequence number of its first registration, so ties in the stacking order can be broken the
+    way Qt draws siblings of equal z, the one added last on top, without looking at all items.
+    """
+
+    def __init__(self, cell_size=None, max_cells_per_item=4096, seed_tags=('image',)):
+        self._initial_cell_size = cell_size
+        self.cell_size = cell_size
+        self.max_cells_per_item = max_cells_per_item
+        self.seed_tags = seed_tags
+        self._cells = defaultdict(set)
+        # // id(item) -> (item, tag, (x0, y0, x1, y1), cells)
+        self._entries = {}
+        # // id(item) -> sequence number of the first registration, kept on updates of the bounding box
+        self._sequence = {}
+        self._next_sequence = 0
+        # // items too large for the grid are checked on every query
+        self._oversized = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return id(item) in self._entries
+
+    def _cell_range(self, rect):
+        x0, y0, x1, y1 = rect
+        c = self.cell_size
+        return (math.floor(x0 / c), math.floor(y0 / c), math.floor(x1 / c), math.floor(y1 / c))
+
+    def insert(self, item, rect, tag=None):
+        """
+        Register an item or update its bounding box
+        :param item: any hashable object, usually a QGraphicsItem
+        :param rect: bounding box (x0, y0, x1, y1) in view coordinates
+        :param tag: optional label to filter queries with, e.g. 'image' or 'roi'
+        :return:
+        """
+        key = id(item)
+        sequence = self._sequence.get(key)
+        if key in self._entries:
+            tag = tag if tag is not None else self._entries[key][1]
+            self.remove(item)
+        if sequence is None:
+            sequence = self._next_sequence
+            self._next_sequence += 1
+        x0, y0, x1, y1 = rect
+        rect = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        if not all(math.isfinite(v) for v in rect):
+            return
+        self._sequence[key] = sequence
+        if self.cell_size is None:
+            if tag in self.seed_tags and rect[2] > rect[0] and rect[3] > rect[1]:
+                self.cell_size = max(rect[2] - rect[0], rect[3] - rect[1])
+                self._regrid()
+            else:
+                self._oversized.add(key)
+                self._entries[key] = (item, tag, rect, None)
+                return
+        cx0, cy0, cx1, cy1 = self._cell_range(rect)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > self.max_cells_per_item:
+            cells = None
+            self._oversized.add(key)
+        else:
+            cells = [(i, j) for i in range(cx0, cx1 + 1) for j in range(cy0, cy1 + 1)]
+            for cell in cells:
+                self._cells[cell].add(key)
+        self._entries[key] = (item, tag, rect, cells)
+
+    def _regrid(self):
+        # // move the items registered before the cell size was known into the grid
+        for key in list(self._oversized):
+            item, tag, rect, _ = self._entries[key]
+            sequence = self._sequence[key]
+            self.remove(item)
+            self._sequence[key] = sequence
+            self.insert(item, rect, tag=tag)
+
+    def remove(self, item):
+        key = id(item)
+        entry = self._entries.pop(key, None)
+        self._sequence.pop(key, None)
+        if entry is None:
+            return
+        if entry[3] is None:
+            self._oversized.discard(key)
+            return
+        for cell in entry[3]:
+            keys = self._cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._entries.clear()
+        self._oversized.clear()
+        self._sequence.clear()
+        self.cell_size = self._initial_cell_size
+
+    def sequence(self, item):
+        """
+        :return: sequence number of the first registration of an item, later registrations have higher numbers
+        """
+        return self._sequence.get(id(item), -1)
+
+    def _candidates(self, rect):
+        if self.cell_size is None:
+            return set(self._oversized)
+        cx0, cy0, cx1, cy1 = self._cell_range(rect)
+        keys = set(self._oversized)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # // the query covers more cells than are occupied, walk the occupied ones instead
+            for (i, j), cell_keys in self._cells.items():
+                if cx0 <= i <= cx1 and cy0 <= j <= cy1:
+                    keys |= cell_keys
+        else:
+            for i in range(cx0, cx1 + 1):
+                for j in range(cy0, cy1 + 1):
+                    keys |= self._cells.get((i, j), set())
+        return keys
+
+    def query_rect(self, rect, tag=None):
+        """
+        Items whose bounding box intersects a rectangle
+        :param rect: (x0, y0, x1, y1) in view coordinates
+        :param tag: only return items registered with this tag
+        :return: list of items
+        """
+        x0, y0, x1, y1 = rect
+        rect = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        found = []
+        for key in self._candidates(rect):
+            item, item_tag, (ix0, iy0, ix1, iy1), _ = self._entries[key]
+            if tag is not None and item_tag != tag:
+                continue
+            if ix0 <= rect[2] and ix1 >= rect[0] and iy0 <= rect[3] and iy1 >= rect[1]:
+                found.append(item)
+        return found
+
+    def query_point(self, x, y, tag=None):
+        """
+        Items whose bounding box contains a point
+        :param x, y: point in view coordinates
+        :param tag: only return items registered with this tag
+        :return: list of items
+        """
+        return self.query_rect((x, y, x, y), tag=tag)
@@ -0,0 +1,26 @@
+import numpy as np
+
+from smart.util.batch_registration import maximum_spanning_tree, overlap_areas
+
+
+def _placement(x0, y0, w=100, h=100):
+    return {'path': '', 'shape': (h, w), 'affine': [[1, 0, x0], [0, 1, y0]]}
+
+
+def test_overlap_areas_of_a_row_of_images():
+    areas = overlap_areas([_placement(0, 0), _placement(60, 0), _placement(120, 0), _placement(500, 500)])
+    assert areas[0, 1] == areas[1, 0] == 40 * 100
+    assert areas[1, 2] == 40 * 100
+    assert areas[0, 2] == 0 and areas[0, 0] == 0
+    assert not areas[3].any()
+
+
+def test_tree_follows_the_largest_overlaps_and_skips_isolated_images():
+    # // 0-1 and 1-2 overlap strongly, 0-2 only a little, 3 overlaps nothing
+    weights = np.array([[0, 9, 1, 0],
+                        [9, 0, 8, 0],
+                        [1, 8, 0, 0],
+                        [0, 0, 0, 0]], dtype=float)
+    assert maximum_spanning_tree(weights, 0) == {1: 0, 2: 1}
+    assert maximum_spanning_tree(weights, 2) == {1: 2, 0: 1}
+    assert maximum_spanning_tree(weights, 3) == {}
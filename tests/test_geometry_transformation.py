@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pyqtgraph')
+from smart.util.geometry_transformation import compose_transform_dict
+
+
+def test_composed_translations_add_up():
+    composed = compose_transform_dict({'tvec': (2, 3)}, {'tvec': (-1, 5), 'success': 0.5})
+    np.testing.assert_allclose(composed['tvec'], (1, 8))
+    assert composed['scale'] == 1 and composed['angle'] == 0
+    assert composed['success'] == 0.5
+
+
+def test_the_first_translation_is_rotated_and_scaled_by_the_second():
+    # // tvec is (ty, tx), a positive angle rotates counter-clockwise on screen like cv2.getRotationMatrix2D
+    composed = compose_transform_dict({'tvec': (0, 1), 'angle': 10}, {'angle': 90, 'scale': 2})
+    np.testing.assert_allclose(composed['tvec'], (-2, 0), atol=1e-12)
+    assert composed['angle'] == 100 and composed['scale'] == 2
+
+
+def _affine(tdict, shape, **kwargs):
+    from smart.util.geometry_transformation import transform_dict_to_affine
+    m = np.eye(3)
+    m[:2] = transform_dict_to_affine(tdict, shape, **kwargs)
+    return m
+
+
+def test_affine_of_a_composition_is_the_product_of_the_affines():
+    pytest.importorskip('cv2')
+    first = {'scale': 1.2, 'angle': 15, 'tvec': (3, -4)}
+    second = {'scale': 0.9, 'angle': -40, 'tvec': (-7, 2)}
+    shape = (120, 200)
+    np.testing.assert_allclose(_affine(compose_transform_dict(first, second), shape),
+                               _affine(second, shape) @ _affine(first, shape), atol=1e-9)
+
+
+def test_flips_are_applied_before_the_transform():
+    pytest.importorskip('cv2')
+    m = _affine({'tvec': (5, 1)}, (50, 80), invertx=True)
+    np.testing.assert_allclose(m @ (0, 0, 1), (80, 5, 1))
+    np.testing.assert_allclose(m @ (79, 49, 1), (1, 54, 1))
+
+
+def test_an_integer_translation_shifts_the_pixels():
+    pytest.importorskip('cv2')
+    from smart.util.geometry_transformation import warp_img_dict
+    image = np.random.default_rng(0).integers(0, 255, (40, 60)).astype(np.uint8)
+    warped = warp_img_dict(image, {'tvec': (3, -2)})
+    np.testing.assert_array_equal(warped[3:, :-2], image[:-3, 2:])
+
+
+def _smooth_image(shape, seed=0):
+    from scipy.ndimage import gaussian_filter
+    return gaussian_filter(np.random.default_rng(seed).random(shape), 3)
+
+
+def test_translation_registration_is_sub_pixel_exact():
+    from scipy.ndimage import fourier_shift
+    from smart.util.geometry_transformation import registration_dft_translation
+    im0 = _smooth_image((256, 256))
+    im1 = np.real(np.fft.ifft2(fourier_shift(np.fft.fft2(im0), (4.25, -7.5))))
+    # // tvec moves im1 back onto im0
+    np.testing.assert_allclose(registration_dft_translation(im0, im1)['tvec'], (-4.25, 7.5), atol=0.05)
+    np.testing.assert_allclose(registration_dft_translation(im0, np.roll(im0, (5, -3), axis=(0, 1)))['tvec'], (-5, 3))
+
+
+def test_pyramid_registration_undoes_a_similarity_transform():
+    cv2 = pytest.importorskip('cv2')
+    pytest.importorskip('imreg_dft')
+    pytest.importorskip('sklearn')
+    from smart.util.geometry_transformation import registration_dft_pyramid
+    im0 = np.float32(_smooth_image((600, 600), seed=1))
+    moved = np.eye(3)
+    moved[:2] = cv2.getRotationMatrix2D((299.5, 299.5), 5, 1.05)
+    moved[:2, 2] += (6, -4)
+    im1 = cv2.warpAffine(im0, moved[:2], (600, 600))
+    result = registration_dft_pyramid(im0, im1)
+    corners = np.array([[0, 599, 0, 599], [0, 0, 599, 599], [1, 1, 1, 1]])
+    # // the corners of the image land within a pixel of where they started
+    residual = (_affine(result, im0.shape) @ moved - np.eye(3)) @ corners
+    assert np.abs(residual).max() < 1
+
+
+def test_coordinate_transform_rotates_like_rotate_point():
+    from smart.util.geometry_transformation import CoordinateTransform, rotatePoint
+    t = CoordinateTransform.from_components(rotation=30, translation=(10, 20), offset=(10, 20))
+    np.testing.assert_allclose(t.map((15.0, 27.0)), rotatePoint((10, 20), (15, 27), 30))
+
+
+def test_coordinate_transform_maps_arrays_and_inverts():
+    from smart.util.geometry_transformation import CoordinateTransform
+    t = CoordinateTransform.from_components(scale=(2, -0.5), rotation=-75, translation=(3, 4), offset=(1, 1))
+    points = np.random.default_rng(0).uniform(-100, 100, (1000, 2))
+    mapped = t.map(points)
+    assert mapped.shape == points.shape
+    np.testing.assert_allclose(t.inverse().map(mapped), points, atol=1e-9)
+    # // a @ b maps with b first
+    shift = CoordinateTransform.from_components(translation=(5, 0))
+    np.testing.assert_allclose((shift @ t).map(points), mapped + (5, 0))
@@ -0,0 +1,36 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+pytest.importorskip('PyQt5')
+from smart.resource.database_tool.image_cache import ImagePreviewCache
+
+
+def _image_file(path, size=3 << 20):
+    with open(path, 'wb') as f:
+        f.write(np.random.default_rng(0).integers(0, 255, size, dtype=np.uint8).tobytes())
+    return path
+
+
+def test_a_copied_file_hits_its_entry(tmp_path):
+    cache = ImagePreviewCache(str(tmp_path / 'cache'))
+    src = _image_file(str(tmp_path / 'a.tif'))
+    cache.put(src, np.ones((300, 200), dtype=np.uint8))
+    copy = str(tmp_path / 'session' / 'a.tif')
+    os.makedirs(os.path.dirname(copy))
+    shutil.copy(src, copy)
+    entry = ImagePreviewCache(str(tmp_path / 'cache')).get(copy)
+    assert entry is not None
+    assert entry['shape'] == (300, 200)
+
+
+def test_an_edit_outside_the_first_chunks_misses(tmp_path):
+    cache = ImagePreviewCache(str(tmp_path / 'cache'))
+    path = _image_file(str(tmp_path / 'a.tif'))
+    cache.put(path, np.ones((30, 20), dtype=np.uint8))
+    with open(path, 'r+b') as f:
+        f.seek((1 << 20) + 12345)
+        f.write(b'\0\1\2')
+    assert cache.get(path) is None
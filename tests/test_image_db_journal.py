@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from smart.resource.data_writer.export_module import ImageDbJournal
+
+
+def _attrs(folder, name, x0=0, rotation=0):
+    return {'Path': os.path.join(folder, name), 'Name': name, 'Outline': [x0, x0 + 10, 0, 20, 0, 1],
+            'Rotation': rotation, 'Opacity': 100, 'Visible': True, 'StageCoords_TL': '0,0'}
+
+
+def test_replay_applies_the_records_in_order(tmp_path):
+    journal = ImageDbJournal(str(tmp_path / 'db.imagedb'))
+    journal.record('add', dict(_attrs(str(tmp_path), 'a.tif'), Parent=object()))
+    journal.record('add', _attrs(str(tmp_path), 'b.tif'))
+    journal.record('update', _attrs(str(tmp_path), 'a.tif', rotation=30))
+    journal.record('remove', _attrs(str(tmp_path), 'b.tif'))
+    assert journal.n_records == 4
+    attr_list = journal.replay([_attrs(str(tmp_path), 'c.tif')])
+    assert [d['Name'] for d in attr_list] == ['c.tif', 'a.tif']
+    assert attr_list[1]['Rotation'] == 30
+    # // runtime only entries are not journaled
+    assert 'Parent' not in attr_list[1]
+
+
+def test_a_torn_last_line_is_skipped(tmp_path):
+    journal = ImageDbJournal(str(tmp_path / 'db.imagedb'))
+    journal.record('add', _attrs(str(tmp_path), 'a.tif'))
+    with open(journal.journal_path, 'a') as f:
+        f.write('{"op": "remove", "attrs": {"Pa')
+    assert [d['Name'] for d in journal.replay([])] == ['a.tif']
+
+
+def test_compact_folds_the_journal_into_the_xml(tmp_path):
+    pytest.importorskip('lxml')
+    from smart.resource.data_loaders.file_loader import load_im_xml
+    xml_path = str(tmp_path / 'db.imagedb')
+    journal = ImageDbJournal(xml_path)
+    journal.record('add', _attrs(str(tmp_path), 'a.tif'))
+    journal.record('add', _attrs(str(tmp_path), 'b.tif', x0=100))
+    journal.compact()
+    assert not os.path.exists(journal.journal_path) and journal.n_records == 0
+    journal.record('update', _attrs(str(tmp_path), 'b.tif', x0=100, rotation=15))
+    journal.compact()
+    attr_list = load_im_xml(xml_path, exclude_file=[], progressbar=None)
+    assert [d['Name'] for d in attr_list] == ['a.tif', 'b.tif']
+    assert attr_list[1]['Rotation'] == 15
+    assert ImageDbJournal(xml_path).n_records == 0
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from smart.resource.data_writer.mosaic_export import MosaicExportAborted, MosaicStitcher
+
+
+def _stitcher(**kwargs):
+    images = {'a': np.full((40, 60), 100, dtype=np.uint8), 'b': np.full((40, 60), 200, dtype=np.uint8)}
+    placements = [{'path': 'a', 'shape': (40, 60), 'affine': [[1, 0, 0], [0, 1, 0]]},
+                  {'path': 'b', 'shape': (40, 60), 'affine': [[1, 0, 30], [0, 1, 0]]}]
+    return MosaicStitcher(placements, load_func=images.get, **kwargs)
+
+
+def test_tiles_cover_the_union_and_the_last_image_is_on_top():
+    stitcher = _stitcher(tile_size=64)
+    assert stitcher.level_shape(0) == (40, 90, 3)
+    assert stitcher.n_levels() == 2
+    left, right = stitcher.render_tile(0, 0, 0), stitcher.render_tile(0, 0, 1)
+    assert (left[10, 10] == 100).all()
+    assert (left[10, 45] == 200).all()
+    assert (right[10, 20] == 200).all()
+    # // below the images and right of the mosaic
+    assert not left[50].any() and not right[10, 40:].any()
+
+
+def test_a_binned_level_keeps_the_values():
+    stitcher = _stitcher(tile_size=64)
+    tile = stitcher.render_tile(1, 0, 0)
+    assert (tile[5, 5] == 100).all() and (tile[5, 40] == 200).all()
+
+
+def test_write_tiff_and_abort(tmp_path):
+    tifffile = pytest.importorskip('tifffile')
+    path = str(tmp_path / 'mosaic.tif')
+    progress = []
+    _stitcher(tile_size=32).write(path, progress_callback=progress.append)
+    assert progress[-1] == pytest.approx(100)
+    mosaic = tifffile.imread(path)
+    assert mosaic.shape == (40, 90, 3)
+    assert (mosaic[10, 10] == 100).all() and (mosaic[10, 80] == 200).all()
+    with pytest.raises(MosaicExportAborted):
+        _stitcher(tile_size=32).write(str(tmp_path / 'aborted.tif'), abort=lambda: True)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from smart.util.particle_locate import locate_tiled, shutdown_locate_pools, subtract_drift, tile_grid
+
+
+def test_tile_cores_cover_the_image_once():
+    shape = (1000, 700)
+    covered = np.zeros(shape, dtype=int)
+    for (r0, r1, c0, c1), (p0, p1, q0, q1) in tile_grid(shape, 256, 20):
+        covered[r0:r1, c0:c1] += 1
+        assert p0 == max(r0 - 20, 0) and p1 == min(r1 + 20, shape[0])
+        assert q0 == max(c0 - 20, 0) and q1 == min(c1 + 20, shape[1])
+    assert (covered == 1).all()
+
+
+def _spots(n=600, count=300, seed=0):
+    from scipy.ndimage import gaussian_filter
+    rng = np.random.default_rng(seed)
+    image = rng.normal(20, 5, (n, n))
+    spots = np.zeros((n, n))
+    spots[rng.integers(0, n, count), rng.integers(0, n, count)] = 2000
+    return np.clip(image + gaussian_filter(spots, 2), 0, 255).astype(np.uint8)
+
+
+def test_tiled_locate_matches_a_single_locate():
+    tp = pytest.importorskip('trackpy')
+    image = _spots()
+    kwargs = dict(diameter=11, minmass=100)
+    try:
+        # // small tiles, every feature near a tile border is found once with the same refinement
+        tiled = locate_tiled(image, tile_size=128, max_workers=2, min_pixels=0, **kwargs)
+    finally:
+        shutdown_locate_pools()
+    expected = tp.locate(image, **kwargs)
+    assert list(tiled.columns) == list(expected.columns)
+    np.testing.assert_array_equal(tiled[['y', 'x']].to_numpy(), expected[['y', 'x']].to_numpy())
+    # // the running sum of the background filter starts at the tile border, masses may differ in the last bit
+    np.testing.assert_allclose(tiled.to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+
+def test_subtract_drift_maps_every_frame_with_its_own_matrix():
+    pd = pytest.importorskip('pandas')
+    shift = np.eye(3)
+    shift[:2, 2] = (5, -2)
+    features = pd.DataFrame({'x': [1.0, 1.0, 3.0], 'y': [2.0, 2.0, 4.0], 'frame': [0, 1, 1]})
+    corrected = subtract_drift(features, [np.eye(3), shift])
+    np.testing.assert_allclose(corrected['x_registered'], [1, 6, 8])
+    np.testing.assert_allclose(corrected['y_registered'], [2, 0, 2])
+    # // the positions in the frame itself are kept for the placement in the field
+    np.testing.assert_array_equal(corrected['x'], features['x'])
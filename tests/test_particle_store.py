@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyqtgraph')
+from smart.resource.database_tool.particle_store import ParticleStore
+from smart.util.geometry_transformation import CoordinateTransform
+
+
+def test_every_frame_is_placed_with_its_own_transform():
+    df = pd.DataFrame({'x': [10.0, 10.0], 'y': [20.0, 20.0], 'frame': [0, 1], 'mass': [1.0, 2.0]})
+    transforms = [CoordinateTransform.from_components(scale=(2, 2)),
+                  CoordinateTransform.from_components(scale=(2, 2), translation=(100, -50))]
+    store = ParticleStore.from_frames(df, transforms)
+    np.testing.assert_allclose(store.view_pos, [[20, 40], [120, -10]])
+    assert store.pixel_size == pytest.approx(2)
+
+
+def _store(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return ParticleStore({'x': rng.uniform(0, 1000, n), 'y': rng.uniform(0, 500, n), 'mass': rng.uniform(0, 100, n),
+                          'size': rng.uniform(1, 3, n)}, to_view=CoordinateTransform.from_components(scale=(2, 2)))
+
+
+def test_rect_query_matches_a_scan():
+    store = _store()
+    vx, vy = store.columns['vx'], store.columns['vy']
+    expected = np.flatnonzero((vx >= 300) & (vx <= 700) & (vy >= 100) & (vy <= 250))
+    # // corners in any order
+    np.testing.assert_array_equal(store.query_rect(700, 250, 300, 100), expected)
+
+
+def test_polygon_query_only_keeps_the_particles_inside():
+    store = _store()
+    triangle = [(0, 0), (2000, 0), (0, 1000)]
+    found = store.query_polygon(triangle)
+    vx, vy = store.columns['vx'][found], store.columns['vy'][found]
+    assert len(found) and (vx / 2000 + vy / 1000 <= 1).all()
+    assert len(found) == np.count_nonzero(store.columns['vx'] / 2000 + store.columns['vy'] / 1000 < 1)
+
+
+def test_range_query_is_sorted_by_the_column():
+    store = _store()
+    found = store.query_range('mass', 20, 30)
+    mass = store.columns['mass']
+    assert set(found) == set(np.flatnonzero((mass >= 20) & (mass <= 30)))
+    assert (np.diff(mass[found]) >= 0).all()
+
+
+def test_nearest_and_diameters_are_in_view_units():
+    store = _store()
+    _, index = store.nearest(store.view_pos[7])
+    assert index == 7
+    np.testing.assert_allclose(store.view_diameters([7]), store.columns['size'][[7]] * 4)
+
+
+def test_save_and_load_keep_the_columns(tmp_path):
+    store = _store(n=50)
+    store.save(str(tmp_path / 'particles.npz'))
+    loaded = ParticleStore.load(str(tmp_path / 'particles.npz'))
+    assert loaded.pixel_size == store.pixel_size
+    for k, v in store.columns.items():
+        np.testing.assert_array_equal(loaded.columns[k], v)
@@ -0,0 +1,58 @@
+from smart.viewer.spatial_index import GridSpatialIndex
+
+
+class _Item(object):
+    pass
+
+
+def _mosaic(index, n=10, size=1000.0):
+    images = []
+    for i in range(n):
+        for j in range(n):
+            img = _Item()
+            index.insert(img, (i * size, j * size, (i + 1) * size, (j + 1) * size), tag='image')
+            images.append(img)
+    return images
+
+
+def test_images_land_in_grid_cells_after_a_degenerate_roi():
+    index = GridSpatialIndex()
+    # // the empty measure tool roi is added to the view before any image
+    roi = _Item()
+    index.insert(roi, (0, 0, 1, 1), tag='roi')
+    images = _mosaic(index)
+    assert index.cell_size == 1000.0
+    assert not index._oversized
+    assert all(index._entries[id(img)][3] for img in images)
+    assert index._entries[id(roi)][3] is not None
+    assert index.query_point(0.5, 0.5, tag='roi') == [roi]
+
+
+def test_point_query_only_returns_images_under_the_point():
+    index = GridSpatialIndex()
+    images = _mosaic(index)
+    found = index.query_point(2500.0, 3500.0, tag='image')
+    assert found == [images[2 * 10 + 3]]
+
+
+def test_clear_resets_the_cell_size():
+    index = GridSpatialIndex()
+    _mosaic(index)
+    index.clear()
+    assert index.cell_size is None
+    _mosaic(index, size=50.0)
+    assert index.cell_size == 50.0
+    assert not index._oversized
+
+
+def test_sequence_survives_moves_and_regridding():
+    index = GridSpatialIndex()
+    roi = _Item()
+    index.insert(roi, (0, 0, 1, 1), tag='roi')
+    images = _mosaic(index, n=2)
+    # // moving an image keeps its stacking rank, the roi keeps its rank when it is moved into the grid
+    index.insert(images[0], (5.0, 5.0, 1005.0, 1005.0))
+    assert [index.sequence(item) for item in [roi] + images] == [0, 1, 2, 3, 4]
+    index.remove(images[1])
+    index.insert(images[1], (0, 0, 1000, 1000), tag='image')
+    assert index.sequence(images[1]) == 5